@@ -0,0 +1,244 @@
+"""
+    Benchmarks of pyql hot paths against sqlite, results are printed & saved as JSON to compare between commits
+
+    Usage:
+        python benchmark.py                                   # :memory: db, 2000 rows, 5 repeats
+        python benchmark.py --database bench.db --rows 10000  # sqlite file
+        python benchmark.py --output before.json
+        python benchmark.py --compare before.json --output after.json
+        python benchmark.py --only select_pk insert_many
+
+    Each benchmark runs --repeat times on a new Database, rows are loaded before the timed part.
+    Results hold the min & median seconds of the timed part & ops/s of the min, see compare for
+    the regression check, which exits with 1 when a benchmark is --threshold percent slower.
+"""
+import data, argparse, json, os, platform, sqlite3, statistics, sys, tempfile, time
+
+TABLES = {
+    'departments': ([('id', int, 'UNIQUE NOT NULL'), ('name', str)], 'id'),
+    'employees': ([
+        ('id', int, 'UNIQUE NOT NULL'), ('name', str), ('department_id', int), ('salary', float), ('active', bool)
+    ], 'id'),
+    'keystore': ([('env', str, 'UNIQUE NOT NULL'), ('val', str)], 'env')
+}
+
+def employee(i):
+    return {'id': i, 'name': f'employee {i}', 'department_id': i % 10, 'salary': 1000.0 + i, 'active': i % 2 == 0}
+
+def new_database(path):
+    if not path == ':memory:' and os.path.exists(path):
+        os.remove(path)
+    return data.Database(sqlite3.connect, database=path)
+
+def create_tables(db, rows, load=True):
+    for name, (columns, prim_key) in TABLES.items():
+        db.create_table(name, columns, prim_key)
+    if not load:
+        return
+    db.tables['departments'].insert_many([{'id': i, 'name': f'department {i}'} for i in range(10)])
+    db.tables['employees'].insert_many([employee(i) for i in range(rows)])
+    db.tables['keystore'].insert_many([{'env': f'key{i}', 'val': f'value{i}'} for i in range(rows)])
+
+# benchmarks - setup(db, rows) is not timed, run(db, rows) returns the number of operations
+
+def run_insert(db, rows):
+    employees = db.tables['employees']
+    for i in range(rows):
+        employees.insert(**employee(i))
+    return rows
+
+def run_insert_many(db, rows):
+    db.tables['employees'].insert_many([employee(i) for i in range(rows)])
+    return rows
+
+def run_select_pk(db, rows):
+    employees = db.tables['employees']
+    for i in range(rows):
+        employees.select('*', where={'id': i})
+    return rows
+
+def run_select_column(db, rows):
+    # department_id is not indexed, each select scans the table
+    employees = db.tables['employees']
+    for i in range(50):
+        employees.select('id', 'name', where={'department_id': i % 10})
+    return 50
+
+def run_select_join(db, rows):
+    employees = db.tables['employees']
+    for i in range(50):
+        employees.select(
+            'employees.name', 'departments.name',
+            join={'departments': {'employees.department_id': 'departments.id'}},
+            where={'departments.id': i % 10})
+    return 50
+
+def run_select_all(db, rows):
+    return len(db.tables['employees'].select('*'))
+
+def run_iter(db, rows):
+    return sum(1 for _ in db.tables['employees'])
+
+def run_update(db, rows):
+    employees = db.tables['employees']
+    for i in range(rows):
+        employees.update(salary=2000.0 + i, where={'id': i})
+    return rows
+
+def run_update_many(db, rows):
+    db.tables['employees'].update_many([{'id': i, 'salary': 2000.0 + i} for i in range(rows)])
+    return rows
+
+def run_delete(db, rows):
+    employees = db.tables['employees']
+    for i in range(rows):
+        employees.delete(where={'id': i})
+    return rows
+
+def run_delete_many(db, rows):
+    db.tables['employees'].delete_many(range(rows))
+    return rows
+
+def run_getitem(db, rows):
+    keystore = db.tables['keystore']
+    for i in range(rows):
+        keystore[f'key{i}']
+    return rows
+
+def run_setitem(db, rows):
+    keystore = db.tables['keystore']
+    for i in range(rows):
+        keystore[f'key{i}'] = f'new value{i}'
+    return rows
+
+def setup_startup(path, tables):
+    """ file db with tables tables, as :memory: does not outlive its Database """
+    db = new_database(path)
+    for i in range(tables):
+        db.create_table(
+            f'table_{i}',
+            [('id', int, 'UNIQUE NOT NULL'), ('name', str), ('value', float), ('parent_id', int)],
+            'id',
+            indexes=[['name']])
+    db.close()
+
+# name: (run, rows loaded before run)
+BENCHMARKS = {
+    'insert': (run_insert, False),
+    'insert_many': (run_insert_many, False),
+    'select_pk': (run_select_pk, True),
+    'select_column': (run_select_column, True),
+    'select_join': (run_select_join, True),
+    'select_all': (run_select_all, True),
+    'iter': (run_iter, True),
+    'update': (run_update, True),
+    'update_many': (run_update_many, True),
+    'delete': (run_delete, True),
+    'delete_many': (run_delete_many, True),
+    'getitem': (run_getitem, True),
+    'setitem': (run_setitem, True),
+}
+
+def timed(run, repeat):
+    """ returns list of (seconds, ops) of each repeat of run(), which returns ops """
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = run()
+        results.append((time.perf_counter() - start, ops))
+    return results
+
+def summarize(results):
+    seconds = [s for s, _ in results]
+    ops = results[0][1]
+    return {
+        'ops': ops,
+        'min_s': min(seconds),
+        'median_s': statistics.median(seconds),
+        'ops_per_s': ops / min(seconds) if min(seconds) > 0 else None
+    }
+
+def run_benchmark(name, path, rows, repeat):
+    run, load = BENCHMARKS[name]
+    results = []
+    for _ in range(repeat):
+        db = new_database(path)
+        create_tables(db, rows, load)
+        results.extend(timed(lambda: run(db, rows), 1))
+        db.close()
+    return summarize(results)
+
+def run_startup(path, tables, repeat):
+    setup_startup(path, tables)
+    def startup():
+        data.Database(sqlite3.connect, database=path).close()
+        return 1
+    return summarize(timed(startup, repeat))
+
+def run_all(args):
+    names = args.only if args.only else list(BENCHMARKS) + ['startup']
+    for name in names:
+        if not name in BENCHMARKS and not name == 'startup':
+            raise data.InvalidInputError(f"unknown benchmark {name}", f"expected one of {list(BENCHMARKS) + ['startup']}")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.database if args.database == ':memory:' else os.path.join(tmp, args.database)
+        for name in names:
+            if name == 'startup':
+                results[name] = run_startup(os.path.join(tmp, 'startup.db'), args.tables, args.repeat)
+            else:
+                results[name] = run_benchmark(name, path, args.rows, args.repeat)
+            print(f"{name:<16} {results[name]['min_s']*1000:>10.2f}ms  {results[name]['ops_per_s'] or 0:>12.0f} ops/s")
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform()
+        },
+        'config': {'database': args.database, 'rows': args.rows, 'tables': args.tables, 'repeat': args.repeat},
+        'results': results
+    }
+
+def compare(baseline, current, threshold):
+    """
+        prints the change in min_s of each benchmark in both baseline & current,
+        returns names of benchmarks more than threshold percent slower
+    """
+    if not baseline['config'] == current['config']:
+        print(f"warning: config differs, baseline {baseline['config']} current {current['config']}")
+    regressions = []
+    for name, result in current['results'].items():
+        if not name in baseline['results']:
+            continue
+        before = baseline['results'][name]['min_s']
+        change = (result['min_s'] - before) / before * 100 if before > 0 else 0.0
+        if change > threshold:
+            regressions.append(name)
+        print(f"{name:<16} {before*1000:>10.2f}ms -> {result['min_s']*1000:>10.2f}ms  {change:+7.1f}%{' REGRESSION' if change > threshold else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='pyql sqlite benchmarks')
+    parser.add_argument('--database', default=':memory:', help="':memory:' or a sqlite file name, created in a temp dir")
+    parser.add_argument('--rows', type=int, default=2000, help='rows loaded & operations per benchmark')
+    parser.add_argument('--tables', type=int, default=100, help='tables of the startup benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help='names of benchmarks to run')
+    parser.add_argument('--output', help='path of the JSON results')
+    parser.add_argument('--compare', help='path of JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent slower reported as a regression')
+    args = parser.parse_args(argv)
+
+    current = run_all(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if len(compare(baseline, current, args.threshold)) > 0:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
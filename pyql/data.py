@@ -1,39 +1,740 @@
-from contextlib import contextmanager
-from collections import namedtuple
-import json, re, logging
+from contextlib import contextmanager, asynccontextmanager
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from collections import namedtuple, deque, OrderedDict
+import asyncio, bisect, contextvars, hashlib, inspect, json, os, re, logging, threading, time, weakref
 
 #Used for grouping columns with database class
 TableColumn = namedtuple('col', ['name', 'type', 'mods'])
+# column types stored as JSON text & decoded on select
+JSON_TYPES = {dict, list}
 
-def get_db_manager(db_connect):
+JsonCodec = namedtuple('JsonCodec', ['dumps', 'loads'])
+
+def get_json_codec(codec=None):
+    """
+        returns JsonCodec used to encode / decode JSON column values
+            None / 'json' - json.dumps & json.loads, NaN / Infinity & ints beyond 64 bits round trip
+            'orjson' - orjson.dumps & orjson.loads, faster but NaN / Infinity are stored as null & 
+                ints beyond 64 bits are rejected, encoded values differ from json.dumps so where 
+                conditions on JSON columns only match rows written with the same codec
+            object with .dumps(value) -> str & .loads(str) methods
+    """
+    if codec == 'orjson':
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError("json_codec='orjson' requires orjson - pip install orjson")
+        return JsonCodec(
+            lambda v: orjson.dumps(v, option=orjson.OPT_NON_STR_KEYS).decode(), 
+            orjson.loads)
+    if codec in {None, 'json'}:
+        return JsonCodec(json.dumps, json.loads)
+    if not hasattr(codec, 'dumps') or not hasattr(codec, 'loads'):
+        raise InvalidInputError(codec, "json_codec expects 'json', 'orjson' or an object with dumps & loads methods")
+    return codec
+
+class LazyRow(dict):
+    """
+        row dictionary which decodes JSON values when first accessed, see Database(..., lazy_json=True)
+        Note: dict(row) or json.dumps(row) see undecoded values, use row.decode_all() first
+    """
+    __slots__ = ('_decoders',)
+    def __init__(self, values, decoders):
+        dict.__init__(self, values)
+        self._decoders = decoders
+    def _decode(self, key):
+        decode = self._decoders.pop(key)
+        dict.__setitem__(self, key, decode(dict.__getitem__(self, key)))
+    def decode_all(self):
+        for key in list(self._decoders):
+            self._decode(key)
+        return self
+    def __getitem__(self, key):
+        if key in self._decoders:
+            self._decode(key)
+        return dict.__getitem__(self, key)
+    def __setitem__(self, key, value):
+        self._decoders.pop(key, None)
+        dict.__setitem__(self, key, value)
+    def __delitem__(self, key):
+        self._decoders.pop(key, None)
+        dict.__delitem__(self, key)
+    def update(self, *args, **kw):
+        # replaced values are not decoded
+        values = dict(*args, **kw)
+        for key in values:
+            self._decoders.pop(key, None)
+        dict.update(self, values)
+    def __ior__(self, other):
+        self.update(other)
+        return self
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    def pop(self, key, *default):
+        if key in self._decoders:
+            self._decode(key)
+        return dict.pop(self, key, *default)
+    def popitem(self):
+        key, value = dict.popitem(self)
+        decode = self._decoders.pop(key, None)
+        return key, decode(value) if decode is not None else value
+    def clear(self):
+        self._decoders.clear()
+        dict.clear(self)
+    def items(self):
+        return dict.items(self.decode_all())
+    def values(self):
+        return dict.values(self.decode_all())
+    def copy(self):
+        return dict(self.decode_all())
+    def __eq__(self, other):
+        return dict.__eq__(self.decode_all(), other)
+    def __ne__(self, other):
+        return not self == other
+    def __repr__(self):
+        return dict.__repr__(self.decode_all())
+
+# column types by name, used to store schemas in Database(..., schema_cache=path)
+COLUMN_TYPES = {t.__name__: t for t in (int, str, float, bool, bytes, dict, list)}
+
+# functions supported by Table.aggregate, result keys are named '<function>(<column>)' i.e. 'sum(qty)'
+AGGREGATE_FUNCTIONS = {'count', 'sum', 'min', 'max', 'avg'}
+
+# numpy dtype used for each column type by Table.select_columns
+NUMPY_DTYPES = {int: 'int64', float: 'float64', bool: 'bool'}
+
+# PRAGMAs run on each sqlite connection by Database(..., sqlite_profile=name)
+SQLITE_PROFILES = {
+    # WAL readers are not blocked by writers, commits fsync at checkpoints only
+    'fast': {
+        'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'mmap_size': 268435456, 
+        'cache_size': -65536, 'temp_store': 'MEMORY', 'busy_timeout': 5000
+    },
+    # WAL with an fsync on every commit
+    'safe': {
+        'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -16384, 'busy_timeout': 5000
+    },
+    # reader processes, the database is opened with mode=ro
+    'readonly': {
+        'query_only': 'true', 'mmap_size': 268435456, 'cache_size': -65536, 
+        'temp_store': 'MEMORY', 'busy_timeout': 5000
+    }
+}
+
+# upper bounds in ms of the latency histogram buckets of QueryStats, slower queries fall in a final bucket
+QUERY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# chars escaped with a backslash in mysql string literals, see mysql_literal_bytes
+MYSQL_ESCAPED = re.compile(r"['\"\\\x00\n\r\x1a]")
+
+# variables bound by a sqlite statement of Table.delete_many, SQLITE_MAX_VARIABLE_NUMBER before sqlite 3.32
+SQLITE_MAX_VARIABLES = 999
+
+# chars of a mysql TEXT column indexed by Table.create_index, mysql cannot index a whole TEXT column
+MYSQL_INDEX_PREFIX = 255
+
+# an indexed column of a sqlite CREATE INDEX, other entries are expressions
+SQLITE_INDEX_COLUMN = re.compile(
+    r'^([A-Za-z_][A-Za-z0-9_$]*|"[^"]+"|`[^`]+`|\[[^\]]+\])(\s+COLLATE\s+\S+)?(\s+(ASC|DESC))?$', re.IGNORECASE)
+
+class LRUCache:
+    """
+        Thread safe mapping which evicts the least recently used key once max_size is reached
+            ttl - seconds an entry is valid for after being set, None never expires
+
+        stats:
+            {'hits': 10, 'misses': 2, 'evictions': 0}
+    """
+    def __init__(self, max_size=512, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    def get(self, key, default=None):
+        with self._lock:
+            if not key in self._data:
+                self.stats['misses']+=1
+                return default
+            value, expires = self._data[key]
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.stats['misses']+=1
+                self.stats['evictions']+=1
+                return default
+            self._data.move_to_end(key)
+            self.stats['hits']+=1
+            return value
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl if self.ttl is not None else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.stats['evictions']+=1
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return item[0] if item is not None else default
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and (item[1] is None or item[1] >= time.monotonic())
+    def __len__(self):
+        return len(self._data)
+
+class TableMap(dict):
+    """
+        db.tables - Table by name. Tables of a Database(..., lazy_tables=True) are pending until first 
+        accessed, when load(name) is called to add them. 'name in db.tables' & iteration include pending 
+        tables, values() & items() load every table, loaded() returns only loaded tables.
+    """
+    def __init__(self, load=None):
+        super().__init__()
+        self._load = load
+        self._pending = set()
+        # changed when a table is added or replaced, SelectPlan's compiled before are compiled again
+        self.version = 0
+    def set_pending(self, names):
+        self._pending = {name for name in names if not dict.__contains__(self, name)}
+    def __missing__(self, name):
+        if name in self._pending:
+            self._load(name)
+            self._pending.discard(name)
+            if dict.__contains__(self, name):
+                return dict.__getitem__(self, name)
+        raise KeyError(name)
+    def __setitem__(self, name, table):
+        dict.__setitem__(self, name, table)
+        self._pending.discard(name)
+        self.version+=1
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self._pending
+    def __iter__(self):
+        return iter(list(dict.keys(self)) + [name for name in list(self._pending) if not dict.__contains__(self, name)])
+    def __len__(self):
+        return len(list(iter(self)))
+    def keys(self):
+        return list(iter(self))
+    def values(self):
+        return [self[name] for name in self.keys()]
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+    def loaded(self):
+        return list(dict.values(self))
+
+class QueryTimer:
+    """
+        times the phases of 1 query & reports its event to the Database hooks, slow query log & query_stats
+
+        event:
+            {'method': 'get', 'query': 'SELECT * FROM stocks WHERE symbol = ?', 'params': ['RHAT'],
+             'timings': {'connect': 0.0001, 'execute': 0.0004, 'fetch': 0.0001, 'convert': 0.0002},
+             'elapsed': 0.0008, 'rows': 2, 'error': None}
+        timings & elapsed are in seconds, time spent outside of pyql (i.e. between iter_batches) is excluded
+    """
+    __slots__ = ('database', 'event', 'mark', 'active')
+    def __init__(self, database, method, query, params):
+        self.database = database
+        self.event = {
+            'method': method, 'query': query, 'params': params, 
+            'timings': {}, 'elapsed': None, 'rows': None, 'error': None
+        }
+        database._call_hooks('before_execute', self.event)
+        self.active = 0.0
+        self.mark = time.perf_counter()
+    def phase(self, name):
+        """ adds the time since the last phase to timings[name] """
+        now = time.perf_counter()
+        timings = self.event['timings']
+        timings[name] = timings.get(name, 0.0) + now - self.mark
+        self.active+= now - self.mark
+        self.mark = now
+    def resume(self):
+        """ starts timing again, after time spent outside of pyql """
+        self.mark = time.perf_counter()
+    def done(self, rows=None):
+        self.event['elapsed'] = self.active
+        self.event['rows'] = rows
+        self.database._query_done(self.event)
+    def error(self, e):
+        self.active+= time.perf_counter() - self.mark
+        self.event['elapsed'] = self.active
+        self.event['error'] = e
+        self.database._query_error(self.event)
+
+class NullTimer:
+    """ QueryTimer used when a Database has no hooks, slow_query_ms or query_stats """
+    __slots__ = ()
+    def phase(self, name):
+        pass
+    def resume(self):
+        pass
+    def done(self, rows=None):
+        pass
+    def error(self, e):
+        pass
+NULL_TIMER = NullTimer()
+
+class QueryStats:
+    """
+        Thread safe count, errors, rows & latency histogram of each query shape, the SQL text of a query
+        with its values bound as params, so each Table.select shape shares 1 entry.
+            max_shapes - further shapes are counted under '<other>'
+
+        snapshot():
+            {'SELECT * FROM stocks WHERE symbol = ?': {
+                'count': 10, 'errors': 0, 'rows': 20, 'total_ms': 4.2, 'max_ms': 1.3, 'p50_ms': 1, 'p99_ms': 2,
+                'histogram': {1: 8, 2: 2, ..}}}
+            p50_ms / p99_ms are the upper bound of the histogram bucket containing the percentile
+    """
+    def __init__(self, buckets=QUERY_BUCKETS_MS, max_shapes=1000):
+        self.buckets = tuple(buckets)
+        self.max_shapes = max_shapes
+        self.shapes = {}
+        self._lock = threading.Lock()
+    def record(self, event):
+        ms = event['elapsed']*1000
+        bucket = bisect.bisect_left(self.buckets, ms)
+        with self._lock:
+            shape = self.shapes.get(event['query'])
+            if shape is None:
+                key = event['query'] if len(self.shapes) < self.max_shapes else '<other>'
+                shape = self.shapes.setdefault(key, {
+                    'count': 0, 'errors': 0, 'rows': 0, 'total_ms': 0.0, 'max_ms': 0.0, 
+                    'histogram': [0] * (len(self.buckets) + 1)
+                })
+            shape['count']+=1
+            shape['errors']+= event['error'] is not None
+            shape['rows']+= event['rows'] if isinstance(event['rows'], int) and event['rows'] > 0 else 0
+            shape['total_ms']+= ms
+            shape['max_ms'] = max(shape['max_ms'], ms)
+            shape['histogram'][bucket]+=1
+    def _percentile(self, histogram, count, q):
+        seen = 0
+        for i, n in enumerate(histogram):
+            seen+= n
+            if seen >= q * count:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+    def snapshot(self):
+        with self._lock:
+            shapes = {query: dict(shape, histogram=list(shape['histogram'])) for query, shape in self.shapes.items()}
+        for shape in shapes.values():
+            histogram = shape['histogram']
+            shape['p50_ms'] = self._percentile(histogram, shape['count'], 0.5)
+            shape['p99_ms'] = self._percentile(histogram, shape['count'], 0.99)
+            shape['histogram'] = {
+                bound: n for bound, n in zip(self.buckets + (float('inf'),), histogram) if n > 0
+            }
+        return shapes
+    def clear(self):
+        with self._lock:
+            self.shapes = {}
+
+class ResultCache:
+    """
+        Thread safe rows of select queries keyed by (SQL, params), each entry is tagged with the tables 
+        the query reads from & dropped by invalidate(table), see Database result_cache
+            max_size, ttl - see LRUCache, tables - only cache queries reading from these tables, None for all
+
+        stats:
+            {'hits': 10, 'misses': 2, 'evictions': 0, 'invalidations': 1}
+    """
+    def __init__(self, max_size=1024, ttl=None, tables=None):
+        self.cache = LRUCache(max_size, ttl)
+        self.stats = self.cache.stats
+        self.stats['invalidations'] = 0
+        self.tables = set(tables) if tables is not None else None
+        # keys of each table & a count of its invalidations, rows read before an invalidation are not stored
+        self._keys = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+    def caches(self, tables):
+        return self.tables is None or all(table in self.tables for table in tables)
+    def get(self, key):
+        return self.cache.get(key)
+    def generation(self, tables):
+        return tuple(self._generations.get(table, 0) for table in tables)
+    def set(self, key, tables, generation, rows):
+        with self._lock:
+            if not self.generation(tables) == generation:
+                return
+            self.cache.set(key, rows)
+            for table in tables:
+                keys = self._keys.setdefault(table, set())
+                keys.add(key)
+                if len(keys) > 2 * self.cache.max_size:
+                    # drop keys evicted from the cache
+                    self._keys[table] = {k for k in keys if k in self.cache}
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+                for key in self._keys.pop(table, ()):
+                    self.cache.pop(key)
+                self.stats['invalidations']+=1
+    def clear(self):
+        with self._lock:
+            for table in self._keys:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._keys = {}
+            self.cache.clear()
+    def __len__(self):
+        return len(self.cache)
+
+class ConnectionPool:
+    """
+        Keeps DB-API connections open between queries so each Database.get does not
+        pay for a new connect / close cycle.
+
+        min_size - connections opened when the pool is created
+        max_size - max open connections, checkouts beyond this wait up to 'timeout' seconds
+        idle_timeout - seconds an idle connection is kept before being closed, None keeps forever,
+            min_size idle connections are always kept
+        ping - seconds a connection may sit idle before it is health checked on checkout,
+            0 checks on every checkout, None disables checks
+        thread_affinity - idle connections are only handed back to the thread that created them,
+            required for sqlite3 connections (check_same_thread). max_size then applies per thread
+            and extra connections are opened (& closed on checkin) instead of waiting. A connection
+            checked in from another thread returns to the thread that checked it out
+        on_connect - callable(conn) run once on each new connection, i.e. session settings
+
+        stats:
+            db.pool.stats
+            {'checkouts': 10, 'waits': 0, 'created': 1, 'closed': 0, 'ping_failures': 0, 'in_use': 0, 'idle': 1}
+    """
+    def __init__(self, db_connect, connect_config=None, min_size=1, max_size=10, idle_timeout=300,
+            ping=None, thread_affinity=False, timeout=30, log=None, on_connect=None):
+        if max_size < 1 or min_size > max_size:
+            raise InvalidInputError(
+                f"min_size {min_size} max_size {max_size}", 
+                "pool requires max_size >= 1 and min_size <= max_size")
+        self.db_connect = db_connect
+        self.connect_config = connect_config if connect_config is not None else {}
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping = ping
+        self.thread_affinity = thread_affinity
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self.log = log if log is not None else logging.getLogger()
+        self.stats = {'checkouts': 0, 'waits': 0, 'created': 0, 'closed': 0, 'ping_failures': 0, 'in_use': 0, 'idle': 0}
+        self._lock = threading.Condition()
+        self._shared = {'idle': deque(), 'size': 0}
+        # thread_affinity - state per thread, dropped with the thread, & the owning state of each checked out connection
+        self._threads = weakref.WeakKeyDictionary()
+        self._owners = {}
+        # checked out together, so min_size connections are opened
+        conns = [self.checkout() for _ in range(min_size)]
+        for conn in conns:
+            self.checkin(conn)
+    def _state(self):
+        """ idle connections & open count visible to the calling thread """
+        if not self.thread_affinity:
+            return self._shared
+        with self._lock:
+            thread = threading.current_thread()
+            if not thread in self._threads:
+                self._threads[thread] = {'idle': deque(), 'size': 0}
+            return self._threads[thread]
+    def _owner(self, conn):
+        """ state of the thread which checked out conn, connections return to the idle list of their thread """
+        if self.thread_affinity:
+            with self._lock:
+                if id(conn) in self._owners:
+                    return self._owners.pop(id(conn))
+        return self._state()
+    def _create(self):
+        conn = self.db_connect(**self.connect_config)
+        with self._lock:
+            self.stats['created']+=1
+        if self.on_connect is not None:
+            try:
+                self.on_connect(conn)
+            except Exception:
+                self._close(conn)
+                raise
+        return conn
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            self.log.debug(f"error closing pooled connection {repr(e)}")
+        with self._lock:
+            self.stats['closed']+=1
+    def _alive(self, conn):
+        try:
+            c = conn.cursor()
+            c.execute('SELECT 1')
+            c.fetchall()
+            c.close()
+            return True
+        except Exception as e:
+            self.log.debug(f"pooled connection failed health check {repr(e)}")
+            return False
+    def checkout(self):
+        state = self._state()
+        while True:
+            conn, last_used, expired = None, None, []
+            try:
+                with self._lock:
+                    while True:
+                        now = time.monotonic()
+                        idle = state['idle']
+                        while len(idle) > self.min_size and self.idle_timeout is not None and now - idle[0][1] > self.idle_timeout:
+                            expired.append(idle.popleft()[0])
+                            state['size']-=1
+                            self.stats['idle']-=1
+                        if len(idle) > 0:
+                            conn, last_used = idle.pop()
+                            self.stats['idle']-=1
+                            break
+                        if state['size'] < self.max_size or self.thread_affinity:
+                            state['size']+=1
+                            break
+                        self.stats['waits']+=1
+                        if not self._lock.wait(self.timeout):
+                            raise PoolTimeoutError(
+                                f"no connection available after {self.timeout}s", 
+                                f"all {self.max_size} pooled connections are in use")
+                    self.stats['in_use']+=1
+            finally:
+                for expired_conn in expired:
+                    self._close(expired_conn)
+            if conn is None:
+                try:
+                    conn = self._create()
+                except Exception:
+                    self._release_slot(state)
+                    raise
+            elif self.ping is not None and time.monotonic() - last_used >= self.ping and not self._alive(conn):
+                with self._lock:
+                    self.stats['ping_failures']+=1
+                self._release_slot(state)
+                self._close(conn)
+                continue
+            with self._lock:
+                self.stats['checkouts']+=1
+                if self.thread_affinity:
+                    self._owners[id(conn)] = state
+            return conn
+    def _release_slot(self, state):
+        with self._lock:
+            state['size']-=1
+            self.stats['in_use']-=1
+            self._lock.notify()
+    def checkin(self, conn, discard=False):
+        state = self._owner(conn)
+        if not discard and len(state['idle']) < self.max_size:
+            with self._lock:
+                state['idle'].append((conn, time.monotonic()))
+                self.stats['in_use']-=1
+                self.stats['idle']+=1
+                self._lock.notify()
+            return
+        self._release_slot(state)
+        self._close(conn)
     @contextmanager
-    def connect(*args, **kwds):
-        # Code to acquire resource, e.g.:
-        conn = db_connect(*args, **kwds)
+    def connection(self):
+        conn = self.checkout()
+        discard = False
         try:
             yield conn
-        except Exception as e:
+        except Exception:
             try:
-                logging.debug(f'failed to yeild connection with params {kwds} using {db_connect} result {conn} {repr(e)}')
-            except Exception:
-                pass
-            if conn:
                 conn.rollback()
+            except Exception:
+                discard = True
+            raise
         finally:
-            if conn:
-                conn.close()
-    return connect
-def get_cursor_manager(connect_db, params={}):
-    @contextmanager
-    def cursor():
-        connect_params = params
-        with connect_db(**connect_params) as conn:
-            c = conn.cursor()
+            self.checkin(conn, discard)
+    def close(self):
+        """ closes idle connections of every thread """
+        idle = []
+        with self._lock:
+            for state in [self._shared] + list(self._threads.values()):
+                idle.extend(state['idle'])
+                state['size']-=len(state['idle'])
+                self.stats['idle']-=len(state['idle'])
+                state['idle'].clear()
+        for conn, _ in idle:
+            self._close(conn)
+async def _maybe_await(result):
+    """ awaits result when an async driver method is a coroutine, i.e. close() in aiosqlite but not aiomysql """
+    if inspect.isawaitable(result):
+        return await result
+    return result
+class AsyncConnectionPool:
+    """
+        asyncio version of ConnectionPool used by AsyncDatabase, connections may be used by any task
+        but by only 1 task at a time. Options & stats match ConnectionPool, without thread_affinity.
+    """
+    def __init__(self, db_connect, connect_config=None, min_size=1, max_size=10, idle_timeout=300,
+            ping=None, timeout=30, log=None, on_connect=None):
+        if max_size < 1 or min_size > max_size:
+            raise InvalidInputError(
+                f"min_size {min_size} max_size {max_size}", 
+                "pool requires max_size >= 1 and min_size <= max_size")
+        self.db_connect = db_connect
+        self.connect_config = connect_config if connect_config is not None else {}
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping = ping
+        self.timeout = timeout
+        self.on_connect = on_connect
+        self.log = log if log is not None else logging.getLogger()
+        self.stats = {'checkouts': 0, 'waits': 0, 'created': 0, 'closed': 0, 'ping_failures': 0, 'in_use': 0, 'idle': 0}
+        self._idle = deque()
+        self._size = 0
+        self._cond = None
+    def _condition(self):
+        # created on first use, so the pool binds to the running event loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+    async def open(self):
+        """ opens min_size connections """
+        conns = [await self.checkout() for _ in range(self.min_size - self._size)]
+        for conn in conns:
+            await self.checkin(conn)
+    async def _create(self):
+        conn = await self.db_connect(**self.connect_config)
+        self.stats['created']+=1
+        if self.on_connect is not None:
             try:
-                yield c
+                await self.on_connect(conn)
+            except Exception:
+                await self._close(conn)
+                raise
+        return conn
+    async def _close(self, conn):
+        try:
+            await _maybe_await(conn.close())
+        except Exception as e:
+            self.log.debug(f"error closing pooled connection {repr(e)}")
+        self.stats['closed']+=1
+    async def _alive(self, conn):
+        try:
+            c = await conn.cursor()
+            await c.execute('SELECT 1')
+            await c.fetchall()
+            await _maybe_await(c.close())
+            return True
+        except Exception as e:
+            self.log.debug(f"pooled connection failed health check {repr(e)}")
+            return False
+    async def checkout(self):
+        cond = self._condition()
+        while True:
+            conn, last_used, expired = None, None, []
+            try:
+                async with cond:
+                    while True:
+                        now = time.monotonic()
+                        idle = self._idle
+                        while len(idle) > self.min_size and self.idle_timeout is not None and now - idle[0][1] > self.idle_timeout:
+                            expired.append(idle.popleft()[0])
+                            self._size-=1
+                            self.stats['idle']-=1
+                        if len(idle) > 0:
+                            conn, last_used = idle.pop()
+                            self.stats['idle']-=1
+                            break
+                        if self._size < self.max_size:
+                            self._size+=1
+                            break
+                        self.stats['waits']+=1
+                        try:
+                            await asyncio.wait_for(cond.wait(), self.timeout)
+                        except asyncio.TimeoutError:
+                            raise PoolTimeoutError(
+                                f"no connection available after {self.timeout}s", 
+                                f"all {self.max_size} pooled connections are in use")
+                    self.stats['in_use']+=1
             finally:
-                conn.commit()
-    return cursor
+                for expired_conn in expired:
+                    await self._close(expired_conn)
+            if conn is None:
+                try:
+                    conn = await self._create()
+                except BaseException:
+                    await self._release_slot()
+                    raise
+            elif self.ping is not None and time.monotonic() - last_used >= self.ping and not await self._alive(conn):
+                self.stats['ping_failures']+=1
+                await self._release_slot()
+                await self._close(conn)
+                continue
+            self.stats['checkouts']+=1
+            return conn
+    async def _release_slot(self):
+        cond = self._condition()
+        async with cond:
+            self._size-=1
+            self.stats['in_use']-=1
+            cond.notify()
+    async def checkin(self, conn, discard=False):
+        if not discard and len(self._idle) < self.max_size:
+            cond = self._condition()
+            async with cond:
+                self._idle.append((conn, time.monotonic()))
+                self.stats['in_use']-=1
+                self.stats['idle']+=1
+                cond.notify()
+            return
+        await self._release_slot()
+        await self._close(conn)
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.checkout()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                await conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            await self.checkin(conn, discard)
+    async def close(self):
+        """ closes idle connections """
+        idle = list(self._idle)
+        self._idle.clear()
+        self._size-=len(idle)
+        self.stats['idle']-=len(idle)
+        for conn, _ in idle:
+            await self._close(conn)
+def mysql_literal_bytes(value):
+    """
+        estimated bytes of value as a literal of a mysql statement - UTF-8 encoded & escaped, with quotes & separator
+    """
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + len(MYSQL_ESCAPED.findall(value)) + 3
+    if isinstance(value, (bytes, bytearray)):
+        # blobs may be escaped or sent as hex, either at most 2 bytes per byte
+        return 2 * len(value) + 10
+    return 12
+@lru_cache(maxsize=256)
+def get_row_class(keys):
+    """
+        namedtuple class for rows with keys, shared by queries selecting the same keys
+    """
+    return namedtuple('Row', [key.replace('.', '_') for key in keys], rename=True)
 def flatten(s):
     return re.sub('\n',' ', s)
 def no_blanks(s):
@@ -55,6 +756,206 @@ def inner(s, l='(', r=')'):
                 inside['right'] = ind
     return s[inside['left']+1:inside['right']]
 
+def describe_table_to_col_sqlite(col_config):
+    config = []
+    for i in ' '.join(col_config.split(',')).split(' '):
+        if not i == '' and not i == '\n':
+            config.append(i.rstrip())
+    TYPE_TRANSLATE = {
+        'varchar': str,
+        'integer': int,
+        'text': str,
+        'real': float,
+        'boolean': bool,
+        'blob': bytes,
+        'json': dict
+    }
+    field, typ, extra = config[0], config[1], ' '.join(config[2:])
+    return TableColumn(
+        field, 
+        TYPE_TRANSLATE[typ.lower() if not 'VARCHAR' in typ else 'varchar'], 
+        extra)
+def parse_sqlite_schema(name, schema):
+    """
+        returns (columns, primary_key, foreign_keys) from the CREATE TABLE schema of sqlite table name
+    """
+    config = schema.split(f'CREATE TABLE {name}')[1]
+    config = flatten(config)
+    col_config = inner(config).split(', ')
+    cols_in_table = []
+    foreign_keys = None
+    for cfg in col_config:
+        if not 'FOREIGN KEY' in cfg:
+            cols_in_table.append(describe_table_to_col_sqlite(cfg))
+        else:
+            if foreign_keys == None:
+                foreign_keys = {}
+            local_key, ref = cfg.split('FOREIGN KEY')[1].split('REFERENCES')
+            local_key = inner(local_key)
+            parent_table, mods = ref.split(')')
+            parent_table, parent_key = parent_table.split('(')
+            foreign_keys[no_blanks(local_key)] = {
+                        'table': no_blanks(parent_table), 
+                        'ref': no_blanks(parent_key),
+                        'mods': mods.rstrip()
+                    }
+    primary_key = None
+    for col_item in cols_in_table: 
+        if 'PRIMARY KEY' in col_item.mods.upper():
+            primary_key = col_item.name
+    return cols_in_table, primary_key, foreign_keys
+def describe_table_to_col(column):
+    TYPE_TRANSLATE = {'tinyint': bool, 'int': int, 'text': str, 'double': float, 'varchar': str, 'json': dict}
+    config = []
+    for i in ' '.join(column.split(',')).split(' '):
+        if not i == '' and not i == '\n':
+            config.append(i.rstrip())
+    column = config
+    field = inner(column[0], '`','`')
+    typ = None
+    for k, v in TYPE_TRANSLATE.items():
+        if k in column[1]:
+            typ = v
+            break
+    if typ == None:
+        raise InvalidColumnType(column[1], f"invalid type provided for column, supported types {list(TYPE_TRANSLATE.keys())}")
+    """
+    Null = 'NOT NULL ' if column[2] == 'NO' else ''
+    Key = 'PRIMARY KEY ' if column[3] == 'PRI' else ''
+    Default = '' # TOODOO - check if this needs implementing
+    """
+    extra = ' '.join(column[2:])
+    return TableColumn(field, typ, extra)
+def parse_mysql_schema(table, schema):
+    """
+        returns (columns, primary_key, foreign_keys) from the 'show create table' schema of mysql table
+    """
+    schema = flatten(schema.split(f'CREATE TABLE `{table}`')[1])
+    col_config = inner(schema).split(', ')
+    cols_in_table = []
+    primary_key = None
+    foreign_keys = None
+    for cfg in col_config:
+        if not 'FOREIGN KEY' in cfg:
+            if not 'PRIMARY KEY' in cfg:
+                if not 'KEY' in cfg:
+                    cols_in_table.append(describe_table_to_col(cfg))
+            else:
+                primary_key = inner(inner(cfg.split('PRIMARY KEY')[1]), '`', '`')
+        else:
+            if foreign_keys == None:
+                foreign_keys = {}
+            local_key, ref = cfg.split('FOREIGN KEY')[1].split('REFERENCES')
+            local_key = inner(inner(local_key), '`', '`')
+            parent_table, mods = ref.split(')')
+            parent_table, parent_key = parent_table.split('(')
+            foreign_keys[no_blanks(local_key)] = {
+                        'table': no_blanks(inner(parent_table, '`', '`')), 
+                        'ref': no_blanks(inner(parent_key, '`', '`')),
+                        'mods': mods.rstrip()
+                    }
+    return cols_in_table, primary_key, foreign_keys
+
+
+def parse_sqlite_master(rows, names=None):
+    """
+        returns {table: (columns, primary_key, foreign_keys, indexes)} from (type, name, tbl_name, sql) rows of sqlite_master
+            names - only parse these tables
+    """
+    tables, indexes = {}, {}
+    for typ, name, tbl_name, sql in rows:
+        if sql is None or (names is not None and not tbl_name in names):
+            continue
+        if typ == 'index':
+            if not tbl_name in indexes:
+                indexes[tbl_name] = {}
+            indexes[tbl_name][name] = parse_sqlite_index(sql)
+        elif typ == 'table' and not name.startswith('sqlite_'):
+            tables[name] = parse_sqlite_schema(name, sql)
+    return {name: (*schema, indexes[name] if name in indexes else {}) for name, schema in tables.items()}
+def parse_mysql_tables(schemas, index_rows):
+    """
+        returns {table: (columns, primary_key, foreign_keys, indexes)} from {table: 'show create table' schema} &
+        information_schema.STATISTICS rows of (TABLE_NAME, NON_UNIQUE, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME)
+    """
+    table_index_rows = {}
+    for row in index_rows:
+        if not row[0] in table_index_rows:
+            table_index_rows[row[0]] = []
+        table_index_rows[row[0]].append(row)
+    return {
+        inner(table, '`', '`'): (
+            *parse_mysql_schema(table, schema), 
+            parse_mysql_indexes(table_index_rows[table] if table in table_index_rows else [])
+        ) for table, schema in schemas.items()
+    }
+def schema_to_json(schema):
+    """
+        {table: (columns, primary_key, foreign_keys, indexes)} -> JSON serializable dict, see schema_from_json
+    """
+    return {
+        name: {
+            'columns': [[column.name, column.type.__name__, column.mods] for column in columns],
+            'prim_key': prim_key, 'foreign_keys': foreign_keys, 'indexes': indexes
+        } for name, (columns, prim_key, foreign_keys, indexes) in schema.items()
+    }
+def schema_from_json(tables):
+    return {
+        name: (
+            [TableColumn(col_name, COLUMN_TYPES[col_type], mods) for col_name, col_type, mods in table['columns']],
+            table['prim_key'], table['foreign_keys'], table['indexes']
+        ) for name, table in tables.items()
+    }
+def parse_sqlite_index(sql):
+    """
+        returns {'columns': [..], 'unique': bool} of a sqlite CREATE INDEX statement
+            expressions i.e lower(name) are None in columns, as in PRAGMA index_info
+            partial indexes add the 'where' predicate, i.e {'columns': ['qty'], 'unique': False, 'where': 'qty > 0'}
+    """
+    # split the indexed columns at commas outside of parentheses & quotes, up to the closing parenthesis
+    start = sql.index('(')
+    items, item, depth, quote, end = [], '', 0, None, len(sql)
+    for ind in range(start + 1, len(sql)):
+        t = sql[ind]
+        if quote is not None:
+            quote = None if t == quote else quote
+        elif t in '\'"`[':
+            quote = ']' if t == '[' else t
+        elif t == '(':
+            depth+=1
+        elif t == ')' and depth == 0:
+            end = ind
+            break
+        elif t == ')':
+            depth-=1
+        elif t == ',' and depth == 0:
+            items.append(item)
+            item = ''
+            continue
+        item+=t
+    items.append(item)
+    columns = []
+    for item in items:
+        match = SQLITE_INDEX_COLUMN.match(item.strip())
+        columns.append(match.group(1).strip('`"[]') if match else None)
+    index = {'columns': columns, 'unique': sql.upper().startswith('CREATE UNIQUE')}
+    where = sql[end + 1:].strip()
+    if where[:5].upper() == 'WHERE':
+        index['where'] = where[5:].strip()
+    return index
+def parse_mysql_indexes(rows):
+    """
+        returns {name: {'columns': [..], 'unique': bool}} of SHOW INDEX rows, excluding the PRIMARY key
+    """
+    indexes = {}
+    for row in sorted(rows, key=lambda row: (row[2], row[3])):
+        non_unique, name, column = row[1], row[2], row[4]
+        if name == 'PRIMARY':
+            continue
+        if not name in indexes:
+            indexes[name] = {'columns': [], 'unique': not int(non_unique)}
+        indexes[name]['columns'].append(column)
+    return indexes
 
 class Database:
     """
@@ -66,9 +967,51 @@ class Database:
         mysql example:
             import mysql.connector
             db = Database(mysql.connector.connect, **config)
-        
+
+        connections are re-used via a ConnectionPool (db.pool), tuned with:
+            pool_min_size=1, pool_max_size=10, pool_idle_timeout=300, pool_timeout=30,
+            pool_ping=10 (None for sqlite), pool_thread_affinity=True (sqlite only)
+
+        autocommit=False - queries on a thread share 1 connection until db.commit() or db.rollback()
+
+        session_init=[] - SQL statements or callable(conn) run once on each new connection, i.e.
+            ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL'] or ["SET SESSION sql_mode='STRICT_ALL_TABLES'"]
+            sqlite tables with foreign keys add 'PRAGMA foreign_keys=true'
+        sqlite_profile=None|'fast'|'safe'|'readonly'|{pragma: value} - PRAGMAs added to session_init, see SQLITE_PROFILES
+            'readonly' also opens the database file with mode=ro
+
+        JSON columns (type dict or list) are encoded / decoded with json_codec - see get_json_codec
+            json_codec=None|'json'|'orjson'|codec, lazy_json=False - decode when a row value is first accessed
+            json_detect=True - also decode str column values which look like JSON objects
+
+        a Database may be shared between threads, each thread uses its own pooled connection.
+            max_workers=pool_max_size - threads of db.executor, used by db.submit & Table.select_async_futures
+
+        query instrumentation, queries are not timed unless one of these is set - see QueryTimer:
+            before_execute=None, after_execute=None, on_error=None - callable(event) or a list, see add_hook
+            slow_query_ms=None - queries taking at least slow_query_ms are logged & kept in db.slow_queries
+            query_stats=False - count & latency histogram per query shape, see db.query_stats.snapshot()
+
+        result_cache=None|True|{'max_size': 1024, 'ttl': None, 'tables': None} - rows of Table.select / aggregate 
+            by SQL & params, invalidated by writes of pyql to the selected or joined tables, see db.invalidate
+            queries within a transaction are not cached
+
     """
     def __init__(self, db_con, **kw):
+        self._configure(db_con, kw)
+        thread_affinity = kw['pool_thread_affinity'] if 'pool_thread_affinity' in kw else self.type == 'sqlite'
+        if self.type == 'sqlite' and not thread_affinity:
+            # pooled connections move between threads, which sqlite3 rejects by default
+            self.connect_config['check_same_thread'] = False
+        self.pool = ConnectionPool(
+            self.db_con,
+            self.connect_config,
+            thread_affinity=thread_affinity,
+            **self._pool_config(kw)
+        )
+        self.connect = self.pool.connection
+        self.load_tables()
+    def _configure(self, db_con, kw):
         self.debug = 'DEBUG' if 'debug' in kw else None
         self.log = kw['logger'] if 'logger' in kw else None
         self.setup_logger(self.log, level=self.debug)
@@ -82,18 +1025,105 @@ class Database:
         if not 'database' in kw:
             raise InvalidInputError(kw, "missing field for 'database'")
         self.db_name = kw['database']
-        self.connect = get_db_manager(self.db_con)
-        self.cursor = get_cursor_manager(self.connect, self.connect_config)
+        # placeholder used for query parameters by the db driver
+        self.param = '?' if self.type == 'sqlite' else '%s'
+        # generated SQL text, keyed by table & query shape
+        self.sql_cache = LRUCache(kw['sql_cache_size'] if 'sql_cache_size' in kw else 512)
+        # compiled SelectPlan's of Table.select, keyed by table, selection & join
+        self.plan_cache = LRUCache(kw['plan_cache_size'] if 'plan_cache_size' in kw else 256)
+        self.max_packet = kw['max_allowed_packet'] if 'max_allowed_packet' in kw else None
+        self.json_codec = get_json_codec(kw['json_codec'] if 'json_codec' in kw else None)
+        # json_detect - decode str column values which look like JSON objects, JSON_TYPES columns are always decoded
+        self.json_detect = kw['json_detect'] if 'json_detect' in kw else True
+        self.lazy_json = kw['lazy_json'] if 'lazy_json' in kw else False
+        # autocommit=False keeps a connection per thread until db.commit() / db.rollback()
+        self.autocommit = kw['autocommit'] if 'autocommit' in kw else True
+        self._local = threading.local()
+        # guards tables, session_init & executor, which may be changed by any thread
+        self._lock = threading.RLock()
+        self.max_workers = kw['max_workers'] if 'max_workers' in kw else None
+        self._executor = None
         if self.type == 'sqlite':
             self.foreign_keys = False
-        self.pre_query = [] # SQL commands Ran before each for self.get self.run query 
-        self.tables = {}
-        self.load_tables()
+        # SQL / callable(conn) run once on each new pooled connection, replaced (not appended) on change
+        self.session_init = list(kw['session_init']) if 'session_init' in kw else []
+        if 'sqlite_profile' in kw and kw['sqlite_profile'] is not None:
+            self._sqlite_profile(kw['sqlite_profile'])
+        # schema_cache - JSON file of introspected tables, reused while the db schema checksum is unchanged
+        self.schema_cache = kw['schema_cache'] if 'schema_cache' in kw else None
+        # lazy_tables - tables are introspected on first access of db.tables[name]
+        self.lazy_tables = kw['lazy_tables'] if 'lazy_tables' in kw else False
+        self.tables = TableMap(self._load_lazy_table)
+        # callbacks by event, replaced (not appended) on change - see add_hook
+        self.hooks = {event: [] for event in ('before_execute', 'after_execute', 'on_error')}
+        for event in self.hooks:
+            if event in kw and kw[event] is not None:
+                self.hooks[event] = list(kw[event]) if isinstance(kw[event], (list, tuple)) else [kw[event]]
+        self._hooked = any(self.hooks.values())
+        self.slow_query_ms = kw['slow_query_ms'] if 'slow_query_ms' in kw else None
+        self.slow_queries = deque(maxlen=kw['slow_query_log_size'] if 'slow_query_log_size' in kw else 100)
+        self.query_stats = QueryStats() if 'query_stats' in kw and kw['query_stats'] else None
+        # result_cache=True or {'max_size': 1024, 'ttl': None, 'tables': None} - see ResultCache
+        result_cache = kw['result_cache'] if 'result_cache' in kw else None
+        self.result_cache = None
+        if result_cache:
+            self.result_cache = ResultCache(**(result_cache if isinstance(result_cache, dict) else {}))
+    def _sqlite_profile(self, profile):
+        """
+            adds PRAGMAs of profile, a SQLITE_PROFILES name or {pragma: value}, before session_init
+        """
+        if not self.type == 'sqlite':
+            raise InvalidInputError(f"sqlite_profile {profile} used with {self.type}", "sqlite_profile is only supported for sqlite")
+        if isinstance(profile, str):
+            if not profile in SQLITE_PROFILES:
+                raise InvalidInputError(f"invalid sqlite_profile {profile}", f"expected one of {list(SQLITE_PROFILES)} or a dict of PRAGMAs")
+            if profile == 'readonly':
+                database = self.connect_config['database']
+                if not database.startswith('file:'):
+                    database = f"file:{database}"
+                self.connect_config['database'] = f"{database}{'&' if '?' in database else '?'}mode=ro"
+                self.connect_config['uri'] = True
+            profile = SQLITE_PROFILES[profile]
+        self.session_init = [f"PRAGMA {pragma}={value}" for pragma, value in profile.items()] + self.session_init
+    def _pool_config(self, kw):
+        return dict(
+            min_size=kw['pool_min_size'] if 'pool_min_size' in kw else 1,
+            max_size=kw['pool_max_size'] if 'pool_max_size' in kw else 10,
+            idle_timeout=kw['pool_idle_timeout'] if 'pool_idle_timeout' in kw else 300,
+            ping=kw['pool_ping'] if 'pool_ping' in kw else (None if self.type == 'sqlite' else 10),
+            timeout=kw['pool_timeout'] if 'pool_timeout' in kw else 30,
+            log=self.log,
+            on_connect=self._init_session
+        )
+    def _init_session(self, conn):
+        """
+            runs session_init on new pooled connection conn
+        """
+        if len(self.session_init) == 0:
+            return
+        c = conn.cursor()
+        try:
+            for statement in self.session_init:
+                if callable(statement):
+                    statement(conn)
+                    continue
+                c.execute(statement)
+                if c.description is not None:
+                    c.fetchall()
+        finally:
+            c.close()
+        conn.commit()
     def __contains__(self, table):
+        return self.has_table(table)
+    def _has_table_query(self):
         if self.type == 'sqlite':
-            return table in [i[0] for i in self.get("select name, sql from sqlite_master where type = 'table'")]
-        else:
-            return table in [i[0] for i in self.get("show tables")]
+            return f"select name from sqlite_master where type = 'table' and name = {self.param}"
+        return f"SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = {self.param}"
+    def has_table(self, table):
+        """
+            True if table exists in the db, also 'table' in db
+        """
+        return len(self.get(self._has_table_query(), [table]) or []) > 0
     def setup_logger(self, logger=None, level=None):
         if logger == None:
             level = logging.DEBUG if level == 'DEBUG' else logging.ERROR
@@ -106,138 +1136,567 @@ class Database:
             self.log.setLevel(level)
         else:
             self.log = logger
+    def add_hook(self, event, callback):
+        """
+        calls callback(event) for each query, see QueryTimer for the event
+            before_execute - before the query is sent, event holds method, query & params
+            after_execute - once rows are fetched & converted, with timings, elapsed & rows
+            on_error - when the query raises, with error
+        Usage:
+            db.add_hook('after_execute', lambda e: print(e['query'], e['elapsed']))
+        hooks are called on the thread running the query, exceptions raised by a hook are logged
+        """
+        if not event in self.hooks:
+            raise InvalidInputError(f"invalid hook event {event}", f"expected one of {list(self.hooks)}")
+        with self._lock:
+            self.hooks = dict(self.hooks, **{event: self.hooks[event] + [callback]})
+            self._hooked = True
+    def remove_hook(self, event, callback):
+        with self._lock:
+            if event in self.hooks and callback in self.hooks[event]:
+                self.hooks = dict(self.hooks, **{event: [hook for hook in self.hooks[event] if not hook == callback]})
+            self._hooked = any(self.hooks.values())
+    def _call_hooks(self, event_name, event):
+        for hook in self.hooks[event_name]:
+            try:
+                hook(event)
+            except Exception as e:
+                self.log.exception(f"exception in {event_name} hook {repr(e)}")
+    def _timer(self, method, query, params):
+        if not self._hooked and self.slow_query_ms is None and self.query_stats is None:
+            return NULL_TIMER
+        return QueryTimer(self, method, query, params)
+    def _query_done(self, event):
+        if self.query_stats is not None:
+            self.query_stats.record(event)
+        if self.slow_query_ms is not None and event['elapsed']*1000 >= self.slow_query_ms:
+            self.slow_queries.append(event)
+            if self.log.isEnabledFor(logging.WARNING):
+                timings = ' '.join(f"{phase}={t*1000:.2f}ms" for phase, t in event['timings'].items())
+                self.log.warning(
+                    f"{self.db_name} slow query {event['elapsed']*1000:.2f}ms rows: {event['rows']} {timings} "
+                    f"{event['method']}: {event['query']}")
+        self._call_hooks('after_execute', event)
+    def _query_error(self, event):
+        if self.query_stats is not None:
+            self.query_stats.record(event)
+        self._call_hooks('on_error', event)
+
+    @contextmanager
+    def cursor(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None and not self.autocommit:
+            conn = self._pin(self.pool.checkout())
+        if conn is not None:
+            # commit is deferred to the end of db.transaction() or db.commit()
+            c = conn.cursor()
+            try:
+                yield c
+            finally:
+                c.close()
+            return
+        with self.connect() as conn:
+            c = conn.cursor()
+            try:
+                yield c
+                conn.commit()
+            finally:
+                c.close()
+    def _pin(self, conn):
+        """ binds conn to the calling thread, used for all queries until unpinned """
+        self._local.conn = conn
+        self._local.depth = 0
+        # tables written on conn, invalidated again once committed / rolled back
+        self._local.written = set()
+        return conn
+    def _unpin(self, discard=False):
+        conn = self._local.conn
+        self._local.conn = None
+        self.pool.checkin(conn, discard)
+        self._invalidate_written(self._local.written)
+    def _written_tables(self):
+        return self._local.written if self.in_transaction() else None
+    def in_transaction(self):
+        return getattr(self._local, 'conn', None) is not None
+    @contextmanager
+    def transaction(self):
+        """
+        Usage:
+            with db.transaction():
+                db.tables['stocks'].insert(**trade)
+                db.tables['stocks'].update(qty=50, where={'order_num': 1})
+            # committed once on exit, rolled back if an exception is raised
 
-    def run(self, query):
-        return self.get(query)
-    def get(self, query):
-        query = f"{';'.join(self.pre_query + [query])}"
-        self.log.debug(f'{self.db_name}.get query: {query}')
+            with db.transaction():
+                db.tables['stocks'].insert(**trade)
+                with db.transaction(): # nested blocks use savepoints
+                    db.tables['stocks'].delete(where={'order_num': 1})
+        """
+        local = self._local
+        owner = not self.in_transaction()
+        if owner:
+            self._pin(self.pool.checkout())
+        conn = local.conn
+        savepoint = None if owner else f"pyql_savepoint_{local.depth}"
+        def execute(statement):
+            c = conn.cursor()
+            try:
+                c.execute(statement)
+            finally:
+                c.close()
+        try:
+            execute(f"SAVEPOINT {savepoint}" if savepoint else 'BEGIN' if self.type == 'sqlite' else 'START TRANSACTION')
+        except Exception:
+            if owner:
+                self._unpin(discard=True)
+            raise
+        local.depth+=1
+        try:
+            yield self
+        except BaseException:
+            local.depth-=1
+            self.clear_caches()
+            if owner:
+                discard = False
+                try:
+                    conn.rollback()
+                except Exception as e:
+                    self.log.exception(f"exception rolling back transaction {repr(e)}")
+                    discard = True
+                self._unpin(discard)
+            else:
+                execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                execute(f"RELEASE SAVEPOINT {savepoint}")
+            raise
+        local.depth-=1
+        if not owner:
+            execute(f"RELEASE SAVEPOINT {savepoint}")
+            return
+        try:
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._unpin()
+    def clear_caches(self):
+        """
+            clears cached rows of every table & the result_cache, i.e after a rollback or writes made outside of pyql
+        """
+        for table in self.tables.loaded():
+            if table.cache is not None:
+                table.cache.clear()
+        if self.result_cache is not None:
+            self.result_cache.clear()
+    def invalidate(self, *tables):
+        """
+        drops result_cache entries reading from tables or tables referencing them by foreign key,
+        all entries when no tables are given - used after writes made outside of pyql, i.e. db.run(..)
+            db.invalidate('departments', 'positions')
+        """
+        if self.result_cache is None:
+            return
+        if len(tables) == 0:
+            return self.result_cache.clear()
+        self.result_cache.invalidate(*self._referencing_tables(tables))
+    def _referencing_tables(self, tables):
+        """
+            returns tables & the tables referencing them by foreign key, which may change via ON UPDATE / DELETE CASCADE
+        """
+        found, pending = set(), list(tables)
+        while pending:
+            name = pending.pop()
+            if name in found:
+                continue
+            found.add(name)
+            for table in self.tables.loaded():
+                if table.foreign_keys and any(fk['table'] == name for fk in table.foreign_keys.values()):
+                    pending.append(table.name)
+        return found
+    def _table_written(self, name):
+        """
+            invalidates the result_cache after pyql writes to table name, within a transaction 
+            the table is invalidated again at the end of the transaction
+        """
+        if self.result_cache is None:
+            return
+        written = self._written_tables()
+        if written is not None:
+            written.add(name)
+        self.invalidate(name)
+    def _invalidate_written(self, written):
+        if len(written) > 0:
+            self.invalidate(*written)
+    def _cached_get(self, tables, query, params, convert):
+        """
+            db.get(query, params, convert) of a select reading from tables, rows are kept in the result_cache
+        """
+        cache = self.result_cache
+        if cache is None or not cache.caches(tables) or self.in_transaction():
+            return self.get(query, params, convert=convert)
+        key = (query, tuple(params))
+        rows = cache.get(key)
+        if rows is None:
+            generation = cache.generation(tables)
+            rows = self.get(query, params)
+            if rows is None:
+                return convert([])
+            cache.set(key, tables, generation, rows)
+        return convert(rows)
+    def commit(self):
+        """
+            commits queries pending on the calling threads connection, used with autocommit=False
+        """
+        self._end_pinned('commit')
+    def rollback(self):
+        """
+            discards queries pending on the calling threads connection, used with autocommit=False
+        """
+        self._end_pinned('rollback')
+    def _end_pinned(self, action):
+        if not self.in_transaction():
+            return
+        if self._local.depth > 0:
+            raise InvalidInputError(
+                f"{action} called within db.transaction()", 
+                "db.transaction() blocks commit on exit or rollback when an exception is raised")
+        conn = self._local.conn
+        try:
+            getattr(conn, action)()
+        finally:
+            self._unpin()
+            if action == 'rollback':
+                self.clear_caches()
+    @property
+    def executor(self):
+        """
+            ThreadPoolExecutor running db.submit & Table.select_async_futures, started on first use
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers if self.max_workers is not None else self.pool.max_size,
+                    thread_name_prefix=f'pyql-{self.db_name}')
+            return self._executor
+    def submit(self, query, params=None):
+        """
+        runs db.get(query, params) on a db.executor thread, returning a concurrent.futures.Future of the rows
+            futures = [db.submit(f"SELECT * FROM stocks WHERE symbol = {db.param}", [s]) for s in symbols]
+            rows = [f.result() for f in futures]
+        Note: queries use a connection of the executor thread, outside of any db.transaction() of the caller
+        """
+        return self.executor.submit(self.get, query, params)
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        self.pool.close()
+    def run(self, query, params=None):
+        return self.get(query, params)
+    def get(self, query, params=None, convert=None):
+        """
+        runs query, returning any selected rows as a list of tuples
+            params - values bound to the query placeholders (db.param), i.e
+                db.get(f"SELECT * FROM stocks WHERE symbol = {db.param}", ['RHAT'])
+            convert - callable(rows) returning the result, timed as the 'convert' phase of the query event
+            query is a single statement, see run_many / pipeline for multiple statements
+        """
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.get query: {query} params: {params}')
+        timer = self._timer('get', query, params)
         with self.cursor() as c:
+            timer.phase('connect')
             try:
-                rows = []
-                result = []
-                query = query.split(';') if ';' in query else [query]
-                for q in query:
-                    r = c.execute(q)
-                    if r == None:
-                        for v in c:
-                            result.append(v)
-                    else:
-                        for row in r:
-                            rows.append(row)
-                return result if len(rows) == 0 else rows
+                if params is None:
+                    c.execute(query)
+                else:
+                    c.execute(query, params)
+                timer.phase('execute')
+                rows = c.fetchall() if c.description is not None else []
+                count = len(rows) if c.description is not None else c.rowcount
+                timer.phase('fetch')
             except Exception as e:
+                timer.error(e)
                 self.log.exception(f"exception in .get {repr(e)}")
+                if self.in_transaction():
+                    raise
+                return None if convert is None else convert([])
+        # commit
+        timer.phase('execute')
+        if convert is not None:
+            rows = convert(rows)
+            timer.phase('convert')
+        timer.done(count)
+        return rows
+    def iter_get(self, query, params=None, batch_size=500):
+        """
+        generator returning rows of query, fetched from the db batch_size rows at a time.
+            A connection is checked out for the life of the generator, unless called within
+            a transaction where rows are read using the transaction connection.
+        """
+        for rows in self.iter_batches(query, params, batch_size):
+            yield from rows
+    def iter_batches(self, query, params=None, batch_size=500):
+        """
+        generator returning lists of up to batch_size rows of query, see iter_get
+        """
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.iter_batches query: {query} params: {params}')
+        params = [] if params is None else params
+        timer = self._timer('iter_batches', query, params)
+        count = 0
+        pinned = self.in_transaction()
+        conn = self._local.conn if pinned else self.pool.checkout()
+        c = conn.cursor()
+        timer.phase('connect')
+        discard = False
+        try:
+            c.execute(query, params)
+            timer.phase('execute')
+            if c.description is None:
+                timer.done(c.rowcount)
+                return
+            if pinned:
+                # transaction connection may be used within the loop, so rows are read upfront
+                rows = c.fetchall()
+                timer.phase('fetch')
+                for i in range(0, len(rows), batch_size):
+                    yield rows[i:i+batch_size]
+                timer.done(len(rows))
+                return
+            while True:
+                rows = c.fetchmany(batch_size)
+                timer.phase('fetch')
+                if not rows:
+                    break
+                count+= len(rows)
+                yield rows
+                timer.resume()
+            timer.done(count)
+        except Exception as e:
+            timer.error(e)
+            self.log.exception(f"exception in .iter_batches {repr(e)}")
+            discard = not pinned
+            raise
+        finally:
+            try:
+                c.close()
+            except Exception:
+                discard = not pinned
+            if not pinned:
+                if not discard:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        discard = True
+                self.pool.checkin(conn, discard)
+    def executemany(self, query, params_list, return_keys=False):
+        """
+        runs query once for each set of params in params_list, using 1 connection & commit,
+        returning the number of affected rows reported by the driver
+            return_keys - returns the cursor lastrowid generated for each set of params
+        """
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.executemany query: {query} rows: {len(params_list)}')
+        timer = self._timer('executemany', query, params_list)
+        keys, rowcount = None, None
+        with self.cursor() as c:
+            timer.phase('connect')
+            try:
+                if return_keys:
+                    keys = []
+                    for params in params_list:
+                        c.execute(query, params)
+                        keys.append(c.lastrowid)
+                elif len(params_list) == 1:
+                    c.execute(query, params_list[0])
+                else:
+                    c.executemany(query, params_list)
+                rowcount = c.rowcount
+            except Exception as e:
+                timer.error(e)
+                self.log.exception(f"exception in .executemany {repr(e)}")
+                raise
+        # includes commit
+        timer.phase('execute')
+        timer.done(len(params_list))
+        return keys if return_keys else rowcount
+    def run_many(self, statements):
+        """
+        runs statements on 1 connection & cursor within 1 transaction, returning the result of each statement,
+        rows for statements which return rows, otherwise the number of affected rows
+            db.run_many([
+                (f"INSERT INTO keystore (env, val) VALUES ({db.param}, {db.param})", ['key1', 'value1']),
+                (f"UPDATE keystore SET val = {db.param} WHERE env = {db.param}", ['value2', 'key1']),
+                "SELECT count(*) FROM keystore"
+            ])
+            [1, 1, [(1,)]]
+        statements are query strings or (query, params), an error rolls back every statement
+        """
+        statements = [(statement, None) if isinstance(statement, str) else statement for statement in statements]
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.run_many statements: {len(statements)}')
+        results = []
+        with self.transaction():
+            with self.cursor() as c:
+                timer = NULL_TIMER
+                try:
+                    for query, params in statements:
+                        timer = self._timer('run_many', query, params)
+                        if params is None:
+                            c.execute(query)
+                        else:
+                            c.execute(query, params)
+                        timer.phase('execute')
+                        results.append(c.fetchall() if c.description is not None else c.rowcount)
+                        timer.phase('fetch')
+                        timer.done(len(results[-1]) if c.description is not None else c.rowcount)
+                except Exception as e:
+                    timer.error(e)
+                    self.log.exception(f"exception in .run_many {repr(e)}")
+                    raise
+        return results
+    @contextmanager
+    def pipeline(self):
+        """
+        collects statements of p.tables[..] & p.run(..), which are run on exit by db.run_many
+            with db.pipeline() as p:
+                p.tables['stocks'].insert(symbol='RHAT', qty=100)
+                p.tables['keystore'].update(val='value2', where={'env': 'key1'})
+                rhat = p.tables['stocks'].select('*', where={'symbol': 'RHAT'})
+            p.results[rhat] # [{'order_num': 1, 'symbol': 'RHAT', 'qty': 100}]
+        see Pipeline
+        """
+        pipeline = Pipeline(self)
+        yield pipeline
+        pipeline._complete(self.run_many(pipeline.statements))
+    def get_max_packet(self):
+        """
+        max size in bytes of a single statement sent to the db, mysql max_allowed_packet
+        """
+        if self.max_packet is None:
+            self.max_packet = 4*1024*1024
+            if self.type == 'mysql':
+                result = self.get('SELECT @@max_allowed_packet', [])
+                if result:
+                    self.max_packet = int(result[0][0])
+        return self.max_packet
     def load_tables(self):
+        with self._lock:
+            session_init = self.session_init
+            self._load_tables()
+            if not session_init is self.session_init:
+                # idle connections were opened before session_init changed
+                self.pool.close()
+    def _load_tables(self):
+        checksum = None
+        if self.schema_cache is not None:
+            checksum = self._schema_checksum(self.get(self._schema_checksum_query()))
+            schema = self._read_schema_cache(checksum)
+            if schema is not None:
+                return self._load_schema(schema)
+        if self.lazy_tables and self.schema_cache is None:
+            return self._lazy_table_names(self.get(self._table_names_query()))
+        schema = self._introspect()
+        if self.schema_cache is not None:
+            self._write_schema_cache(checksum, schema)
+        self._load_schema(schema)
+    def _introspect(self, names=None):
+        """
+            returns {table: (columns, primary_key, foreign_keys, indexes)} of tables in names, default all tables
+        """
         if self.type == 'sqlite':
-            def describe_table_to_col_sqlite(col_config):
-                config = []
-                for i in ' '.join(col_config.split(',')).split(' '):
-                    if not i == '' and not i == '\n':
-                        config.append(i.rstrip())
-                TYPE_TRANSLATE = {
-                    'varchar': str,
-                    'integer': int,
-                    'text': str,
-                    'real': float,
-                    'boolean': bool,
-                    'blob': bytes 
-                }
-                field, typ, extra = config[0], config[1], ' '.join(config[2:])
-                return TableColumn(
-                    field, 
-                    TYPE_TRANSLATE[typ.lower() if not 'VARCHAR' in typ else 'varchar'], 
-                    extra)
-                
-            for t in self.get("select name, sql from sqlite_master where type = 'table'"):
-                if 'sqlite' in t[1]:
+            return parse_sqlite_master(self.get(self._sqlite_master_query()), names)
+        tables = names if names is not None else [table for table, in self.get('show tables')]
+        index_query, index_params = self._mysql_index_query(names)
+        return parse_mysql_tables(
+            {table: self.get(f'show create table {table}')[0][1] for table in tables}, 
+            self.get(index_query, index_params))
+    def _sqlite_master_query(self):
+        return "select type, name, tbl_name, sql from sqlite_master where type in ('table', 'index') order by name"
+    def _mysql_index_query(self, names=None):
+        query = "SELECT TABLE_NAME, NON_UNIQUE, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()"
+        if names is None:
+            return query, []
+        return f"{query} AND TABLE_NAME IN ({', '.join([self.param]*len(names))})", list(names)
+    def _table_names_query(self):
+        if self.type == 'sqlite':
+            return "select name, sql from sqlite_master where type = 'table'"
+        return 'show tables'
+    def _lazy_table_names(self, rows):
+        names = []
+        for row in rows:
+            if self.type == 'sqlite':
+                name, schema = row
+                if name.startswith('sqlite_'):
                     continue
-                name = t[0]
-                schema = t[1]
-                config = schema.split(f'CREATE TABLE {name}')[1]
-                config = flatten(config)
-                col_config = inner(config).split(', ')
-                cols_in_table = []
-                foreign_keys = None
-                for cfg in col_config:
-                    if not 'FOREIGN KEY' in cfg:
-                        cols_in_table.append(describe_table_to_col_sqlite(cfg))
-                    else:
-                        if foreign_keys == None:
-                            foreign_keys = {}
-                        local_key, ref = cfg.split('FOREIGN KEY')[1].split('REFERENCES')
-                        local_key = inner(local_key)
-                        parent_table, mods = ref.split(')')
-                        parent_table, parent_key = parent_table.split('(')
-                        foreign_keys[no_blanks(local_key)] = {
-                                    'table': no_blanks(parent_table), 
-                                    'ref': no_blanks(parent_key),
-                                    'mods': mods.rstrip()
-                                }
-                # Create tables
-                primary_key = None
-                for col_item in cols_in_table: 
-                    if 'PRIMARY KEY' in col_item.mods.upper():
-                        primary_key = col_item.name
-                self.create_table(t[0], cols_in_table, primary_key, foreign_keys=foreign_keys)
-                if not foreign_keys == None:
-                    self.foreign_keys = True
-                    foreign_keys_pre_query = 'PRAGMA foreign_keys=true'
-                    if not foreign_keys_pre_query in self.pre_query:
-                        self.pre_query.append(foreign_keys_pre_query)
-
-
-        if self.type == 'mysql':
-            def describe_table_to_col(column):
-                TYPE_TRANSLATE = {'tinyint': bool, 'int': int, 'text': str, 'double': float, 'varchar': str}
-                config = []
-                for i in ' '.join(column.split(',')).split(' '):
-                    if not i == '' and not i == '\n':
-                        config.append(i.rstrip())
-                column = config
-                field = inner(column[0], '`','`')
-                typ = None
-                for k, v in TYPE_TRANSLATE.items():
-                    if k in column[1]:
-                        typ = v
-                        break
-                if typ == None:
-                    raise InvalidColumnType(column[1], f"invalid type provided for column, supported types {list(TYPE_TRANSLATE.keys())}")
-                """
-                Null = 'NOT NULL ' if column[2] == 'NO' else ''
-                Key = 'PRIMARY KEY ' if column[3] == 'PRI' else ''
-                Default = '' # TOODOO - check if this needs implementing
-                """
-                extra = ' '.join(column[2:])
-                return TableColumn(field, typ, extra)
-            for table, in self.run('show tables'):
-                cols_in_table = []
-                for _, schema in self.run(f'show create table {table}'):
-                    schema = flatten(schema.split(f'CREATE TABLE `{table}`')[1])
-                    col_config = inner(schema).split(', ')
-                    cols_in_table = []
-                    foreign_keys = None
-                    for cfg in col_config:
-                        if not 'FOREIGN KEY' in cfg:
-                            if not 'PRIMARY KEY' in cfg:
-                                if not 'KEY' in cfg:
-                                    cols_in_table.append(describe_table_to_col(cfg))
-                            else:
-                                primary_key = inner(inner(cfg.split('PRIMARY KEY')[1]), '`', '`')
-                        else:
-                            if foreign_keys == None:
-                                foreign_keys = {}
-                            local_key, ref = cfg.split('FOREIGN KEY')[1].split('REFERENCES')
-                            local_key = inner(inner(local_key), '`', '`')
-                            parent_table, mods = ref.split(')')
-                            parent_table, parent_key = parent_table.split('(')
-                            foreign_keys[no_blanks(local_key)] = {
-                                        'table': no_blanks(inner(parent_table, '`', '`')), 
-                                        'ref': no_blanks(inner(parent_key, '`', '`')),
-                                        'mods': mods.rstrip()
-                                    }
-                table = inner(table, '`', '`')
-                self.create_table(table, cols_in_table, primary_key, foreign_keys=foreign_keys)
+                if 'REFERENCES' in schema.upper():
+                    # connections need PRAGMA foreign_keys before the table is loaded
+                    self._enable_foreign_keys({})
+            names.append(inner(row[0], '`', '`'))
+        self.tables.set_pending(names)
+    def _load_lazy_table(self, name):
+        with self._lock:
+            if dict.__contains__(self.tables, name):
+                return
+            schema = self._introspect([name])
+            if name in schema:
+                self._load_table(name, *schema[name])
+    def _schema_checksum_query(self):
+        if self.type == 'sqlite':
+            return self._sqlite_master_query()
+        return """SELECT 
+            (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS(':', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, 
+                IS_NULLABLE, COLUMN_KEY, EXTRA, COALESCE(COLUMN_DEFAULT, '')))), 0)) 
+                FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()),
+            (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS(':', TABLE_NAME, INDEX_NAME, COLUMN_NAME, NON_UNIQUE))), 0)) 
+                FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()),
+            (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS(':', CONSTRAINT_NAME, UPDATE_RULE, DELETE_RULE, 
+                REFERENCED_TABLE_NAME))), 0)) 
+                FROM information_schema.REFERENTIAL_CONSTRAINTS WHERE CONSTRAINT_SCHEMA = DATABASE())"""
+    def _schema_checksum(self, rows):
+        return hashlib.sha1(repr([tuple(row) for row in rows or []]).encode()).hexdigest()
+    def _read_schema_cache(self, checksum):
+        """
+            returns the schema stored in schema_cache if its checksum matches, else None
+        """
+        try:
+            with open(self.schema_cache) as cache_file:
+                cache = json.load(cache_file)
+            if cache['database'] == self.db_name and cache['type'] == self.type and cache['checksum'] == checksum:
+                return schema_from_json(cache['tables'])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.log.warning(f"ignoring invalid schema_cache {self.schema_cache} {repr(e)}")
+        return None
+    def _write_schema_cache(self, checksum, schema):
+        cache = {'database': self.db_name, 'type': self.type, 'checksum': checksum, 'tables': schema_to_json(schema)}
+        try:
+            # written to a temp file & replaced, so readers never see a partial cache
+            with open(f"{self.schema_cache}.tmp", 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(f"{self.schema_cache}.tmp", self.schema_cache)
+        except Exception as e:
+            self.log.warning(f"unable to write schema_cache {self.schema_cache} {repr(e)}")
+    def _load_schema(self, schema):
+        for name, table in schema.items():
+            self._load_table(name, *table)
+    def _load_table(self, name, columns, prim_key, foreign_keys, indexes=None):
+        table = Table(name, self, self._table_columns(columns), prim_key, foreign_keys=foreign_keys, exists=True)
+        table.indexes = indexes if indexes is not None else {}
+        with self._lock:
+            self.tables[name] = table
+        self._enable_foreign_keys(foreign_keys)
+    def _enable_foreign_keys(self, foreign_keys):
+        if self.type == 'sqlite' and not foreign_keys == None:
+            foreign_keys_pragma = 'PRAGMA foreign_keys=true'
+            with self._lock:
+                self.foreign_keys = True
+                if not foreign_keys_pragma in self.session_init:
+                    # new list, so connections created on other threads see a consistent session_init
+                    self.session_init = self.session_init + [foreign_keys_pragma]
     def create_table(self,name, columns, prim_key=None, **kw):
         """
         Usage:
@@ -252,9 +1711,21 @@ class Database:
                     ('price', str, None)
                     ], 
                 'order_num', # Primary Key
-                foreign_keys={'trans': {'table': 'transactions', 'ref': 'txId'}} 
+                foreign_keys={'trans': {'table': 'transactions', 'ref': 'txId'}},
+                indexes=['symbol', ['date', 'trans'], {'columns': ['order_num', 'date'], 'unique': True}]
             )
+            indexes - column, [columns] or {'columns': [..], 'unique': False, 'name': None} for each
+                index created if missing, see Table.create_index
         """
+        with self._lock:
+            table = Table(name, self, self._table_columns(columns), prim_key, **kw)
+            if name in self.tables:
+                table.indexes = dict(self.tables[name].indexes)
+            self.tables[name] = table
+        self.invalidate(name)
+        for index in kw['indexes'] if 'indexes' in kw else []:
+            table.create_index(*table._index_args(index))
+    def _table_columns(self, columns):
         #Convert tuple columns -> named_tuples
         cols = []
         for c in columns:
@@ -263,20 +1734,21 @@ class Database:
                 cols.append(TableColumn(*c) if len(c) > 2 else TableColumn(*c, ''))
             else:
                 cols.append(c)
-        self.tables[name] = Table(name, self, cols, prim_key, **kw)
+        return cols
 
 
 class Table:
     def __init__(self, name, database, columns, prim_key = None, **kw):
         self.name = name
         self.database = database
-        self.types = {int,str,float,bool,bytes}
+        self.types = {int,str,float,bool,bytes,dict,list}
         self.TRANSLATION = {
             'integer': int,
             'text': str,
             'real': float,
             'boolean': bool,
-            'blob': bytes 
+            'blob': bytes,
+            'json': dict
         }
         self.columns = {}
         for c in columns:
@@ -285,17 +1757,23 @@ class Table:
             if c.name in self.columns:
                 raise InvalidInputError(f"duplicate column name {c.name} provided", f"column names may only be specified once for table objects")
             self.columns[c.name] = c
-        if prim_key is not None:
-            self.prim_key = prim_key if prim_key in self.columns else None
+        self.prim_key = prim_key if prim_key in self.columns else None
         self.foreign_keys = kw['foreign_keys'] if 'foreign_keys' in kw else None
-            
-        self.create_schema()
+        # {name: {'columns': [..], 'unique': bool}}, loaded by Database.load_tables
+        self.indexes = {}
+        self.cache = None
+        if 'cache' in kw and kw['cache']:
+            self.enable_cache(**(kw['cache'] if isinstance(kw['cache'], dict) else {}))
+        # exists - loaded from the db, no CREATE TABLE needed
+        if not ('exists' in kw and kw['exists']):
+            self.create_schema()
     def get_schema(self):
         constraints = ''
         cols = '('
         for col_name,col in self.columns.items():
+            col_type = dict if col.type in JSON_TYPES else col.type
             for k,v in self.TRANSLATION.items():
-                if col.type == v:
+                if col_type == v:
                     if len(cols) > 1:
                         cols = f'{cols}, '
                     if col_name == self.prim_key and (k=='text' or k=='blob'):
@@ -321,156 +1799,279 @@ class Table:
     def create_schema(self):
         if not self.name in self.database:
             self.database.run(self.get_schema())
+    def _index_args(self, index):
+        """
+            returns (columns, unique, name) of a create_table index - column, [columns] or dict
+        """
+        if isinstance(index, dict):
+            if not 'columns' in index:
+                raise InvalidInputError(f"index {index} is missing 'columns'", "expected {'columns': [..], 'unique': False, 'name': None}")
+            return index['columns'], index['unique'] if 'unique' in index else False, index['name'] if 'name' in index else None
+        return index, False, None
+    def _create_index_query(self, columns, unique=False, name=None):
+        """
+            returns (name, column names, query) of an index on columns - column names or (column, prefix length),
+            mysql TEXT columns are indexed by a prefix of MYSQL_INDEX_PREFIX chars unless a length is given
+        """
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        if len(columns) == 0:
+            raise InvalidInputError(f"no columns provided for index on {self.name}", "provide 1 or more columns")
+        col_names, parts = [], []
+        for column in columns:
+            col_name, length = column if isinstance(column, (tuple, list)) else (column, None)
+            if not col_name in self.columns:
+                raise InvalidInputError(f"{col_name} is not a valid column in table {self.name}", f"valid columns {self.columns}")
+            if length is not None and (not isinstance(length, int) or length < 1):
+                raise InvalidInputError(f"prefix length {length} of {col_name} is not valid", "expected an int >= 1")
+            if self.database.type == 'mysql' and length is None and self.columns[col_name].type == str and not col_name == self.prim_key:
+                # str columns are created as TEXT, which mysql only indexes by a prefix
+                length = MYSQL_INDEX_PREFIX
+            col_names.append(col_name)
+            parts.append(f"{col_name}({length})" if self.database.type == 'mysql' and length is not None else col_name)
+        name = name if name is not None else f"idx_{self.name}_{'_'.join(col_names)}"
+        exists = 'IF NOT EXISTS ' if self.database.type == 'sqlite' else ''
+        query = f"CREATE {'UNIQUE ' if unique else ''}INDEX {exists}{name} ON {self.name} ({', '.join(parts)})"
+        return name, col_names, query
+    def _drop_index_query(self, name):
+        if not name in self.indexes:
+            raise InvalidInputError(f"index {name} does not exist on table {self.name}", f"existing indexes {list(self.indexes)}")
+        if self.database.type == 'mysql':
+            return f"DROP INDEX {name} ON {self.name}"
+        return f"DROP INDEX IF EXISTS {name}"
+    def create_index(self, columns, unique=False, name=None):
+        """
+        Usage: creates an index on columns if missing, returning the index name
+            db.tables['stocks'].create_index('symbol')
+            db.tables['stocks'].create_index(['symbol', 'date'], unique=True, name='stocks_symbol_date')
+            query:
+                CREATE UNIQUE INDEX stocks_symbol_date ON stocks (symbol, date)
+            db.tables['stocks'].indexes
+                {'idx_stocks_symbol': {'columns': ['symbol'], 'unique': False}, 
+                 'stocks_symbol_date': {'columns': ['symbol', 'date'], 'unique': True}}
+        name defaults to idx_<table>_<columns>
+        mysql indexes str (TEXT) columns by their first 255 chars, (column, length) sets the prefix length
+            db.tables['stocks'].create_index([('symbol', 8), 'date'])
+                CREATE INDEX idx_stocks_symbol_date ON stocks (symbol(8), date(255))
+        """
+        name, columns, query = self._create_index_query(columns, unique, name)
+        if not name in self.indexes:
+            self.database.run_many([query])
+            self.indexes[name] = {'columns': columns, 'unique': unique}
+        return name
+    def drop_index(self, name):
+        """
+        Usage:
+            db.tables['stocks'].drop_index('idx_stocks_symbol')
+        """
+        self.database.run_many([self._drop_index_query(name)])
+        del self.indexes[name]
+    def _to_db_value(self, column, value):
+        """
+            converts value into the parameter passed to the db driver for column
+        """
+        if value is None:
+            return None
+        if column.type == bool:
+            try:
+                value = bool(int(value))
+            except Exception:
+                #Bool Input is string
+                if isinstance(value, str) and 'true' in value.lower():
+                    value = True
+                elif isinstance(value, str) and 'false' in value.lower():
+                    value = False
+                else:
+                    raise InvalidInputError(
+                        f"Unsupported value {value} provide for column type {column.type}", 
+                        f"expected bool or 'true' / 'false' for column {column.name}")
+            return value if self.database.type == 'mysql' else int(value)
+        #JSON handling
+        if column.type in JSON_TYPES:
+            return value if isinstance(value, str) else self.database.json_codec.dumps(value)
+        if column.type == str and isinstance(value, dict):
+            return self.database.json_codec.dumps(value)
+        return column.type(value)
     def _process_input(self, kw):
-        tables = [self]
-        if 'join' in kw:
-            if isinstance(kw['join'], dict):
-                for table in kw['join']:
-                    if table in self.database.tables:
-                        tables.append(self.database.tables[table])
-            else:
-                if kw['join'] in self.database.tables:
-                    tables.append(self.database.tables[kw['join']])
-        def verify_input(where):
-            for table in tables:
-                for col_name, col in table.columns.items():
-                    if col_name in where:
-                        if not col.type == bool:
-                            #JSON handling
-                            if col.type == str and type(where[col_name]) == dict:
-                                where[col_name] = f"'{col.type(json.dumps(where[col_name]))}'"
-                                continue
-                            if type(where) == dict:
-                                where[col_name] = col.type(where[col_name]) if not where[col_name] == None else 'NULL'
-                        else:
-                            try:
-                                where[col_name] = col.type(int(where[col_name])) if table.database.type == 'mysql' else int(col.type(int(where[col_name])))
-                            except:
-                                #Bool Input is string
-                                if 'true' in where[col_name].lower():
-                                    where[col_name] = True if table.database.type == 'mysql' else 1
-                                elif 'false' in where[col_name].lower():
-                                    where[col_name] = False if table.database.type == 'mysql' else 0
-                                else:
-                                    self.database.log.warning(f"Unsupported value {where[col_name]} provide for column type {col.type}")
-                                    del(where[col_name])
-                                    continue
-            return where
-        kw = verify_input(kw)
-        if 'where' in kw:
-            kw['where'] = verify_input(kw['where'])
+        for col_name, col in self.columns.items():
+            if col_name in kw:
+                try:
+                    kw[col_name] = self._to_db_value(col, kw[col_name])
+                except InvalidInputError as e:
+                    self.database.log.warning(e.invalid_input)
+                    del(kw[col_name])
         return kw
+    def _cached_sql(self, key, build):
+        """
+            returns SQL text for query shape key, calling build() only when not already cached
+        """
+        query = self.database.sql_cache.get(key)
+        if query is None:
+            query = build()
+            self.database.sql_cache.set(key, query)
+        return query
+    def _where_column(self, col_name):
+        if isinstance(col_name, str) and '.' in col_name:
+            table, column = col_name.split('.')
+        else:
+            table, column = self.name, col_name
+        if not table in self.database.tables or not column in self.database.tables[table].columns:
+            raise InvalidInputError(
+                f"{column} is not a valid column in table {table}", 
+                "invalid column specified for 'where'")
+        return self.database.tables[table].columns[column]
+    def _is_column_ref(self, value):
+        if not isinstance(value, str) or not value.count('.') == 1:
+            return False
+        table, column = value.split('.')
+        return table in self.database.tables and column in self.database.tables[table].columns
+    def _where(self, kw):
+        """
+            returns (where_shape, params) for kw['where'], compiled in a single pass over the conditions
+                where_shape - hashable description of the conditions, used to build & cache the WHERE clause
+                params - values bound to each placeholder within the WHERE clause
 
-    def __where(self, kw):
-        where_sel = ''
-        index = 0
-        kw = self._process_input(kw)
-        if 'where' in kw:
-            and_value = 'WHERE '
-
-            def get_valid_table_column(col_name, **kw):
-                dot_table = False
-                if isinstance(col_name, str) and '.' in col_name:
-                    dot_table = True
-                    table, column = col_name.split('.')
-                else:
-                    table, column = self.name, col_name
-                if not column in self.database.tables[table].columns:
-                    if 'no_raise' in kw and not dot_table:
-                        pass
-                    else:
-                        raise InvalidInputError(
-                            f"{column} is not a valid column in table {table}", 
-                            "invalid column specified for 'where'")
-                return table, column
-
-            supported_operators = {'=', '==', '<>', '!=', '>', '>=', '<', '<=', 'like', 'in', 'not in', 'not like'}
-            if isinstance(kw['where'], list):
-                for condition in kw['where']:
-                    if not type(condition) in [dict, list]:
-                        raise InvalidInputError(
-                            f"{condition} is not a valid type within where=[]", 
-                            "invalid subcondition type within where=[], expected type(list, dict)"
-                            )
-                    if isinstance(condition, list):
-                        if not len(condition) == 3:
-                            cond_len = len(condition)
-                            raise InvalidInputError(
-                                f"{condition} has {cond_len} items, expected 3", 
-                                f"{condition} has {cond_len} items, expected 3"
-                        )
-                        condition1 = f"{condition[0]}"
-                        operator = condition[1]
-                        condition2 = condition[2]
-
-                        table, column = None, None
-                        # expecting comparison operators
-                        if not operator in supported_operators:
+            conditions - {'col': value}, ['col', operator, value] or a list of these, which are ANDed
+                {'or': [conditions, ..]} / {'and': [conditions, ..]} - nested groups
+                {'not': conditions} - negated conditions
+        """
+        params = []
+        if not 'where' in kw:
+            return (), params
+        return self._conditions(kw['where'], params), params
+    def _conditions(self, conditions, params):
+        """
+            returns the shape of conditions which are ANDed, appending values of placeholders to params
+        """
+        if isinstance(conditions, dict):
+            conditions = [conditions]
+        if not isinstance(conditions, list):
+            raise InvalidInputError(
+                f"{conditions} is not a valid type for where", 
+                "expected where={'col': value} or where=[[condition1], {'col': value}]")
+        shape = []
+        for condition in conditions:
+            if not type(condition) in [dict, list]:
+                raise InvalidInputError(
+                    f"{condition} is not a valid type within where=[]", 
+                    "invalid subcondition type within where=[], expected type(list, dict)"
+                    )
+            if isinstance(condition, dict):
+                for col_name, v in condition.items():
+                    group = col_name.lower() if isinstance(col_name, str) and not col_name in self.columns else None
+                    if group in {'or', 'and'}:
+                        if not isinstance(v, list) or len(v) == 0:
                             raise InvalidInputError(
-                                f"Invalid operator {operator} within {condition}", f"supported operators [{supported_operators}]"
-                            )
-                        for i, value in enumerate([condition1, condition2]):
-                            if i == 0:
-                                table, column = get_valid_table_column(value)
-                                pass
-                            if i == 1 and 'in' in operator:
-                                # in operators should be proceeded by a list of values
-                                if not isinstance(condition2, list):
-                                    raise InvalidInputError(
-                                        f"Invalid use of operator '{operator}' within {condition}", 
-                                        f"'in' should be proceeded by ['list', 'of', 'values'] not {type(condition2)} - {condition2}"
-                                    )
-                                if self.database.tables[table].columns[column].type == str:
-                                    condition2 = [f"'{cond}'" for cond in condition2]
-                                else:
-                                    condition2 = [str(cond) for cond in condition2]
-                                condition2 = ', '.join(condition2)
-                                condition2 = f"({condition2})"
-                                break
-                            if i == 1:
-                                get_valid_table_column(value, no_raise=True)
-                                """still raises if dot_table used & not in table """
-                                pass
-
-                        if 'like' in operator:
-                            condition2 = f"{condition2}"
-                            if not '*' in condition2:
-                                condition2 = f"'%{condition2}%'"
-                            else:
-                                condition2 = '%'.join(condition2.split('*'))
-                                condition2 = f"'{condition2}'"
-
-                        
-                        where_sel = f"{where_sel}{and_value}{condition1} {operator} {condition2}"
-                    if isinstance(condition, dict):
-                        for col_name, v in condition.items():
-                            table, column = get_valid_table_column(col_name)
-                            table = self.database.tables[table]
-                            eq = '=' if not v == 'NULL' else ' IS '
-                            #json check
-                            if v == 'NULL' or table.columns[column].type == str and '{"' and '}' in v:
-                                where_sel = f"{where_sel}{and_value}{col_name}{eq}{v}"
-                            else:
-                                val = v if table.columns[column].type is not str else f"'{v}'"
-                                where_sel = f"{where_sel}{and_value}{col_name}{eq}{val}"
-
-                    and_value = ' AND '
-                        
-            if isinstance(kw['where'], dict):
-                for col_name, v in kw['where'].items():
-                    table, column = get_valid_table_column(col_name)
-                    table = self.database.tables[table]
-                    eq = '=' if not v == 'NULL' else ' IS '
-                    #json check
-                    if v == 'NULL' or table.columns[column].type == str and '{"' and '}' in v:
-                        where_sel = f"{where_sel}{and_value}{col_name}{eq}{v}"
-                    else:
-                        val = v if table.columns[column].type is not str else f"'{v}'"
-                        where_sel = f"{where_sel}{and_value}{col_name}{eq}{val}"
-                    and_value = ' AND '
-        return where_sel
-    def _join(self, kw):
-        join = ''
+                                f"{col_name} expects a list of conditions, not {v}", 
+                                "usage: where={'or': [{'col': value}, ['col', operator, value]]}")
+                        shape.append(('group', group.upper(), tuple(self._condition_group(c, params) for c in v)))
+                        continue
+                    if group == 'not':
+                        shape.append(('not', self._condition_group(v, params)))
+                        continue
+                    column = self._where_column(col_name)
+                    if v is None:
+                        shape.append(('null', col_name, 'IS'))
+                        continue
+                    shape.append(('value', col_name, '='))
+                    params.append(self._to_db_value(column, v))
+                continue
+            if len(condition) > 0 and type(condition[0]) in [dict, list]:
+                # nested list of conditions
+                shape.append(self._condition_group(condition, params))
+                continue
+            shape.append(self._comparison(condition, params))
+        return tuple(shape)
+    def _condition_group(self, conditions, params):
+        if isinstance(conditions, list) and len(conditions) > 0 and not type(conditions[0]) in [dict, list]:
+            # single ['col', operator, value] condition
+            conditions = [conditions]
+        shape = self._conditions(conditions, params)
+        if len(shape) == 0:
+            raise InvalidInputError(
+                f"empty condition {conditions}", "conditions within 'or', 'and' & 'not' may not be empty")
+        return shape[0] if len(shape) == 1 else ('group', 'AND', shape)
+    def _comparison(self, condition, params):
+        """
+            returns the shape of ['col', operator, value], appending values of placeholders to params
+        """
+        supported_operators = {
+            '=', '==', '<>', '!=', '>', '>=', '<', '<=', 'like', 'in', 'not in', 'not like', 
+            'between', 'not between', 'is null', 'is not null'
+        }
+        operator = condition[1].lower() if len(condition) > 1 and isinstance(condition[1], str) else None
+        if not len(condition) == 3 and not (len(condition) == 2 and operator in {'is null', 'is not null'}):
+            cond_len = len(condition)
+            raise InvalidInputError(
+                f"{condition} has {cond_len} items, expected 3", 
+                f"{condition} has {cond_len} items, expected 3"
+        )
+        col_name, value = condition[0], condition[2] if len(condition) == 3 else None
+        # expecting comparison operators
+        if not operator in supported_operators:
+            raise InvalidInputError(
+                f"Invalid operator {condition[1]} within {condition}", f"supported operators [{supported_operators}]"
+            )
+        operator = '=' if operator == '==' else operator
+        column = self._where_column(col_name)
+        if operator in {'in', 'not in'}:
+            # in operators should be proceeded by a list of values
+            if not isinstance(value, list):
+                raise InvalidInputError(
+                    f"Invalid use of operator '{operator}' within {condition}", 
+                    f"'in' should be proceeded by ['list', 'of', 'values'] not {type(value)} - {value}"
+                )
+            params.extend(self._to_db_value(column, v) for v in value)
+            return ('in', col_name, operator, len(value))
+        if operator in {'between', 'not between'}:
+            if not isinstance(value, (list, tuple)) or not len(value) == 2:
+                raise InvalidInputError(
+                    f"Invalid use of operator '{operator}' within {condition}", 
+                    f"'between' should be proceeded by [low, high] not {type(value)} - {value}"
+                )
+            params.extend(self._to_db_value(column, v) for v in value)
+            return ('between', col_name, operator)
+        if operator in {'is null', 'is not null'}:
+            return ('null', col_name, 'IS' if operator == 'is null' else 'IS NOT')
+        if 'like' in operator:
+            value = f"{value}"
+            value = f"%{value}%" if not '*' in value else '%'.join(value.split('*'))
+            params.append(value)
+            return ('value', col_name, operator)
+        if value is None and operator in {'=', '<>', '!='}:
+            return ('null', col_name, 'IS' if operator == '=' else 'IS NOT')
+        if self._is_column_ref(value):
+            return ('column', col_name, operator, value)
+        params.append(self._to_db_value(column, value))
+        return ('value', col_name, operator)
+    def _where_sql(self, shape):
+        if len(shape) == 0:
+            return ''
+        return f"WHERE {self._conditions_sql(shape)}"
+    def _conditions_sql(self, shape, join='AND'):
+        conditions = []
+        for condition in shape:
+            kind = condition[0]
+            if kind == 'group':
+                sql = self._conditions_sql(condition[2], condition[1])
+                conditions.append(f"({sql})" if len(condition[2]) > 1 else sql)
+                continue
+            if kind == 'not':
+                conditions.append(f"NOT ({self._conditions_sql((condition[1],))})")
+                continue
+            col_name, operator = condition[1:3]
+            if kind == 'null':
+                conditions.append(f"{col_name} {operator} NULL")
+            elif kind == 'in':
+                conditions.append(f"{col_name} {operator} ({', '.join([self.database.param]*condition[3])})")
+            elif kind == 'between':
+                conditions.append(f"{col_name} {operator} {self.database.param} AND {self.database.param}")
+            elif kind == 'column':
+                conditions.append(f"{col_name} {operator} {condition[3]}")
+            else:
+                conditions.append(f"{col_name} {operator} {self.database.param}")
+        return f' {join} '.join(conditions)
+    def _join(self, kw):
+        join = ''
         if not 'join' in kw:
             return join
         for join_table, condition in kw['join'].items():
@@ -498,22 +2099,10 @@ class Table:
                 count+=1
         return join
 
-    def select(self, *selection, **kw):
+    def _resolve_join(self, kw):
         """
-        Usage: returns list of dictionaries for each selection in each row. 
-            tb = db.tables['stocks_new_tb2']
-
-            sel = tb.select('order_num',
-                            'symbol', 
-                            where={'trans': 'BUY', 'qty': 100})
-            sel = tb.select('*')
-            # Iterate through table
-            sel = [row for row in tb]
-            # Using Primary key only
-            sel = tb[0] # select * from <table> where <table_prim_key> = <val>
+            replaces join='table' with the join conditions of the foreign key referencing table
         """
-
-
         if 'join' in kw and isinstance(kw['join'], str):
             if kw['join'] in [self.foreign_keys[k]['table'] for k in self.foreign_keys]:
                 for local_key, foreign_key in self.foreign_keys.items():
@@ -525,6 +2114,38 @@ class Table:
             else:
                 error = f"join table {kw['join']} specified without specifying matching columns or tables do not share keys"
                 raise InvalidInputError(error, f"valid foreign_keys {self.foreign_keys}")
+    def _join_tables(self, kw):
+        """ names of this table & the tables joined by resolved kw join """
+        return (self.name,) + (tuple(kw['join']) if 'join' in kw else ())
+    def _join_key(self, kw):
+        if not 'join' in kw:
+            return None
+        return tuple((table, tuple(condition.items())) for table, condition in kw['join'].items())
+    def _select_query(self, selection, kw):
+        """
+            returns (query, params, keys, col_refs) for a select of selection with kw join / where / orderby / limit / offset
+                keys - result key for each selected column
+                col_refs - TableColumn for each key
+        """
+        plan = self._select_plan(selection, kw)
+        query, params = plan.query(kw)
+        return query, params, plan.keys, plan.col_refs
+    def _select_plan(self, selection, kw):
+        """
+            returns the SelectPlan of selection & kw join from db.plan_cache, compiled on first use
+        """
+        join = kw['join'] if 'join' in kw else None
+        key = (self.name, tuple(selection), join if not isinstance(join, dict) else self._join_key(kw))
+        plan = self.database.plan_cache.get(key)
+        if plan is None or not plan.version == self.database.tables.version:
+            plan = SelectPlan(self, selection, join)
+            self.database.plan_cache.set(key, plan)
+        return plan
+    def _compile_selection(self, selection, kw):
+        """
+            returns (select_item, keys, col_refs) of selection, validating each column
+        """
+        self._resolve_join(kw)
         if '*' in selection:
             selection = '*'
             if 'join' in kw:
@@ -570,40 +2191,434 @@ class Table:
                 col_refs[col] = self.columns[col]
                 keys.append(col)
             selection = ','.join(selection)
-        join = ''
-        if 'join' in kw:
-            join = self._join(kw)        
-        where_sel = self.__where(kw)
-        orderby = ''
-        if 'orderby' in kw:
-            if not kw['orderby'] in self.columns:
-                raise InvalidInputError(f"orderby input {kw['orderby']} is not a valid column name", f"valid columns {self.columns}")
-            orderby = ' ORDER BY '+ kw['orderby']
-        query = 'SELECT {select_item} FROM {name} {join}{where}{order}'.format(
-            select_item = selection,
-            name = self.name,
-            join=join,
-            where = where_sel,
-            order = orderby
-        )
-        rows = self.database.get(query)
+        return selection, keys, col_refs
+    def _orderby(self, kw, keys=()):
+        """
+            returns ((column, 'ASC' | 'DESC'), ..) for kw['orderby'] - 'col', 'col desc', ('col', 'desc') or a list of these
+                keys - result keys which may also be ordered by, i.e. 'sum(qty)'
+        """
+        if not 'orderby' in kw or kw['orderby'] is None:
+            return ()
+        orderby = []
+        for item in kw['orderby'] if isinstance(kw['orderby'], list) else [kw['orderby']]:
+            parts = item.split() if isinstance(item, str) else list(item)
+            if not len(parts) in {1, 2}:
+                raise InvalidInputError(f"orderby input {item} is not valid", "expected 'col', 'col desc' or ('col', 'desc')")
+            col_name, direction = parts[0], parts[1].upper() if len(parts) == 2 else 'ASC'
+            if not col_name in self.columns and not self._is_column_ref(col_name) and not col_name in keys:
+                raise InvalidInputError(f"orderby input {col_name} is not a valid column name", f"valid columns {self.columns}")
+            if not direction in {'ASC', 'DESC'}:
+                raise InvalidInputError(f"orderby direction {direction} is not valid for {col_name}", "expected 'asc' or 'desc'")
+            orderby.append((col_name, direction))
+        return tuple(orderby)
+    def _limit(self, kw):
+        """
+            returns (limit_shape, params) for kw['limit'] & kw['offset'], values are bound as params
+        """
+        shape, params = [], []
+        for key in ['limit', 'offset']:
+            if key in kw and kw[key] is not None:
+                if not isinstance(kw[key], int) or isinstance(kw[key], bool) or kw[key] < 0:
+                    raise InvalidInputError(f"{key} {kw[key]} is not valid", f"expected {key} to be an int >= 0")
+                shape.append(key)
+                params.append(kw[key])
+        return tuple(shape), params
+    def _limit_sql(self, shape):
+        if len(shape) == 0:
+            return ''
+        # OFFSET requires a LIMIT, use the max row count of the db
+        limit = self.database.param if 'limit' in shape else '-1' if self.database.type == 'sqlite' else '18446744073709551615'
+        return f" LIMIT {limit}{f' OFFSET {self.database.param}' if 'offset' in shape else ''}"
+    def _aggregate_column(self, key):
+        """
+            returns (function, column name, TableColumn of the result) for aggregate key i.e. 'sum(qty)'
+        """
+        match = re.fullmatch(r'\s*(\w+)\(\s*(\*|[\w.]+)\s*\)\s*', key)
+        if match is None or not match.group(1).lower() in AGGREGATE_FUNCTIONS:
+            raise InvalidInputError(f"{key} is not a valid aggregate", f"expected '<function>(<column>)' with a function in {AGGREGATE_FUNCTIONS}")
+        function, col_name = match.group(1).lower(), match.group(2)
+        if col_name == '*':
+            if not function == 'count':
+                raise InvalidInputError(f"{key} is not a valid aggregate", "'*' is only supported with count")
+            return function, col_name, TableColumn(key, int, None)
+        column = self._where_column(col_name)
+        if function == 'count':
+            column = TableColumn(key, int, None)
+        elif function == 'avg' or (function == 'sum' and not column.type in {int, float}):
+            column = TableColumn(key, float, None)
+        elif function == 'sum':
+            column = TableColumn(key, column.type, None)
+        return function, col_name, column
+    def _aggregate_query(self, aggregates, group_by, having, kw):
+        """
+            returns (query, params, keys, col_refs) of an aggregate select, see aggregate
+        """
+        self._resolve_join(kw)
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by) if group_by else []
+        keys, col_refs = [], {}
+        for col_name in group_by:
+            if not col_name in self.columns and not self._is_column_ref(col_name):
+                raise InvalidInputError(f"group_by input {col_name} is not a valid column name", f"valid columns {self.columns}")
+            keys.append(col_name)
+            col_refs[col_name] = self._where_column(col_name)
+        for col_name, functions in aggregates.items():
+            for function in [functions] if isinstance(functions, str) else functions:
+                key = f"{function.lower()}({col_name})"
+                col_refs[key] = self._aggregate_column(key)[2]
+                keys.append(key)
+        if len(keys) == len(group_by):
+            raise InvalidInputError(f"no aggregates provided {aggregates}", "expected {'column': 'sum'} or {'column': ['min', 'max']}")
+        having_shape, having_params = [], []
+        conditions = [having] if isinstance(having, dict) else having if having else []
+        for condition in conditions:
+            if isinstance(condition, dict):
+                condition = [[key, '=', value] for key, value in condition.items()]
+            else:
+                condition = [condition]
+            for key, operator, value in condition:
+                if not operator in {'=', '==', '<>', '!=', '>', '>=', '<', '<='}:
+                    raise InvalidInputError(f"Invalid operator {operator} within having {condition}", "supported operators =, <>, !=, >, >=, <, <=")
+                if key in group_by:
+                    expression = key
+                else:
+                    function, col_name, _ = self._aggregate_column(key)
+                    expression = f"{function}({col_name})"
+                having_shape.append((expression, '=' if operator == '==' else operator))
+                having_params.append(value)
+        having_shape = tuple(having_shape)
+        join_key = self._join_key(kw)
+        where_shape, params = self._where(kw)
+        orderby = self._orderby(kw, keys)
+        limit_shape, limit_params = self._limit(kw)
+        def build():
+            return 'SELECT {select_item} FROM {name} {join}{where}{group}{having}{order}{limit}'.format(
+                select_item = ', '.join(keys),
+                name = self.name,
+                join=self._join(kw) if 'join' in kw else '',
+                where = self._where_sql(where_shape),
+                group = ' GROUP BY ' + ', '.join(group_by) if group_by else '',
+                having = ' HAVING ' + ' AND '.join(
+                    [f"{expression} {operator} {self.database.param}" for expression, operator in having_shape]) if having_shape else '',
+                order = ' ORDER BY '+ ', '.join([f"{col_name} {direction}" for col_name, direction in orderby]) if orderby else '',
+                limit = self._limit_sql(limit_shape)
+            )
+        query = self._cached_sql(
+            ('aggregate', self.name, tuple(keys), len(group_by), join_key, where_shape, having_shape, orderby, limit_shape), build)
+        return query, params + having_params + limit_params, keys, col_refs
+    def _page_kw(self, page_size, after, desc, kw):
+        """
+            returns (key, select kw) for the page of paginate after primary key value after
+        """
+        if self.prim_key is None:
+            raise InvalidInputError(f"table {self.name} has no primary key", "paginate requires a primary key")
+        if not isinstance(page_size, int) or page_size < 1:
+            raise InvalidInputError(f"page_size {page_size} is not valid", "expected page_size to be an int >= 1")
+        key = f"{self.name}.{self.prim_key}" if 'join' in kw else self.prim_key
+        page_kw = {**kw, 'orderby': [(key, 'DESC' if desc else 'ASC')], 'limit': page_size}
+        if after is not None:
+            where = kw['where'] if 'where' in kw else []
+            page_kw['where'] = ([where] if isinstance(where, dict) else list(where)) + [[key, '<' if desc else '>', after]]
+        return key, page_kw
+    def _page_selection(self, selection, key):
+        if '*' in selection or key in selection:
+            return selection
+        # the primary key of the last row seeks the next page
+        return tuple(selection) + (key,)
+    def _page_last(self, page, selection, key, kw):
+        """
+            returns (rows, primary key of the last row) of a paginate page in any row_format
+        """
+        row_format = kw['row_format'] if 'row_format' in kw else 'dict'
+        if row_format in {'columns', 'numpy'}:
+            rows = len(page[key])
+            last = page[key][-1] if rows > 0 else None
+        else:
+            rows = len(page)
+            if rows == 0:
+                last = None
+            elif row_format in {'tuple', 'namedtuple'}:
+                # positional rows, the key is found by its position in the selection
+                last = page[-1][self._select_plan(selection, kw).keys.index(key)]
+            else:
+                last = page[-1][key]
+        # numpy scalars are converted into the python value bound to the next page
+        return rows, last.item() if hasattr(last, 'item') else last
+    def _row_converters(self, keys, col_refs, lazy=False):
+        """
+            returns a function per key converting db values to python, None where no conversion is needed
+                lazy - returns (converters, json_decoders) with JSON decoding split out into {key: decoder}
+        """
+        loads = self.database.json_codec.loads
+        def json_or_none(v):
+            # sqlite JSON columns have NUMERIC affinity, JSON numbers are read back as int / float
+            return loads(v) if isinstance(v, (str, bytes, bytearray)) else v
+        def json_or_str(v):
+            # str columns holding JSON objects written from dicts
+            if isinstance(v, str) and v[:1] == '{' and v[-1:] == '}':
+                try:
+                    return loads(v)
+                except ValueError:
+                    pass
+            return v
+        converters, json_decoders = [], {}
+        for key in keys:
+            col_type = col_refs[key].type
+            if col_type in JSON_TYPES:
+                convert = json_or_none
+            elif col_type == str and self.database.json_detect:
+                convert = json_or_str
+            else:
+                converters.append(bool if col_type == bool else None)
+                continue
+            if lazy:
+                json_decoders[key] = convert
+                convert = None
+            converters.append(convert)
+        return (converters, json_decoders) if lazy else converters
+    def _format_rows(self, rows, keys, col_refs, row_format='dict'):
+        """
+            generator converting db rows into row_format
+                'dict' - {'key': value}, LazyRow when Database(..., lazy_json=True)
+                'tuple' - values in key order
+                'namedtuple' - Row(key=value), '.' in join keys is replaced with '_' i.e Row.employees_name
+        """
+        if not row_format in {'dict', 'tuple', 'namedtuple'}:
+            raise InvalidInputError(f"invalid row_format {row_format}", "expected one of 'dict', 'tuple', 'namedtuple', 'columns', 'numpy'")
+        lazy = row_format == 'dict' and self.database.lazy_json
+        if lazy:
+            converters, json_decoders = self._row_converters(keys, col_refs, lazy=True)
+            lazy = len(json_decoders) > 0
+        else:
+            converters = self._row_converters(keys, col_refs)
+        convert = not all(c == None for c in converters)
+        if row_format == 'namedtuple':
+            row_class = get_row_class(tuple(keys))
+        for row in rows:
+            try:
+                values = [v if c == None else c(v) for c, v in zip(converters, row)] if convert else row
+            except Exception as e:
+                self.database.log.exception(f"error processing results on row {row} with {keys}")
+                raise
+            if lazy:
+                yield LazyRow(zip(keys, values), dict(json_decoders))
+            elif row_format == 'dict':
+                yield dict(zip(keys, values))
+            elif row_format == 'tuple':
+                yield tuple(values)
+            else:
+                yield row_class(*values)
+    def _format_result(self, rows, keys, col_refs, row_format='dict'):
+        if row_format == 'columns':
+            result = {key: [] for key in keys}
+            columns = [result[key] for key in keys]
+            for row in self._format_rows(rows, keys, col_refs, 'tuple'):
+                for column, v in zip(columns, row):
+                    column.append(v)
+            return result
+        return list(self._format_rows(rows, keys, col_refs, row_format))
+    def select(self, *selection, row_format='dict', **kw):
+        """
+        Usage: returns list of dictionaries for each selection in each row. 
+            tb = db.tables['stocks_new_tb2']
 
-        #dictonarify each row result and return
-        to_return = []
-        if not rows == None:
-            for row in rows:
-                r_dict = {}
-                for i,v in enumerate(row):
-                    try:
-                        if not v == None and col_refs[keys[i]].type == str and '{"' and '}' in v:
-                                r_dict[keys[i]] = json.loads(v)
-                        else:
-                            r_dict[keys[i]] = v if not col_refs[keys[i]].type == bool else bool(v)
-                    except Exception as e:
-                        self.database.log.exception(f"error processing results on row {row} index {i} value {v} with {keys}")
-                        assert False
-                to_return.append(r_dict)
-        return to_return
+            sel = tb.select('order_num',
+                            'symbol', 
+                            where={'trans': 'BUY', 'qty': 100})
+            sel = tb.select('*')
+            # Iterate through table, rows are read in pages by primary key - see iter_select & paginate
+            sel = [row for row in tb]
+            # Using Primary key only
+            sel = tb[0] # select * from <table> where <table_prim_key> = <val>
+
+            row_format - 'dict' (default), 'tuple', 'namedtuple' or 'columns'
+            tb.select('order_num', 'symbol', row_format='tuple')
+                [(1, 'RHAT'), (2, 'NTAP')]
+            tb.select('order_num', 'symbol', row_format='namedtuple')
+                [Row(order_num=1, symbol='RHAT'), Row(order_num=2, symbol='NTAP')]
+            tb.select('order_num', 'symbol', row_format='columns')
+                {'order_num': [1, 2], 'symbol': ['RHAT', 'NTAP']}
+            tb.select('order_num', 'symbol', row_format='numpy') # see select_columns
+                {'order_num': masked_array(data=[1, 2]), 'symbol': masked_array(data=['RHAT', 'NTAP'])}
+
+            orderby - 'col', 'col desc', ('col', 'desc') or a list of these, limit & offset - ints
+            tb.select('*', orderby=['symbol', 'order_num desc'], limit=50, offset=100)
+                SELECT * FROM stocks ORDER BY symbol ASC, order_num DESC LIMIT ? OFFSET ?
+        """
+        if row_format == 'numpy':
+            return self.select_columns(*selection, **kw)
+        plan = self._select_plan(selection, kw)
+        query, params = plan.query(kw)
+        return self.database._cached_get(plan.tables, query, params, plan._convert(row_format))
+    def select_columns(self, *selection, batch_size=5000, **kw):
+        """
+        Usage: same as select, but returns a numpy masked array per selected column, NULL values are masked. 
+            Requires numpy.
+
+            cols = db.tables['stocks'].select_columns('qty', 'price', where={'symbol': 'RHAT'})
+            cols['price'].mean()
+            cols['qty'].mask # True where qty is NULL
+
+            column types are stored as: int -> int64, float -> float64, bool -> bool, str / bytes -> object
+        """
+        query, params, keys, col_refs = self._select_query(selection, kw)
+        return self._column_arrays(self.database.iter_batches(query, params, batch_size), keys, col_refs)
+    def _column_arrays(self, batches, keys, col_refs):
+        """
+            builds the numpy masked array of each key from batches of db rows, see select_columns
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("select_columns requires numpy - pip install numpy")
+        dtypes = [NUMPY_DTYPES.get(col_refs[key].type, object) for key in keys]
+        converters = [c if not c == bool else None for c in self._row_converters(keys, col_refs)]
+        chunks = [[] for _ in keys]
+        masks = [[] for _ in keys]
+        for rows in batches:
+            for i, values in enumerate(zip(*rows)):
+                mask = None
+                if None in values:
+                    mask = numpy.fromiter((v is None for v in values), dtype=bool, count=len(values))
+                if dtypes[i] == object:
+                    convert = converters[i]
+                    array = numpy.empty(len(values), dtype=object)
+                    array[:] = values if convert == None else [convert(v) for v in values]
+                else:
+                    if mask is not None:
+                        values = [0 if v is None else v for v in values]
+                    array = numpy.array(values, dtype=dtypes[i])
+                chunks[i].append(array)
+                masks[i].append(mask)
+        result = {}
+        for i, key in enumerate(keys):
+            if len(chunks[i]) == 0:
+                result[key] = numpy.ma.MaskedArray(numpy.empty(0, dtype=dtypes[i]))
+                continue
+            data = numpy.concatenate(chunks[i]) if len(chunks[i]) > 1 else chunks[i][0]
+            mask = numpy.ma.nomask
+            if any(m is not None for m in masks[i]):
+                mask = numpy.concatenate([
+                    m if m is not None else numpy.zeros(len(chunk), dtype=bool) 
+                        for m, chunk in zip(masks[i], chunks[i])
+                ])
+            result[key] = numpy.ma.MaskedArray(data, mask=mask)
+        return result
+    def iter_select(self, *selection, batch_size=500, row_format='dict', **kw):
+        """
+        Usage: same as select, but returns a generator of rows. Rows are fetched
+            batch_size at a time, a connection is held until the generator is exhausted or closed.
+
+            for row in db.tables['stocks'].iter_select('*', where={'symbol': 'RHAT'}, batch_size=1000):
+                print(row)
+        """
+        if row_format == 'columns':
+            raise InvalidInputError(f"invalid row_format {row_format} for iter_select", "use select(..., row_format='columns')")
+        query, params, keys, col_refs = self._select_query(selection, kw)
+        return self._format_rows(self.database.iter_get(query, params, batch_size), keys, col_refs, row_format)
+    def paginate(self, *selection, page_size=50, after=None, desc=False, **kw):
+        """
+        Usage: generator returning pages (lists) of up to page_size rows ordered by primary key,
+            each page seeks past the primary key of the previous page (keyset pagination) instead of an OFFSET scan
+
+            for page in db.tables['stocks'].paginate('*', page_size=50, where={'symbol': 'RHAT'}):
+                print(page[-1]['order_num'])
+            # resume from the last primary key shown, i.e. a cursor returned by an API
+            page = next(db.tables['stocks'].paginate(page_size=50, after=last_order_num))
+                SELECT * FROM stocks WHERE order_num > ? ORDER BY order_num ASC LIMIT ?
+
+            selection defaults to '*', the primary key is added to the selection if missing
+            desc=True - pages in descending primary key order
+            row_format - any select row_format, a 'columns' / 'numpy' page is a dict of columns
+        """
+        key, page_kw = self._page_kw(page_size, after, desc, kw)
+        selection = self._page_selection(selection if selection else ('*',), key)
+        while True:
+            page = self.select(*selection, **page_kw)
+            rows, last = self._page_last(page, selection, key, kw)
+            if rows > 0:
+                yield page
+            if rows < page_size:
+                return
+            key, page_kw = self._page_kw(page_size, last, desc, kw)
+    def count(self, **kw):
+        """
+        Usage: number of rows matching where / join
+            db.tables['stocks'].count(where={'symbol': 'RHAT'})
+                SELECT count(*) FROM stocks WHERE symbol = ?
+            a failed query is logged & counts 0, as select returns [] (raised within a transaction)
+        """
+        return self._count_result(self.aggregate({'*': 'count'}, **kw))
+    def _count_result(self, rows):
+        # db.get returns no rows when the query failed outside of a transaction
+        return rows[0]['count(*)'] if rows else 0
+    def aggregate(self, aggregates, group_by=None, having=None, row_format='dict', **kw):
+        """
+        Usage: computes aggregates within the db, keys of each row are the group_by columns & '<function>(<column>)'
+            db.tables['stocks'].aggregate(
+                {'qty': 'sum', 'price': ['avg', 'max'], '*': 'count'},
+                group_by=['symbol'],
+                having=[['sum(qty)', '>', 100]],
+                where={'trans': 'BUY'},
+                orderby='sum(qty) desc'
+            )
+            query:
+                SELECT symbol, sum(qty), avg(price), max(price), count(*) FROM stocks WHERE trans = ? 
+                    GROUP BY symbol HAVING sum(qty) > ? ORDER BY sum(qty) DESC
+            result:
+                [{'symbol': 'RHAT', 'sum(qty)': 300, 'avg(price)': 35.5, 'max(price)': 36.0, 'count(*)': 3}]
+
+            functions - count, sum, min, max, avg, '*' is supported with count
+            having - [['<function>(<column>)', operator, value], ..] or {'<function>(<column>)': value}
+            accepts join, where, orderby, limit & offset as select, row_format - 'dict', 'tuple', 'namedtuple' or 'columns'
+        """
+        query, params, keys, col_refs = self._aggregate_query(aggregates, group_by, having, kw)
+        return self.database._cached_get(
+            self._join_tables(kw), query, params, lambda rows: self._format_result(rows, keys, col_refs, row_format))
+    def select_async_futures(self, *selection, **kw):
+        """
+        Usage: same as select, but runs on a db.executor thread returning a concurrent.futures.Future of the rows
+            futures = [tb.select_async_futures('*', where={'symbol': s}) for s in ['RHAT', 'NTAP']]
+            rhat, ntap = [f.result() for f in futures]
+        """
+        return self.database.executor.submit(self.select, *selection, **kw)
+    def prepare_select(self, *selection, join=None, where_columns=None, orderby=None, row_format='dict'):
+        """
+        Usage: returns a SelectPlan, a select compiled once & run with new values for where_columns
+            by_symbol = tb.prepare_select('order_num', 'qty', where_columns=['symbol'], orderby='order_num')
+            by_symbol('RHAT')
+                SELECT order_num,qty FROM stocks WHERE symbol = ? ORDER BY order_num ASC
+            by_symbol('RHAT', limit=10, where=[['qty', '>', 50]]) # conditions ANDed with where_columns
+            by_symbol.select(where={'qty': 100}) # any select of the plan selection & join
+
+        the join, selection & where_columns are validated once, tb.select uses plans of db.plan_cache
+        """
+        return SelectPlan(self, selection, join, where_columns, orderby, row_format)
+    def _missing_required(self, cols):
+        """
+            returns NOT NULL columns (without AUTO_INCREMENT) missing from cols
+        """
+        missing = []
+        for col_name, col in self.columns.items():
+            if not col_name in cols and not col.mods == None:
+                if 'NOT NULL' in col.mods and not 'INCREMENT' in col.mods:
+                    missing.append(col_name)
+        return missing
+    def _insert_sql(self, cols, row_count=1, upsert=False):
+        """
+            INSERT for row_count rows of cols, upsert updates cols of rows with an existing primary key
+        """
+        def build():
+            values = f"({', '.join([self.database.param]*len(cols))})"
+            query = f"INSERT INTO {self.name} ({', '.join(cols)}) VALUES {', '.join([values]*row_count)}"
+            if not upsert:
+                return query
+            update_cols = [col_name for col_name in cols if not col_name == self.prim_key]
+            if self.database.type == 'mysql':
+                set_cols = ', '.join([f"{col_name} = VALUES({col_name})" for col_name in update_cols])
+                return f"{query} ON DUPLICATE KEY UPDATE {set_cols if update_cols else f'{self.prim_key} = {self.prim_key}'}"
+            set_cols = ', '.join([f"{col_name} = excluded.{col_name}" for col_name in update_cols])
+            return f"{query} ON CONFLICT({self.prim_key}) {f'DO UPDATE SET {set_cols}' if update_cols else 'DO NOTHING'}"
+        return self._cached_sql(('upsert' if upsert else 'insert', self.name, cols, row_count), build)
     def insert(self, **kw):
         """
         Usage:
@@ -617,64 +2632,284 @@ class Table:
                 qty=100.0,
                 price=35.14)
         """
-        cols = '('
-        vals = '('
+        self._write(kw)
+    def upsert(self, **kw):
+        """
+        Usage: inserts row, or updates the provided columns if a row with the primary key exists
+            db.tables['keystore'].upsert(env='key1', val='value1')
+            query (sqlite):
+                INSERT INTO keystore (env, val) VALUES (?, ?) ON CONFLICT(env) DO UPDATE SET val = excluded.val
+            query (mysql):
+                INSERT INTO keystore (env, val) VALUES (%s, %s) ON DUPLICATE KEY UPDATE val = VALUES(val)
+        """
+        self._write(kw, upsert=True)
+    def _write(self, kw, upsert=False):
+        query, params = self._write_query(kw, upsert)
+        self.database.run(query, params)
+        self._invalidate(keys=[kw[self.prim_key]] if self.prim_key in kw else [])
+        self.database._table_written(self.name)
+    def _write_query(self, kw, upsert=False):
+        """
+            returns INSERT query & params for row kw, kw values are converted in place
+        """
+        if upsert and (self.prim_key == None or not self.prim_key in kw):
+            raise InvalidInputError(f"primary key {self.prim_key} is required for upsert in table {self.name}", "correct and try again")
         #checking input kw's for correct value types
 
         kw = self._process_input(kw)
 
-        for col_name, col in self.columns.items():
-            if not col_name in kw:
-                if not col.mods == None:
-                    if 'NOT NULL' in col.mods and not 'INCREMENT' in col.mods:
-                        raise InvalidInputError(f'{col_name} is a required field for INSERT in table {self.name}', "correct and try again")
-                continue
-            if len(cols) > 2:
-                cols = f'{cols}, '
-                vals = f'{vals}, '
-            cols = f'{cols}{col_name}'
-            #json handling
-            if kw[col_name]== 'NULL' or kw[col_name] == None or col.type == str and '{"' and '}' in kw[col_name]:
-                new_val = kw[col_name]
+        missing = self._missing_required(kw)
+        if len(missing) > 0:
+            raise InvalidInputError(f'{missing[0]} is a required field for INSERT in table {self.name}', "correct and try again")
+        cols = tuple(col_name for col_name in self.columns if col_name in kw)
+        return self._insert_sql(cols, upsert=upsert), [kw[col_name] for col_name in cols]
+    def insert_many(self, rows, batch_size=1000, return_keys=False):
+        """
+        Usage:
+            db.tables['stocks'].insert_many(
+                [
+                    {'date': '2006-01-05', 'trans': 'BUY', 'symbol': 'RHAT', 'qty': 100, 'price': 35.14},
+                    {'date': '2006-01-06', 'trans': 'SELL', 'symbol': 'RHAT', 'qty': 50, 'price': 36.01}
+                ], # or any iterable / generator of dicts
+                batch_size=1000,
+                return_keys=True
+            )
+            {'inserted': 2, 'batches': 1, 'keys': [1, 2]}
+
+            rows are validated once per distinct set of columns & committed once per batch. 
+            mysql batches are sent as a multi-row INSERT sized below max_allowed_packet.
+            return_keys - include the primary key of each row, generated keys require 1 statement per row
+        """
+        return self._write_many(rows, batch_size, return_keys)
+    def upsert_many(self, rows, batch_size=1000):
+        """
+        Usage: upsert for each row, batched & committed like insert_many
+            db.tables['keystore'].upsert_many(
+                [{'env': 'key1', 'val': 'value1'}, {'env': 'key2', 'val': 'value2'}]
+            )
+            {'upserted': 2, 'batches': 1}
+        """
+        return self._write_many(rows, batch_size, upsert=True)
+    def _write_many(self, rows, batch_size=1000, return_keys=False, upsert=False):
+        result = self._write_many_result(return_keys, upsert)
+        max_bytes = int(self.database.get_max_packet() * 0.75) if self.database.type == 'mysql' else None
+        for batch in self._write_batches(rows, batch_size, return_keys, upsert, max_bytes):
+            keys = self.database.executemany(batch['query'], batch['params'], return_keys=batch['generate_keys'])
+            self._write_batch_done(result, batch, keys)
+        return result
+    def _write_many_result(self, return_keys=False, upsert=False):
+        result = {'upserted' if upsert else 'inserted': 0, 'batches': 0}
+        if return_keys:
+            result['keys'] = []
+        return result
+    def _write_batches(self, rows, batch_size=1000, return_keys=False, upsert=False, max_bytes=None):
+        """
+            generator returning a statement per batch of rows:
+                {'query': .., 'params': [..], 'generate_keys': bool, 'cols': (..), 'rows': [[..], ..]}
+            batches are split on a new set of columns, batch_size or max_bytes (multi-row INSERT)
+        """
+        plans = {}
+        batch, batch_bytes, batch_plan = [], 0, None
+        def insert_plan(row_cols):
+            for col_name in row_cols:
+                if not col_name in self.columns:
+                    raise InvalidInputError(f"{col_name} is not a valid column in table {self.name}", f"valid columns {self.columns}")
+            missing = self._missing_required(row_cols)
+            if len(missing) > 0:
+                raise InvalidInputError(f'{missing[0]} is a required field for INSERT in table {self.name}', "correct and try again")
+            if upsert and not self.prim_key in row_cols:
+                raise InvalidInputError(f"primary key {self.prim_key} is required for upsert in table {self.name}", "correct and try again")
+            return {
+                'cols': row_cols,
+                'columns': [self.columns[col_name] for col_name in row_cols],
+                'generates_key': not self.prim_key in row_cols
+            }
+        def statement():
+            cols = batch_plan['cols']
+            generate_keys = return_keys and batch_plan['generates_key']
+            if max_bytes is None or generate_keys or len(batch) == 1:
+                query, params = self._insert_sql(cols, upsert=upsert), batch
             else:
-                new_val = kw[col_name] if col.type is not str else f'"{kw[col_name]}"'
-            vals = f'{vals}{new_val}'
+                query = self._insert_sql(cols, len(batch), upsert=upsert)
+                params = [[v for row_params in batch for v in row_params]]
+            return {'query': query, 'params': params, 'generate_keys': generate_keys, 'cols': cols, 'rows': batch}
+        for row in rows:
+            row_cols = tuple(row)
+            if not row_cols in plans:
+                plans[row_cols] = insert_plan(row_cols)
+            plan = plans[row_cols]
+            params = [self._to_db_value(column, row[column.name]) for column in plan['columns']]
+            row_bytes = 0
+            if max_bytes is not None:
+                row_bytes = sum(mysql_literal_bytes(v) for v in params)
+            # rows are sent in input order, so a new set of columns starts a new batch
+            if len(batch) > 0 and (
+                not plan is batch_plan or len(batch) >= batch_size or 
+                (max_bytes is not None and batch_bytes + row_bytes > max_bytes)):
+                yield statement()
+                batch, batch_bytes = [], 0
+            batch_plan = plan
+            batch.append(params)
+            batch_bytes+=row_bytes
+        if len(batch) > 0:
+            yield statement()
+    def _write_batch_done(self, result, batch, keys=None):
+        """
+            records a written batch from _write_batches in result, keys - generated keys if requested
+        """
+        cols = batch['cols']
+        if 'keys' in result:
+            if batch['generate_keys']:
+                result['keys'].extend(keys)
+            else:
+                key_index = cols.index(self.prim_key)
+                result['keys'].extend(params[key_index] for params in batch['rows'])
+        if self.cache is not None and self.prim_key in cols:
+            key_index = cols.index(self.prim_key)
+            self._invalidate(keys=[params[key_index] for params in batch['rows']])
+        self.database._table_written(self.name)
+        result['upserted' if 'upserted' in result else 'inserted']+=len(batch['rows'])
+        result['batches']+=1
+    def update_many(self, rows, batch_size=1000):
+        """
+        Usage: updates each row by primary key, setting the other columns of the row
+            db.tables['stocks'].update_many(
+                [
+                    {'order_num': 1, 'qty': 50},
+                    {'order_num': 2, 'qty': 75},
+                    {'order_num': 3, 'qty': 80, 'price': 36.0}
+                ], # or any iterable / generator of dicts
+                batch_size=1000
+            )
+            {'updated': 3, 'batches': 2}
+            query:
+                UPDATE stocks SET qty = ? WHERE order_num = ?
 
-        cols = cols + ')'
-        vals = vals + ')'
+            rows are sent with executemany & committed once per batch, a new set of columns starts a new batch
+        """
+        result = {'updated': 0, 'batches': 0}
+        for batch in self._update_batches(rows, batch_size):
+            rowcount = self.database.executemany(batch['query'], batch['params'])
+            self._many_done(result, 'updated', batch['keys'], rowcount)
+        return result
+    def delete_many(self, keys, batch_size=1000):
+        """
+        Usage: deletes the rows with primary keys in keys
+            db.tables['stocks'].delete_many([1, 2, 3], batch_size=1000)
+            {'deleted': 3, 'batches': 1}
+            query:
+                DELETE FROM stocks WHERE order_num in (?, ?, ?)
 
-        query = f'INSERT INTO {self.name} {cols} VALUES {vals}'
-        self.database.log.debug(query)
-        self.database.run(query)
+            keys are deleted in batches of batch_size (at most 999 on sqlite), each in 1 transaction
+        """
+        result = {'deleted': 0, 'batches': 0}
+        for batch in self._delete_batches(keys, batch_size):
+            rowcount, = self.database.run_many([(batch['query'], batch['params'])])
+            self._many_done(result, 'deleted', batch['keys'], rowcount)
+        return result
+    def _update_batches(self, rows, batch_size=1000):
+        """
+            generator returning {'query': .., 'params': [..], 'keys': [..]} per batch of rows for update_many, 
+            batches are split on a new set of columns or batch_size
+        """
+        if self.prim_key is None:
+            raise InvalidInputError(f"table {self.name} has no primary key", "update_many requires a primary key")
+        key_column = self.columns[self.prim_key]
+        plans = {}
+        batch, keys, batch_plan = [], [], None
+        def update_plan(row_cols):
+            if not self.prim_key in row_cols:
+                raise InvalidInputError(f"primary key {self.prim_key} is required for update_many in table {self.name}", "correct and try again")
+            cols = tuple(col_name for col_name in row_cols if not col_name == self.prim_key)
+            if len(cols) == 0:
+                raise InvalidInputError(f"no columns to update in {row_cols}", f"expected a column of {self.name} other than {self.prim_key}")
+            for col_name in cols:
+                if not col_name in self.columns:
+                    raise InvalidInputError(f"{col_name} is not a valid column in table {self.name}", f"valid columns {self.columns}")
+            where_shape = (('value', self.prim_key, '='),)
+            query = self._cached_sql(('update', self.name, cols, where_shape), lambda: 'UPDATE {name} SET {cols_vals} {where}'.format(
+                name=self.name,
+                cols_vals=', '.join([f"{col_name} = {self.database.param}" for col_name in cols]),
+                where=self._where_sql(where_shape)
+            ))
+            return {'query': query, 'columns': [self.columns[col_name] for col_name in cols]}
+        for row in rows:
+            row_cols = tuple(row)
+            if not row_cols in plans:
+                plans[row_cols] = update_plan(row_cols)
+            plan = plans[row_cols]
+            if len(batch) > 0 and (not plan is batch_plan or len(batch) >= batch_size):
+                yield {'query': batch_plan['query'], 'params': batch, 'keys': keys}
+                batch, keys = [], []
+            batch_plan = plan
+            key = self._to_db_value(key_column, row[self.prim_key])
+            batch.append([self._to_db_value(column, row[column.name]) for column in plan['columns']] + [key])
+            keys.append(key)
+        if len(batch) > 0:
+            yield {'query': batch_plan['query'], 'params': batch, 'keys': keys}
+    def _delete_batches(self, keys, batch_size=1000):
+        """
+            generator returning {'query': .., 'params': [..], 'keys': [..]} per batch_size keys for delete_many
+        """
+        if self.prim_key is None:
+            raise InvalidInputError(f"table {self.name} has no primary key", "delete_many requires a primary key")
+        keys = list(keys)
+        if self.database.type == 'sqlite':
+            # each key is a bound variable, limited to SQLITE_MAX_VARIABLE_NUMBER before sqlite 3.32
+            batch_size = min(batch_size, SQLITE_MAX_VARIABLES)
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i+batch_size]
+            query, params = self._delete_query(self._where({'where': [[self.prim_key, 'in', batch]]}))
+            yield {'query': query, 'params': params, 'keys': batch}
+    def _many_done(self, result, action, keys, rowcount):
+        """
+            records a batch of update_many / delete_many in result & invalidates the cached rows of keys
+        """
+        self._invalidate(keys=keys)
+        self._invalidate_references()
+        self.database._table_written(self.name)
+        result[action]+= rowcount if rowcount is not None and rowcount >= 0 else len(keys)
+        result['batches']+=1
     def update(self,**kw):
         """
         Usage:
             db.tables['stocks'].update(symbol='NTAP',trans='SELL', where={'order_num': 1})
         """
-        
+        self.database.run(*self._update_query(kw))
+        self._written(kw)
+    def _update_query(self, kw):
+        """
+            returns UPDATE query & params for kw, kw values are converted in place
+        """
         kw = self._process_input(kw)
 
-        cols_to_set = ''
+        cols, params = [], []
         for col_name, col_val in kw.items():
             if col_name.lower() == 'where':
                 continue
-            if len(cols_to_set) > 1:
-                cols_to_set = f'{cols_to_set}, '
-            #JSON detection
-            if col_val == 'NULL' or self.columns[col_name].type == str and '{"' and '}' in col_val:
-                column_value = col_val
-            else:
-                column_value = col_val if self.columns[col_name].type is not str else f"'{col_val}'"
-            cols_to_set = f'{cols_to_set}{col_name} = {column_value}'
-
-        where_sel = self.__where(kw)
-        query = 'UPDATE {name} SET {cols_vals} {where}'.format(
-            name=self.name,
-            cols_vals=cols_to_set,
-            where=where_sel
-        )
-        self.database.log.debug(query)
-        self.database.run(query)
+            if not col_name in self.columns:
+                raise InvalidInputError(f"{col_name} is not a valid column in table {self.name}", f"valid columns {self.columns}")
+            cols.append(col_name)
+            params.append(col_val)
+        cols = tuple(cols)
+        where_shape, where_params = self._where(kw)
+        def build():
+            return 'UPDATE {name} SET {cols_vals} {where}'.format(
+                name=self.name,
+                cols_vals=', '.join([f"{col_name} = {self.database.param}" for col_name in cols]),
+                where=self._where_sql(where_shape)
+            )
+        query = self._cached_sql(('update', self.name, cols, where_shape), build)
+        return query, params + where_params
+    def _written(self, kw):
+        """
+            invalidates cached rows after an update / delete with kw
+        """
+        self._invalidate(kw['where'] if 'where' in kw else None)
+        if self.prim_key in kw:
+            self._invalidate(keys=[kw[self.prim_key]])
+        self._invalidate_references()
+        self.database._table_written(self.name)
     def delete(self, all_rows=False, **kw):
         """
         Usage:
@@ -682,51 +2917,827 @@ class Table:
             db.tables['stocks'].delete(all_rows=True)
         """
         try:
-            where_sel = self.__where(kw)
+            where = self._where(kw)
         except Exception as e:
             return repr(e)
-        if len(where_sel) < 1 and not all_rows:
+        self.database.run(*self._delete_query(where, all_rows))
+        self._written(kw)
+    def _delete_query(self, where, all_rows=False):
+        """
+            returns DELETE query & params for where, parsed with _where
+        """
+        where_shape, params = where
+        if len(where_shape) < 1 and not all_rows:
             error = "where statment is required with DELETE, otherwise specify .delete(all_rows=True)"
             raise InvalidInputError(error, "correct & try again later")
-        query = "DELETE FROM {name} {where}".format(
-            name=self.name,
-            where=where_sel
-        )
-        self.database.run(query)
+        def build():
+            return "DELETE FROM {name} {where}".format(
+                name=self.name,
+                where=self._where_sql(where_shape)
+            )
+        return self._cached_sql(('delete', self.name, where_shape), build), params
     def __get_val_column(self):
         if len(self.columns.keys()) == 2:
             for key in list(self.columns.keys()):
                 if not key == self.prim_key:
                     return key
 
-    def __getitem__(self, key_val):
+    def enable_cache(self, max_size=1024, ttl=None):
+        """
+        Usage: caches rows read by primary key with tb[key] & key in tb, 
+            entries are updated or removed by insert / update / delete / tb[key] = value
+
+            db.tables['keystore'].enable_cache(max_size=1000, ttl=60)
+            db.tables['keystore'].cache.stats
+                {'hits': 10, 'misses': 2, 'evictions': 0}
+
+            also enabled with db.create_table(..., cache={'max_size': 1000, 'ttl': 60})
+        Note: writes not made through this table, i.e. db.run() or other processes,
+            are only seen once the cached entry expires or tb.cache.clear() is called.
+            The cache is bypassed within a transaction, as rows read there may be uncommitted
+        """
+        self.cache = LRUCache(max_size, ttl)
+        return self.cache
+    def disable_cache(self):
+        self.cache = None
+    def _cache_key(self, key_val):
+        return self._to_db_value(self.columns[self.prim_key], key_val)
+    def _get_row(self, key_val):
+        # rows read within a transaction may be uncommitted, so are neither read from nor stored in the cache
+        cache = self.cache if not self.database.in_transaction() else None
+        if cache is not None:
+            row = cache.get(self._cache_key(key_val))
+            if row is not None:
+                return deepcopy(row)
         val = self.select('*', where={self.prim_key: key_val})
-        if not val == None and len(val) > 0:
-            if len(self.columns.keys()) == 2:
-                return val[0][self.__get_val_column()] # returns 
-            return val[0]
-        return None
+        if val == None or len(val) == 0:
+            return None
+        if cache is not None:
+            # deep copies, so nested JSON values of returned rows do not share state with the cache
+            cache.set(self._cache_key(key_val), deepcopy(val[0].copy()))
+        return val[0]
+    def _invalidate(self, where=None, keys=None):
+        """
+            removes cached rows matching where or with primary keys in keys, 
+            clearing all cached rows when the matching keys cannot be determined from where
+        """
+        if self.cache is None:
+            return
+        if keys is None:
+            if not isinstance(where, dict) or not len(where) == 1 or not self.prim_key in where:
+                return self.cache.clear()
+            keys = [where[self.prim_key]]
+        for key in keys:
+            try:
+                self.cache.pop(self._cache_key(key))
+            except Exception:
+                return self.cache.clear()
+    def _invalidate_references(self):
+        """
+            clears cached rows of tables referencing this table, which may change via ON UPDATE / DELETE CASCADE
+        """
+        for table in self.database.tables.loaded():
+            if table.cache is not None and table.foreign_keys:
+                for foreign_key in table.foreign_keys.values():
+                    if foreign_key['table'] == self.name:
+                        table.cache.clear()
+                        table._invalidate_references()
+                        break
+    def _item_value(self, row):
+        """ value returned by tb[key] for row, the value column of 2 column tables """
+        if row is None:
+            return None
+        if len(self.columns.keys()) == 2:
+            return row[self.__get_val_column()] # returns 
+        return row
+    def _item_values(self, key, values):
+        """ column values of row key for tb[key] = values """
+        val_column = self.__get_val_column()
+        if not val_column == None and (not isinstance(values, dict) or not set(values) <= set(self.columns)):
+            values = {val_column: values}
+        return {**values, self.prim_key: key}
+    def __getitem__(self, key_val):
+        return self._item_value(self._get_row(key_val))
     def __setitem__(self, key, values):
-        if not self[key] == None:
-            if not isinstance(values, dict) and len(self.columns.keys()) == 2:
-                return self.update(**{self.__get_val_column(): values}, where={self.prim_key: key})
-            return self.update(**values, where={self.prim_key: key})
-        if not isinstance(values, dict) and len(self.columns.keys()) == 2:
-            return self.insert(**{self.prim_key: key, self.__get_val_column(): values})
-        if len(self.columns.keys()) == 2 and isinstance(values, dict) and not self.prim_key in values:
-            return self.insert(**{self.prim_key: key, self.__get_val_column(): values})
-        if len(values) == len(self.columns):
-            return self.insert(**values)
+        values = self._item_values(key, values)
+        if len(self._missing_required(values)) > 0:
+            # partial update of a row with NOT NULL columns, which an upsert cannot insert
+            values.pop(self.prim_key)
+            if not self._get_row(key) == None:
+                return self.update(**values, where={self.prim_key: key})
+            values[self.prim_key] = key
+        return self.upsert(**values)
 
     def __contains__(self, key):
-        if self[key] == None:
+        if self._get_row(key) == None:
             return False
         return True
     def __iter__(self):
-        def gen():
-            for row in self.select('*'):
+        # pages of 500 rows are read by primary key, so no cursor is held while the loop writes to the table
+        if self.prim_key is None:
+            return iter(self.select('*'))
+        return (row for page in self.paginate('*', page_size=500) for row in page)
+class SelectPlan:
+    """
+        select of a Table compiled once - the resolved join, validated selection, result keys & TableColumn
+        of each key. Created by Table.prepare_select, or by Table.select & kept in db.plan_cache.
+            plan(*values, **kw) - runs the select with values bound to where_columns
+            plan.select(**kw) - runs the select with kw where, orderby, limit, offset & row_format
+        plans compile again when a table of the db is created or loaded
+    """
+    def __init__(self, table, selection, join=None, where_columns=None, orderby=None, row_format='dict'):
+        if not row_format in {'dict', 'tuple', 'namedtuple', 'columns'}:
+            raise InvalidInputError(f"invalid row_format {row_format}", "expected one of 'dict', 'tuple', 'namedtuple', 'columns'")
+        self.table = table
+        self.database = table.database
+        self.selection = tuple(selection)
+        self.join = join
+        self.where_columns = tuple(where_columns) if where_columns is not None else ()
+        self.orderby = orderby
+        self.row_format = row_format
+        self._compile()
+    def _compile(self):
+        table = self.table
+        self.version = self.database.tables.version
+        kw = {'join': self.join} if self.join is not None else {}
+        self.select_item, self.keys, self.col_refs = table._compile_selection(self.selection, kw)
+        self.join_key = table._join_key(kw)
+        self.tables = table._join_tables(kw)
+        self.join_sql = table._join(kw)
+        self.columns = [table._where_column(col_name) for col_name in self.where_columns]
+        # statement of plan(*values), an empty where clause without where_columns
+        where_shape = tuple(('value', col_name, '=') for col_name in self.where_columns)
+        self.sql = self._sql(where_shape, table._orderby({'orderby': self.orderby}), ())
+    def _sql(self, where_shape, orderby, limit_shape):
+        table = self.table
+        return 'SELECT {select_item} FROM {name} {join}{where}{order}{limit}'.format(
+            select_item = self.select_item,
+            name = table.name,
+            join = self.join_sql,
+            where = table._where_sql(where_shape),
+            order = ' ORDER BY '+ ', '.join([f"{col_name} {direction}" for col_name, direction in orderby]) if orderby else '',
+            limit = table._limit_sql(limit_shape)
+        )
+    def query(self, kw):
+        """
+            returns (query, params) for kw where / orderby / limit / offset
+        """
+        if not self.version == self.database.tables.version:
+            self._compile()
+        table = self.table
+        where_shape, params = table._where(kw)
+        orderby = table._orderby(kw)
+        limit_shape, limit_params = table._limit(kw)
+        query = table._cached_sql(
+            ('select', table.name, self.select_item, self.join_key, where_shape, orderby, limit_shape), 
+            lambda: self._sql(where_shape, orderby, limit_shape))
+        return query, params + limit_params
+    def _convert(self, row_format):
+        return lambda rows: self.table._format_result(rows, self.keys, self.col_refs, row_format)
+    def select(self, row_format=None, **kw):
+        if self.orderby is not None and not 'orderby' in kw:
+            kw['orderby'] = self.orderby
+        query, params = self.query(kw)
+        return self.database._cached_get(self.tables, query, params, self._convert(row_format or self.row_format))
+    def __call__(self, *values, row_format=None, **kw):
+        if not len(values) == len(self.where_columns):
+            raise InvalidInputError(
+                f"{len(values)} values for where_columns {self.where_columns}", 
+                f"expected a value for each of {self.where_columns}")
+        if len(kw) > 0 or any(v is None for v in values) or not self.version == self.database.tables.version:
+            where = kw.pop('where') if 'where' in kw else []
+            where = [dict(zip(self.where_columns, values))] + ([where] if isinstance(where, dict) else list(where))
+            return self.select(row_format, where=where, **kw)
+        params = [self.table._to_db_value(column, v) for column, v in zip(self.columns, values)]
+        return self.database._cached_get(self.tables, self.sql, params, self._convert(row_format or self.row_format))
+class Pipeline:
+    """
+        statements collected by db.pipeline(), p.tables[name] mirrors the query methods of Table, 
+        each returning the index of its statement in p.results:
+            select - formatted rows, see Table.select
+            insert / upsert / update / delete / run - number of affected rows (run - rows if returned)
+        p.results is None until the pipeline has run
+    """
+    def __init__(self, database):
+        self.database = database
+        self.statements = []
+        self.results = None
+        self._handlers = []
+        # table proxies are created on first access, like lazy db.tables
+        self.tables = TableMap(lambda name: self.tables.__setitem__(name, PipelineTable(self, database.tables[name])))
+        self.tables.set_pending(database.tables)
+    def add(self, query, params=None, handler=None):
+        """
+            adds statement query with params, handler(result) converts its result once run
+        """
+        self.statements.append((query, params))
+        self._handlers.append(handler)
+        return len(self.statements) - 1
+    def run(self, query, params=None):
+        return self.add(query, params)
+    def _complete(self, results):
+        self.results = [result if handler is None else handler(result) for handler, result in zip(self._handlers, results)]
+class PipelineTable:
+    """
+        Table proxy of a Pipeline, query methods add their statement to the pipeline
+    """
+    def __init__(self, pipeline, table):
+        self.pipeline = pipeline
+        self.table = table
+    def select(self, *selection, row_format='dict', **kw):
+        if row_format == 'numpy':
+            raise InvalidInputError(f"invalid row_format {row_format} for pipeline select", "use select_columns outside of the pipeline")
+        table = self.table
+        query, params, keys, col_refs = table._select_query(selection, kw)
+        return self.pipeline.add(query, params, lambda rows: table._format_result(rows, keys, col_refs, row_format))
+    def insert(self, **kw):
+        return self._write(kw)
+    def upsert(self, **kw):
+        return self._write(kw, upsert=True)
+    def _write(self, kw, upsert=False):
+        table = self.table
+        query, params = table._write_query(kw, upsert)
+        keys = [kw[table.prim_key]] if table.prim_key in kw else []
+        def written(rowcount):
+            table._invalidate(keys=keys)
+            table.database._table_written(table.name)
+            return rowcount
+        return self.pipeline.add(query, params, written)
+    def update(self, **kw):
+        return self.pipeline.add(*self.table._update_query(kw), self._written(kw))
+    def delete(self, all_rows=False, **kw):
+        return self.pipeline.add(*self.table._delete_query(self.table._where(kw), all_rows), self._written(kw))
+    def _written(self, kw):
+        def written(rowcount):
+            self.table._written(kw)
+            return rowcount
+        return written
+class AsyncDatabase(Database):
+    """
+        asyncio version of Database for async db drivers, tables are AsyncTable's sharing the SQL of Table
+
+        aiosqlite example:
+            import aiosqlite
+            db = await AsyncDatabase.create(aiosqlite.connect, database="testdb")
+        aiomysql example:
+            import aiomysql
+            db = await AsyncDatabase.create(aiomysql.connect, type='mysql', **config)
+
+            rows = await db.get(f"SELECT * FROM stocks WHERE symbol = {db.param}", ['RHAT'])
+            async with db.transaction():
+                await db.tables['stocks'].insert(**trade)
+
+        accepts the options of Database, connections are pooled by an AsyncConnectionPool (db.pool).
+        Connections of db.transaction() / autocommit=False are bound to the calling asyncio task, 
+        tasks started within a transaction share its connection.
+    """
+    def __init__(self, db_con, **kw):
+        self._configure(db_con, kw)
+        if self.lazy_tables:
+            raise InvalidInputError("lazy_tables=True", "lazy_tables is not supported by AsyncDatabase, use schema_cache")
+        connect_config = dict(self.connect_config)
+        if self.type == 'mysql' and 'database' in connect_config:
+            # aiomysql.connect names the database 'db'
+            connect_config['db'] = connect_config.pop('database')
+        self.pool = AsyncConnectionPool(self.db_con, connect_config, **self._pool_config(kw))
+        self.connect = self.pool.connection
+        # {'conn': connection, 'depth': transaction depth} of the calling task
+        self._task_conn = contextvars.ContextVar(f'pyql_conn_{id(self)}', default=None)
+    @classmethod
+    async def create(cls, db_con, **kw):
+        """
+            returns an AsyncDatabase with an open pool & loaded tables
+        """
+        db = cls(db_con, **kw)
+        await db.pool.open()
+        await db.load_tables()
+        return db
+    async def _init_session(self, conn):
+        if len(self.session_init) == 0:
+            return
+        c = await conn.cursor()
+        try:
+            for statement in self.session_init:
+                if callable(statement):
+                    await _maybe_await(statement(conn))
+                    continue
+                await c.execute(statement)
+                if c.description is not None:
+                    await c.fetchall()
+        finally:
+            await _maybe_await(c.close())
+        await conn.commit()
+    def __contains__(self, table):
+        """ True if table is loaded in db.tables, see has_table """
+        return table in self.tables
+    async def has_table(self, table):
+        return len(await self.get(self._has_table_query(), [table]) or []) > 0
+    @asynccontextmanager
+    async def cursor(self):
+        state = self._task_conn.get()
+        if state is None and not self.autocommit:
+            state = self._pin(await self.pool.checkout())
+        if state is not None:
+            # commit is deferred to the end of db.transaction() or db.commit()
+            c = await state['conn'].cursor()
+            try:
+                yield c
+            finally:
+                await _maybe_await(c.close())
+            return
+        async with self.connect() as conn:
+            c = await conn.cursor()
+            try:
+                yield c
+                await conn.commit()
+            finally:
+                await _maybe_await(c.close())
+    def _pin(self, conn):
+        """ binds conn to the calling task, used for all queries until unpinned """
+        state = {'conn': conn, 'depth': 0, 'written': set()}
+        self._task_conn.set(state)
+        return state
+    async def _unpin(self, discard=False):
+        state = self._task_conn.get()
+        self._task_conn.set(None)
+        await self.pool.checkin(state['conn'], discard)
+        self._invalidate_written(state['written'])
+    def _written_tables(self):
+        state = self._task_conn.get()
+        return state['written'] if state is not None else None
+    def in_transaction(self):
+        return self._task_conn.get() is not None
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Usage:
+            async with db.transaction():
+                await db.tables['stocks'].insert(**trade)
+                async with db.transaction(): # nested blocks use savepoints
+                    await db.tables['stocks'].delete(where={'order_num': 1})
+        """
+        state = self._task_conn.get()
+        owner = state is None
+        if owner:
+            state = self._pin(await self.pool.checkout())
+        conn = state['conn']
+        savepoint = None if owner else f"pyql_savepoint_{state['depth']}"
+        async def execute(statement):
+            c = await conn.cursor()
+            try:
+                await c.execute(statement)
+            finally:
+                await _maybe_await(c.close())
+        try:
+            await execute(f"SAVEPOINT {savepoint}" if savepoint else 'BEGIN' if self.type == 'sqlite' else 'START TRANSACTION')
+        except Exception:
+            if owner:
+                await self._unpin(discard=True)
+            raise
+        state['depth']+=1
+        try:
+            yield self
+        except BaseException:
+            state['depth']-=1
+            self.clear_caches()
+            if owner:
+                discard = False
+                try:
+                    await conn.rollback()
+                except Exception as e:
+                    self.log.exception(f"exception rolling back transaction {repr(e)}")
+                    discard = True
+                await self._unpin(discard)
+            else:
+                await execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                await execute(f"RELEASE SAVEPOINT {savepoint}")
+            raise
+        state['depth']-=1
+        if not owner:
+            await execute(f"RELEASE SAVEPOINT {savepoint}")
+            return
+        try:
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+        finally:
+            await self._unpin()
+    async def commit(self):
+        await self._end_pinned('commit')
+    async def rollback(self):
+        await self._end_pinned('rollback')
+    async def _end_pinned(self, action):
+        state = self._task_conn.get()
+        if state is None:
+            return
+        if state['depth'] > 0:
+            raise InvalidInputError(
+                f"{action} called within db.transaction()", 
+                "db.transaction() blocks commit on exit or rollback when an exception is raised")
+        try:
+            await getattr(state['conn'], action)()
+        finally:
+            await self._unpin()
+            if action == 'rollback':
+                self.clear_caches()
+    @property
+    def executor(self):
+        raise InvalidInputError(f"{self.db_name}.executor is not available on an AsyncDatabase", "use asyncio.gather(db.get(..), ..)")
+    def submit(self, query, params=None):
+        raise InvalidInputError(f"{self.db_name}.submit(...) is not available on an AsyncDatabase", "use asyncio.gather(db.get(query, params), ..)")
+    async def close(self):
+        await self.pool.close()
+    async def run(self, query, params=None):
+        return await self.get(query, params)
+    async def get(self, query, params=None, convert=None):
+        """
+        runs query, returning any selected rows as a list of tuples, see Database.get
+        """
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.get query: {query} params: {params}')
+        timer = self._timer('get', query, params)
+        async with self.cursor() as c:
+            timer.phase('connect')
+            try:
+                if params is None:
+                    await c.execute(query)
+                else:
+                    await c.execute(query, params)
+                timer.phase('execute')
+                rows = await c.fetchall() if c.description is not None else []
+                count = len(rows) if c.description is not None else c.rowcount
+                timer.phase('fetch')
+            except Exception as e:
+                timer.error(e)
+                self.log.exception(f"exception in .get {repr(e)}")
+                if self.in_transaction():
+                    raise
+                return None if convert is None else convert([])
+        # commit
+        timer.phase('execute')
+        if convert is not None:
+            rows = convert(rows)
+            timer.phase('convert')
+        timer.done(count)
+        return rows
+    async def _cached_get(self, tables, query, params, convert):
+        cache = self.result_cache
+        if cache is None or not cache.caches(tables) or self.in_transaction():
+            return await self.get(query, params, convert=convert)
+        key = (query, tuple(params))
+        rows = cache.get(key)
+        if rows is None:
+            generation = cache.generation(tables)
+            rows = await self.get(query, params)
+            if rows is None:
+                return convert([])
+            cache.set(key, tables, generation, rows)
+        return convert(rows)
+    async def iter_get(self, query, params=None, batch_size=500):
+        """
+        async generator returning rows of query, see Database.iter_get
+            async for row in db.iter_get('SELECT * FROM stocks'):
+        """
+        async for rows in self.iter_batches(query, params, batch_size):
+            for row in rows:
+                yield row
+    async def iter_batches(self, query, params=None, batch_size=500):
+        """
+        async generator returning lists of up to batch_size rows of query, see Database.iter_get
+        """
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.iter_batches query: {query} params: {params}')
+        params = [] if params is None else params
+        timer = self._timer('iter_batches', query, params)
+        count = 0
+        state = self._task_conn.get()
+        pinned = state is not None
+        conn = state['conn'] if pinned else await self.pool.checkout()
+        c = await conn.cursor()
+        timer.phase('connect')
+        discard = False
+        try:
+            await c.execute(query, params)
+            timer.phase('execute')
+            if c.description is None:
+                timer.done(c.rowcount)
+                return
+            if pinned:
+                # transaction connection may be used within the loop, so rows are read upfront
+                rows = await c.fetchall()
+                timer.phase('fetch')
+                for i in range(0, len(rows), batch_size):
+                    yield rows[i:i+batch_size]
+                timer.done(len(rows))
+                return
+            while True:
+                rows = await c.fetchmany(batch_size)
+                timer.phase('fetch')
+                if not rows:
+                    break
+                count+= len(rows)
+                yield rows
+                timer.resume()
+            timer.done(count)
+        except Exception as e:
+            timer.error(e)
+            self.log.exception(f"exception in .iter_batches {repr(e)}")
+            discard = not pinned
+            raise
+        finally:
+            try:
+                await _maybe_await(c.close())
+            except Exception:
+                discard = not pinned
+            if not pinned:
+                if not discard:
+                    try:
+                        await conn.rollback()
+                    except Exception:
+                        discard = True
+                await self.pool.checkin(conn, discard)
+    async def executemany(self, query, params_list, return_keys=False):
+        """
+        runs query once for each set of params in params_list, see Database.executemany
+        """
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.executemany query: {query} rows: {len(params_list)}')
+        timer = self._timer('executemany', query, params_list)
+        keys, rowcount = None, None
+        async with self.cursor() as c:
+            timer.phase('connect')
+            try:
+                if return_keys:
+                    keys = []
+                    for params in params_list:
+                        await c.execute(query, params)
+                        keys.append(c.lastrowid)
+                elif len(params_list) == 1:
+                    await c.execute(query, params_list[0])
+                else:
+                    await c.executemany(query, params_list)
+                rowcount = c.rowcount
+            except Exception as e:
+                timer.error(e)
+                self.log.exception(f"exception in .executemany {repr(e)}")
+                raise
+        # includes commit
+        timer.phase('execute')
+        timer.done(len(params_list))
+        return keys if return_keys else rowcount
+    async def run_many(self, statements):
+        """
+        runs statements on 1 connection & cursor within 1 transaction, see Database.run_many
+        """
+        statements = [(statement, None) if isinstance(statement, str) else statement for statement in statements]
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(f'{self.db_name}.run_many statements: {len(statements)}')
+        results = []
+        async with self.transaction():
+            async with self.cursor() as c:
+                timer = NULL_TIMER
+                try:
+                    for query, params in statements:
+                        timer = self._timer('run_many', query, params)
+                        if params is None:
+                            await c.execute(query)
+                        else:
+                            await c.execute(query, params)
+                        timer.phase('execute')
+                        results.append(await c.fetchall() if c.description is not None else c.rowcount)
+                        timer.phase('fetch')
+                        timer.done(len(results[-1]) if c.description is not None else c.rowcount)
+                except Exception as e:
+                    timer.error(e)
+                    self.log.exception(f"exception in .run_many {repr(e)}")
+                    raise
+        return results
+    @asynccontextmanager
+    async def pipeline(self):
+        """
+        Usage: same as Database.pipeline, statements are run on exit of the async with block
+            async with db.pipeline() as p:
+                p.tables['stocks'].insert(symbol='RHAT', qty=100)
+        """
+        pipeline = Pipeline(self)
+        yield pipeline
+        pipeline._complete(await self.run_many(pipeline.statements))
+    async def get_max_packet(self):
+        if self.max_packet is None:
+            self.max_packet = 4*1024*1024
+            if self.type == 'mysql':
+                result = await self.get('SELECT @@max_allowed_packet', [])
+                if result:
+                    self.max_packet = int(result[0][0])
+        return self.max_packet
+    async def load_tables(self):
+        session_init = self.session_init
+        await self._load_tables()
+        if not session_init is self.session_init:
+            await self.pool.close()
+    async def _load_tables(self):
+        checksum = None
+        if self.schema_cache is not None:
+            checksum = self._schema_checksum(await self.get(self._schema_checksum_query()))
+            schema = self._read_schema_cache(checksum)
+            if schema is not None:
+                return self._load_schema(schema)
+        schema = await self._introspect()
+        if self.schema_cache is not None:
+            self._write_schema_cache(checksum, schema)
+        self._load_schema(schema)
+    async def _introspect(self, names=None):
+        if self.type == 'sqlite':
+            return parse_sqlite_master(await self.get(self._sqlite_master_query()), names)
+        tables = names if names is not None else [table for table, in await self.get('show tables')]
+        index_query, index_params = self._mysql_index_query(names)
+        return parse_mysql_tables(
+            {table: (await self.get(f'show create table {table}'))[0][1] for table in tables}, 
+            await self.get(index_query, index_params))
+    def _load_table(self, name, columns, prim_key, foreign_keys, indexes=None):
+        self.tables[name] = AsyncTable(name, self, self._table_columns(columns), prim_key, foreign_keys=foreign_keys, exists=True)
+        self.tables[name].indexes = indexes if indexes is not None else {}
+        self._enable_foreign_keys(foreign_keys)
+    async def create_table(self, name, columns, prim_key=None, **kw):
+        """
+        Usage: same as Database.create_table
+            await db.create_table('keystore', [('env', str, 'UNIQUE NOT NULL'), ('val', str)], 'env')
+        """
+        table = AsyncTable(name, self, self._table_columns(columns), prim_key, **kw)
+        if not await self.has_table(name):
+            await self.run(table.get_schema())
+        if name in self.tables:
+            table.indexes = dict(self.tables[name].indexes)
+        self.tables[name] = table
+        self.invalidate(name)
+        for index in kw['indexes'] if 'indexes' in kw else []:
+            await table.create_index(*table._index_args(index))
+class AsyncTable(Table):
+    """
+        Table of an AsyncDatabase, methods which query the db are coroutines:
+            tb = db.tables['stocks']
+            await tb.insert(**trade)
+            rows = await tb.select('*', where={'symbol': 'RHAT'})
+            async for row in tb:
+                print(row)
+            await tb.insert_many(trades)
+            row = await tb[1]
+            await tb.set(1, {'symbol': 'NTAP'}) # tb[1] = {...}
+            await tb.contains(1) # 1 in tb
+    """
+    def create_schema(self):
+        # created by await AsyncDatabase.create_table
+        pass
+    async def create_index(self, columns, unique=False, name=None):
+        name, columns, query = self._create_index_query(columns, unique, name)
+        if not name in self.indexes:
+            await self.database.run_many([query])
+            self.indexes[name] = {'columns': columns, 'unique': unique}
+        return name
+    async def drop_index(self, name):
+        await self.database.run_many([self._drop_index_query(name)])
+        del self.indexes[name]
+    def select_async_futures(self, *selection, **kw):
+        raise InvalidInputError(f"{self.name}.select_async_futures(...) is not available on an AsyncTable", "use asyncio.gather(tb.select(..), ..)")
+    async def select(self, *selection, row_format='dict', **kw):
+        """
+        Usage: same as Table.select
+        """
+        if row_format == 'numpy':
+            return await self.select_columns(*selection, **kw)
+        plan = self._select_plan(selection, kw)
+        query, params = plan.query(kw)
+        return await self.database._cached_get(plan.tables, query, params, plan._convert(row_format))
+    async def select_columns(self, *selection, batch_size=5000, **kw):
+        """
+        Usage: same as Table.select_columns
+        """
+        query, params, keys, col_refs = self._select_query(selection, kw)
+        batches = [rows async for rows in self.database.iter_batches(query, params, batch_size)]
+        return self._column_arrays(batches, keys, col_refs)
+    async def iter_select(self, *selection, batch_size=500, row_format='dict', **kw):
+        """
+        Usage: same as Table.iter_select, returning an async generator
+            async for row in db.tables['stocks'].iter_select('*', where={'symbol': 'RHAT'}):
+        """
+        if row_format == 'columns':
+            raise InvalidInputError(f"invalid row_format {row_format} for iter_select", "use select(..., row_format='columns')")
+        query, params, keys, col_refs = self._select_query(selection, kw)
+        async for rows in self.database.iter_batches(query, params, batch_size):
+            for row in self._format_rows(rows, keys, col_refs, row_format):
+                yield row
+    async def count(self, **kw):
+        return self._count_result(await self.aggregate({'*': 'count'}, **kw))
+    async def aggregate(self, aggregates, group_by=None, having=None, row_format='dict', **kw):
+        """
+        Usage: same as Table.aggregate
+        """
+        query, params, keys, col_refs = self._aggregate_query(aggregates, group_by, having, kw)
+        return await self.database._cached_get(
+            self._join_tables(kw), query, params, lambda rows: self._format_result(rows, keys, col_refs, row_format))
+    async def paginate(self, *selection, page_size=50, after=None, desc=False, **kw):
+        """
+        Usage: same as Table.paginate, returning an async generator
+            async for page in db.tables['stocks'].paginate('*', page_size=50):
+        """
+        key, page_kw = self._page_kw(page_size, after, desc, kw)
+        selection = self._page_selection(selection if selection else ('*',), key)
+        while True:
+            page = await self.select(*selection, **page_kw)
+            rows, last = self._page_last(page, selection, key, kw)
+            if rows > 0:
+                yield page
+            if rows < page_size:
+                return
+            key, page_kw = self._page_kw(page_size, last, desc, kw)
+    async def insert(self, **kw):
+        await self._write(kw)
+    async def upsert(self, **kw):
+        await self._write(kw, upsert=True)
+    async def _write(self, kw, upsert=False):
+        query, params = self._write_query(kw, upsert)
+        await self.database.run(query, params)
+        self._invalidate(keys=[kw[self.prim_key]] if self.prim_key in kw else [])
+        self.database._table_written(self.name)
+    async def insert_many(self, rows, batch_size=1000, return_keys=False):
+        return await self._write_many(rows, batch_size, return_keys)
+    async def upsert_many(self, rows, batch_size=1000):
+        return await self._write_many(rows, batch_size, upsert=True)
+    async def _write_many(self, rows, batch_size=1000, return_keys=False, upsert=False):
+        result = self._write_many_result(return_keys, upsert)
+        max_bytes = int(await self.database.get_max_packet() * 0.75) if self.database.type == 'mysql' else None
+        for batch in self._write_batches(rows, batch_size, return_keys, upsert, max_bytes):
+            keys = await self.database.executemany(batch['query'], batch['params'], return_keys=batch['generate_keys'])
+            self._write_batch_done(result, batch, keys)
+        return result
+    async def update(self, **kw):
+        await self.database.run(*self._update_query(kw))
+        self._written(kw)
+    async def update_many(self, rows, batch_size=1000):
+        result = {'updated': 0, 'batches': 0}
+        for batch in self._update_batches(rows, batch_size):
+            rowcount = await self.database.executemany(batch['query'], batch['params'])
+            self._many_done(result, 'updated', batch['keys'], rowcount)
+        return result
+    async def delete_many(self, keys, batch_size=1000):
+        result = {'deleted': 0, 'batches': 0}
+        for batch in self._delete_batches(keys, batch_size):
+            rowcount, = await self.database.run_many([(batch['query'], batch['params'])])
+            self._many_done(result, 'deleted', batch['keys'], rowcount)
+        return result
+    async def delete(self, all_rows=False, **kw):
+        try:
+            where = self._where(kw)
+        except Exception as e:
+            return repr(e)
+        await self.database.run(*self._delete_query(where, all_rows))
+        self._written(kw)
+    async def _get_row(self, key_val):
+        # rows read within a transaction may be uncommitted, so are neither read from nor stored in the cache
+        cache = self.cache if not self.database.in_transaction() else None
+        if cache is not None:
+            row = cache.get(self._cache_key(key_val))
+            if row is not None:
+                return deepcopy(row)
+        val = await self.select('*', where={self.prim_key: key_val})
+        if val == None or len(val) == 0:
+            return None
+        if cache is not None:
+            # deep copies, so nested JSON values of returned rows do not share state with the cache
+            cache.set(self._cache_key(key_val), deepcopy(val[0].copy()))
+        return val[0]
+    async def __getitem__(self, key_val):
+        return self._item_value(await self._get_row(key_val))
+    async def set(self, key, values):
+        """ await tb.set(key, values) - same as tb[key] = values for Table """
+        values = self._item_values(key, values)
+        if len(self._missing_required(values)) > 0:
+            values.pop(self.prim_key)
+            if not await self._get_row(key) == None:
+                return await self.update(**values, where={self.prim_key: key})
+            values[self.prim_key] = key
+        return await self.upsert(**values)
+    async def contains(self, key):
+        """ await tb.contains(key) - same as key in tb for Table """
+        return not await self._get_row(key) == None
+    def __setitem__(self, key, values):
+        raise InvalidInputError(f"{self.name}[{key}] = ... requires a db query", "use await tb.set(key, values)")
+    def __contains__(self, key):
+        raise InvalidInputError(f"{key} in {self.name} requires a db query", "use await tb.contains(key)")
+    def __iter__(self):
+        raise InvalidInputError(f"iter({self.name}) requires a db query", "use async for row in tb")
+    def __aiter__(self):
+        return self._iter_rows()
+    async def _iter_rows(self):
+        # pages of 500 rows are read by primary key, so no cursor is held while the loop writes to the table
+        if self.prim_key is None:
+            for row in await self.select('*'):
+                yield row
+            return
+        async for page in self.paginate('*', page_size=500):
+            for row in page:
                 yield row
-        return gen()
 class Error(Exception):
     pass
 class InvalidInputError(Error):
@@ -737,7 +3748,9 @@ class InvalidColumnType(Error):
     def __init__(self, invalid_type, message):
         self.invalid_type = invalid_type
         self.message = message
+class PoolTimeoutError(Error):
+    def __init__(self, invalid_input, message):
+        self.invalid_input = invalid_input
+        self.message = message
 #   TOODOO:
-# - Add support for creating column indexes per tables
-# - Add OR statement querry support
 # - Support for transactions?
\ No newline at end of file
@@ -36,6 +36,925 @@ class TestData(unittest.TestCase):
         colast_names = ['order_num', 'date', 'trans', 'symbol', 'qty', 'price', 'after_hours']
         for col in colast_names:
             assert col in ref_database.tables['stocks'].columns, f"missing column {col}"
+    def test_run_sqlite_pool_test(self):
+        import sqlite3, threading, time
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            pool_max_size=2
+            )
+        created = db.pool.stats['created']
+        for _ in range(10):
+            db.run("select name from sqlite_master")
+        assert db.pool.stats['created'] == created, "connections should be re-used between queries"
+        assert db.pool.stats['in_use'] == 0, "connections should be returned to the pool"
+
+        # sqlite connections are bound to the thread which created them
+        def query():
+            db.run("select name from sqlite_master")
+        threads = [threading.Thread(target=query) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert db.pool.stats['created'] == created + 3, "each thread should use its own connection"
+        db.close()
+        assert db.pool.stats['idle'] == 0, "close should drain the idle connections of every thread"
+
+        # a connection checked in from another thread returns to the idle list of the thread which checked it out
+        pool = data.ConnectionPool(
+            sqlite3.connect, {'database': 'testdb', 'check_same_thread': False}, min_size=0, thread_affinity=True)
+        conns = []
+        worker = threading.Thread(target=lambda: conns.append(pool.checkout()))
+        worker.start()
+        worker.join()
+        pool.checkin(conns[0])
+        conn = pool.checkout()
+        assert not conn is conns[0], "the connection of the worker thread should not be handed to the main thread"
+        pool.checkin(conn)
+        assert pool.stats['idle'] == 2 and pool.stats['in_use'] == 0, f"unexpected pool stats {pool.stats}"
+        pool.close()
+        assert pool.stats['closed'] == 2 and pool.stats['idle'] == 0, f"close should close every idle connection {pool.stats}"
+
+        # min_size connections are opened up front & kept when idle connections expire
+        pool = data.ConnectionPool(sqlite3.connect, {'database': 'testdb'}, min_size=3, max_size=4, idle_timeout=0)
+        assert pool.stats['created'] == 3 and pool.stats['idle'] == 3, f"expected min_size connections {pool.stats}"
+        conns = [pool.checkout() for _ in range(4)]
+        for conn in conns:
+            pool.checkin(conn)
+        time.sleep(0.01)
+        pool.checkin(pool.checkout())
+        assert pool.stats['idle'] == 3, f"expiring idle connections should keep min_size {pool.stats}"
+        pool.close()
+        db = data.Database(sqlite3.connect, database="testdb", pool_min_size=3)
+        assert db.pool.stats['created'] == 3, f"expected pool_min_size connections {db.pool.stats}"
+        db.close()
+    def test_run_sqlite_params_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table notes')
+        db.create_table('notes', [('id', int), ('note', str)], 'id')
+        note = "it's; \"quoted\" -- text"
+        db.tables['notes'].insert(id=1, note=note)
+        db.tables['notes'].insert(id=2, note='other')
+        assert db.tables['notes'][1] == note, "values should be passed as parameters, not interpolated"
+
+        cached = len(db.sql_cache)
+        for i in [1, 2]:
+            db.tables['notes'].select('*', where={'id': i})
+        assert len(db.sql_cache) == cached, "queries of the same shape should re-use cached SQL"
+        sel = db.tables['notes'].select('id', where=[['note', 'in', [note, 'other']], ['id', '>', 0]])
+        assert len(sel) == 2, f"expected 2 rows, found {len(sel)}"
+    def test_run_sqlite_insert_many_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table trades')
+        db.create_table(
+            'trades', 
+            [
+                ('order_num', int, 'AUTOINCREMENT'),
+                ('symbol', str),
+                ('qty', int),
+                ('after_hours', bool)
+            ], 
+            'order_num'
+        )
+        rows = ({'symbol': 'RHAT', 'qty': i, 'after_hours': i % 2 == 0} for i in range(2500))
+        result = db.tables['trades'].insert_many(rows, batch_size=1000)
+        assert result == {'inserted': 2500, 'batches': 3}, f"unexpected insert_many result {result}"
+        assert len(db.tables['trades'].select('order_num')) == 2500, "expected 2500 inserted rows"
+
+        result = db.tables['trades'].insert_many(
+            [{'symbol': 'NTAP', 'qty': 1}, {'symbol': 'NTAP', 'qty': 2}, {'order_num': 5000, 'symbol': 'NTNX'}],
+            return_keys=True
+        )
+        assert result['keys'] == [2501, 2502, 5000], f"unexpected keys {result['keys']}"
+        assert db.tables['trades'][5000]['symbol'] == 'NTNX', "row with explicit key should be inserted"
+
+        # mysql batches are sized by UTF-8 bytes & escapes of each value, not chars
+        rows = [{'symbol': '€' * 30, 'qty': 1}, {'symbol': "'" * 30, 'qty': 2}, {'symbol': 'RHAT', 'qty': 3}]
+        batches = list(db.tables['trades']._write_batches(rows, max_bytes=80))
+        assert [len(batch['rows']) for batch in batches] == [1, 1, 1], f"unexpected batches {[batch['rows'] for batch in batches]}"
+        assert data.mysql_literal_bytes('€') == 6 and data.mysql_literal_bytes("'") == 5
+    def test_run_sqlite_transaction_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table ledger')
+        db.create_table('ledger', [('id', int), ('amount', int)], 'id')
+        ledger = db.tables['ledger']
+
+        with db.transaction():
+            ledger.insert(id=1, amount=10)
+            ledger.insert(id=2, amount=20)
+            try:
+                with db.transaction():
+                    ledger.insert(id=3, amount=30)
+                    raise ValueError("rollback savepoint")
+            except ValueError:
+                pass
+        assert [r['id'] for r in ledger.select('id')] == [1, 2], "nested transaction should only roll back its own rows"
+
+        try:
+            with db.transaction():
+                ledger.update(amount=0, where={'id': 1})
+                ledger.insert(id=2, amount=20) # duplicate key
+        except Exception:
+            pass
+        assert ledger[1] == 10, "failed transaction should be rolled back"
+
+        manual = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            autocommit=False
+            )
+        manual.tables['ledger'].insert(id=4, amount=40)
+        manual.rollback()
+        assert not 4 in manual.tables['ledger'], "rolled back insert should not exist"
+        manual.tables['ledger'].insert(id=5, amount=50)
+        manual.commit()
+        assert ledger[5] == 50, "committed insert should be visible to other connections"
+    def test_run_sqlite_iter_select_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table readings')
+        db.create_table('readings', [('id', int), ('value', float), ('valid', bool)], 'id')
+        db.tables['readings'].insert_many({'id': i, 'value': i / 2, 'valid': i % 3 == 0} for i in range(1000))
+
+        rows = db.tables['readings'].iter_select('id', 'valid', where=[['id', '>=', 500]], batch_size=64)
+        first = next(rows)
+        assert first == {'id': 500, 'valid': False}, f"unexpected first row {first}"
+        assert db.pool.stats['in_use'] == 1, "iterator should hold a connection while open"
+        assert len(list(rows)) == 499, "expected remaining 499 rows"
+        assert db.pool.stats['in_use'] == 0, "exhausted iterator should return its connection"
+
+        rows = db.tables['readings'].iter_select('*')
+        next(rows)
+        rows.close()
+        assert db.pool.stats['in_use'] == 0, "closed iterator should return its connection"
+        assert sum(1 for _ in db.tables['readings']) == 1000, "expected 1000 rows from table iteration"
+        # more rows than the iter_select batch_size, writes within the loop must not wait on an open read
+        for row in db.tables['readings']:
+            if row['id'] % 100 == 0:
+                db.tables['readings'].update(value=-1.0, where={'id': row['id']})
+        assert db.tables['readings'].count(where={'value': -1.0}) == 10, "expected 10 updated rows"
+        # table iteration reads pages of rows, not the whole table
+        events = []
+        paged = data.Database(sqlite3.connect, database="testdb", after_execute=events.append)
+        rows = iter(paged.tables['readings'])
+        assert next(rows)['id'] == 0 and max(e['rows'] for e in events) <= 500, f"expected a page of rows {[e['rows'] for e in events]}"
+        assert sum(1 for _ in rows) == 999 and max(e['rows'] for e in events) <= 500, "expected pages of up to 500 rows"
+        paged.close()
+
+        sel = db.tables['readings'].select('id', 'valid', where={'id': 3}, row_format='tuple')
+        assert sel == [(3, True)], f"unexpected tuple rows {sel}"
+        sel = db.tables['readings'].select('id', 'value', where=[['id', '<', 2]], row_format='namedtuple')
+        assert sel[1].id == 1 and sel[1].value == 0.5, f"unexpected namedtuple rows {sel}"
+        assert type(sel[0]) is type(db.tables['readings'].select('id', 'value', row_format='namedtuple')[0]), "row class should be shared"
+        sel = db.tables['readings'].select('id', 'valid', where=[['id', '<', 4]], row_format='columns')
+        assert sel == {'id': [0, 1, 2, 3], 'valid': [True, False, False, True]}, f"unexpected columns {sel}"
+    def test_run_sqlite_select_columns_test(self):
+        import sqlite3
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy is not installed")
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table prices')
+        db.create_table('prices', [('id', int), ('symbol', str), ('qty', int), ('price', float), ('open', bool)], 'id')
+        db.tables['prices'].insert_many(
+            {'id': i, 'symbol': 'RHAT', 'qty': None if i % 10 == 0 else i, 'price': i * 1.5, 'open': i % 2 == 0} 
+                for i in range(1000)
+        )
+        cols = db.tables['prices'].select_columns('id', 'symbol', 'qty', 'price', 'open', batch_size=300)
+        assert cols['id'].dtype == numpy.int64 and cols['price'].dtype == numpy.float64, "unexpected column dtypes"
+        assert cols['open'].dtype == numpy.bool_ and cols['symbol'].dtype == object, "unexpected column dtypes"
+        assert len(cols['id']) == 1000 and cols['id'].sum() == sum(range(1000)), "unexpected id values"
+        assert cols['qty'].mask.sum() == 100, "NULL qty values should be masked"
+        assert cols['qty'].sum() == sum(i for i in range(1000) if i % 10), "masked values should be excluded"
+        assert cols['open'].sum() == 500, "unexpected bool values"
+
+        empty = db.tables['prices'].select('price', where={'symbol': 'NTAP'}, row_format='numpy')
+        assert len(empty['price']) == 0, "expected empty array"
+    def test_run_sqlite_json_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table configs')
+        db.create_table('configs', [('name', str), ('config', dict), ('tags', list), ('note', str)], 'name')
+        config = {'limit': 36.0, 'nested': {'a': [1, 2]}}
+        db.tables['configs'].insert(name='c1', config=config, tags=['a', 'b'], note='not {json}')
+        db.tables['configs'].insert(name='c2', config=None, tags=[], note='{"legacy": true}')
+        sel = db.tables['configs'].select('*', where={'config': config})
+        assert sel == [{'name': 'c1', 'config': config, 'tags': ['a', 'b'], 'note': 'not {json}'}], f"unexpected json row {sel}"
+        sel = db.tables['configs']['c2']
+        assert sel['config'] == None and sel['tags'] == [] and sel['note'] == {'legacy': True}, f"unexpected json row {sel}"
+
+        reloaded = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            json_codec='json',
+            json_detect=False,
+            lazy_json=True
+            )
+        assert reloaded.tables['configs'].columns['config'].type == dict, "json columns should be loaded as dict"
+        row = reloaded.tables['configs']['c1']
+        assert isinstance(row, data.LazyRow) and dict.__getitem__(row, 'config') == '{"limit": 36.0, "nested": {"a": [1, 2]}}', "json should not be decoded before access"
+        assert row['config'] == config and row['tags'] == ['a', 'b'], "json should be decoded on access"
+        assert reloaded.tables['configs']['c2']['note'] == '{"legacy": true}', "str columns should not be decoded with json_detect=False"
+        row = reloaded.tables['configs']['c1']
+        row.update({'config': {'limit': 1}}, tags=None)
+        assert row['config'] == {'limit': 1} and row['tags'] == None, f"updated values should not be decoded {row}"
+        row = reloaded.tables['configs']['c1']
+        del row['config']
+        assert row == {'name': 'c1', 'tags': ['a', 'b'], 'note': 'not {json}'}, f"unexpected row after del {row}"
+        assert row.setdefault('config', {}) == {} and row.popitem() == ('config', {}), f"unexpected row {row}"
+        assert row.popitem() == ('note', 'not {json}') and row.popitem() == ('tags', ['a', 'b']), "popitem should decode values"
+
+        # JSON numbers are stored as sqlite numbers in JSON columns
+        db.tables['configs'].insert(name='c4', config=5, tags=[])
+        assert db.tables['configs']['c4']['config'] == 5, "expected a JSON number"
+        assert reloaded.tables['configs']['c4']['config'] == 5, "expected a lazily decoded JSON number"
+
+        # the default codec round trips values json.dumps writes
+        db.tables['configs'].insert(name='c3', config={'nan': float('nan'), 'big': 2**70, 'inf': float('inf')}, tags=[2**65])
+        row = db.tables['configs']['c3']
+        assert row['config']['nan'] != row['config']['nan'], f"expected NaN {row}"
+        assert row['config']['big'] == 2**70 and isinstance(row['config']['big'], int), f"expected a big int {row}"
+        assert row['config']['inf'] == float('inf') and row['tags'] == [2**65], f"unexpected row {row}"
+    def test_run_sqlite_row_cache_test(self):
+        import sqlite3, threading
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table settings')
+        db.create_table('settings', [('env', str, 'UNIQUE NOT NULL'), ('val', str)], 'env', cache={'max_size': 2})
+        settings = db.tables['settings']
+        settings['key1'] = 'value1'
+        assert settings['key1'] == 'value1' and settings['key1'] == 'value1', "cached value should be returned"
+        assert settings.cache.stats['hits'] >= 1, f"expected a cache hit {settings.cache.stats}"
+
+        settings['key1'] = 'value2'
+        assert settings['key1'] == 'value2', "setitem should update the cached row"
+        settings.update(val='value3', where={'env': 'key1'})
+        assert settings['key1'] == 'value3', "update should invalidate the cached row"
+        settings.delete(where=[['env', 'like', 'key*']])
+        assert not 'key1' in settings, "delete should invalidate cached rows"
+
+        for key in ['a', 'b', 'c']:
+            settings[key] = key
+            assert settings[key] == key
+        assert len(settings.cache) == 2 and settings.cache.stats['evictions'] >= 1, "cache should be bounded by max_size"
+
+        try:
+            with db.transaction():
+                settings['a'] = 'changed'
+                assert settings['a'] == 'changed'
+                raise ValueError("rollback")
+        except ValueError:
+            pass
+        assert settings['a'] == 'a', "rollback should clear cached rows"
+
+        # rows read within a transaction are not cached, other threads only see committed rows
+        settings['b'] = 'committed'
+        seen = []
+        try:
+            with db.transaction():
+                settings['b'] = 'uncommitted'
+                assert settings['b'] == 'uncommitted'
+                reader = threading.Thread(target=lambda: seen.append(settings['b']))
+                reader.start()
+                reader.join()
+                raise ValueError("rollback")
+        except ValueError:
+            pass
+        assert seen == ['committed'], f"another thread read an uncommitted row {seen}"
+        assert settings['b'] == 'committed', "rollback should keep the committed row"
+
+        db.run('drop table profiles')
+        db.create_table('profiles', [('id', int, 'UNIQUE NOT NULL'), ('name', str), ('prefs', dict)], 'id', cache={'max_size': 10})
+        profiles = db.tables['profiles']
+        profiles[1] = {'name': 'frank', 'prefs': {'theme': 'dark', 'tags': ['a']}}
+        for _ in range(2):
+            # the first read stores the row in the cache, the second is a cache hit
+            row = profiles[1]
+            row['prefs']['theme'] = 'light'
+            row['prefs']['tags'].append('b')
+        assert profiles[1]['prefs'] == {'theme': 'dark', 'tags': ['a']}, f"cached row was mutated {profiles[1]}"
+    def test_run_sqlite_upsert_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table kv')
+        db.create_table('kv', [('env', str, 'UNIQUE NOT NULL'), ('val', str), ('version', int)], 'env')
+        kv = db.tables['kv']
+        kv.upsert(env='key1', val='value1', version=1)
+        kv.upsert(env='key1', val='value2')
+        assert kv['key1'] == {'env': 'key1', 'val': 'value2', 'version': 1}, "upsert should only update provided columns"
+
+        checkouts = db.pool.stats['checkouts']
+        kv['key2'] = {'val': 'value1', 'version': 2}
+        assert db.pool.stats['checkouts'] == checkouts + 1, "setitem should use a single query"
+        kv['key2'] = {'version': 3}
+        assert kv['key2'] == {'env': 'key2', 'val': 'value1', 'version': 3}, "setitem should update existing rows"
+
+        result = kv.upsert_many({'env': f'key{i}', 'val': 'bulk'} for i in range(5))
+        assert result == {'upserted': 5, 'batches': 1}, f"unexpected upsert_many result {result}"
+        assert len(kv.select('env', where={'val': 'bulk'})) == 5, "expected 5 upserted rows"
+        assert kv['key1']['version'] == 1, "upsert_many should keep columns not provided"
+    def test_run_sqlite_threads_test(self):
+        import sqlite3, threading
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            max_workers=4
+            )
+        db.run('drop table prices')
+        db.create_table('prices', [('id', int, 'UNIQUE'), ('symbol', str), ('price', float)], 'id')
+        prices = db.tables['prices']
+        prices.insert_many({'id': i, 'symbol': 'RHAT' if i % 2 else 'NTAP', 'price': float(i)} for i in range(100))
+
+        futures = [db.submit(f"SELECT id FROM prices WHERE symbol = {db.param}", ['RHAT']) for _ in range(10)]
+        assert all(len(f.result()) == 50 for f in futures), "each submitted query should return 50 rows"
+        futures = [prices.select_async_futures('id', where={'symbol': s}) for s in ['RHAT', 'NTAP']]
+        rhat, ntap = [f.result() for f in futures]
+        assert len(rhat) == 50 and len(ntap) == 50, "select_async_futures returned unexpected rows"
+
+        errors = []
+        def worker(n):
+            try:
+                for i in range(10):
+                    prices[1000 + n*10 + i] = {'symbol': f'T{n}', 'price': float(i)}
+                    assert len(prices.select('id', where={'symbol': f'T{n}'})) == i + 1
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == [], f"errors in worker threads {errors}"
+        assert len(prices.select('id')) == 140, "expected 140 rows after threaded writes"
+        db.close()
+    def test_run_sqlite_pipeline_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table kv')
+        db.create_table('kv', [('env', str, 'UNIQUE NOT NULL'), ('val', str)], 'env', cache=True)
+        db.tables['kv']['key1'] = 'value1'
+        assert db.tables['kv']['key1'] == 'value1'
+
+        checkouts = db.pool.stats['checkouts']
+        with db.pipeline() as p:
+            p.tables['kv'].insert(env='key2', val='value2')
+            p.tables['kv'].update(val='new1', where={'env': 'key1'})
+            p.tables['kv'].upsert(env='key3', val='value3')
+            p.run(f"DELETE FROM kv WHERE env = {db.param}", ['key3'])
+            keys = p.tables['kv'].select('env', row_format='tuple')
+            assert p.results is None, "pipeline statements should run on exit"
+        assert db.pool.stats['checkouts'] == checkouts + 1, "pipeline should use a single connection"
+        assert p.results == [1, 1, 1, 1, [('key1',), ('key2',)]], f"unexpected pipeline results {p.results}"
+        assert p.results[keys] == [('key1',), ('key2',)]
+        assert db.tables['kv']['key1'] == 'new1', "cached row should be invalidated by the pipeline update"
+
+        try:
+            db.run_many([
+                (f"INSERT INTO kv (env, val) VALUES ({db.param}, {db.param})", ['key4', 'value4']),
+                (f"INSERT INTO kv (env, val) VALUES ({db.param}, {db.param})", ['key1', 'duplicate'])
+            ])
+        except Exception:
+            pass
+        assert not 'key4' in db.tables['kv'], "run_many should roll back every statement on error"
+        assert db.run_many(["SELECT count(*) FROM kv"]) == [[(2,)]]
+    def test_run_sqlite_session_init_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            session_init=['PRAGMA cache_size=-4000']
+            )
+        assert db.get('PRAGMA cache_size') == [(-4000,)], "session_init should run on pooled connections"
+        assert db.get("SELECT 'a;b'") == [('a;b',)], "queries should not be split on ';'"
+        db.run('drop table children')
+        db.run('drop table parents')
+        db.create_table('parents', [('id', int, 'UNIQUE')], 'id')
+        db.create_table('children', [('id', int, 'UNIQUE'), ('parent_id', int)], 'id', 
+            foreign_keys={'parent_id': {'table': 'parents', 'ref': 'id', 'mods': 'ON DELETE CASCADE'}})
+        db.close()
+
+        db = data.Database(sqlite3.connect, database="testdb")
+        assert 'PRAGMA foreign_keys=true' in db.session_init, "foreign keys should enable PRAGMA foreign_keys"
+        db.tables['parents'].insert(id=1)
+        created = db.pool.stats['created']
+        db.tables['children'].insert(id=1, parent_id=1)
+        db.tables['parents'].delete(where={'id': 1})
+        assert db.get('PRAGMA foreign_keys') == [(1,)], "foreign_keys should be enabled per connection"
+        assert db.tables['children'].select('id') == [], "delete should cascade to children"
+        assert db.pool.stats['created'] == created, "session_init should not require new connections per query"
+    def test_run_sqlite_profile_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb_profile",
+            sqlite_profile='fast'
+            )
+        assert db.get('PRAGMA journal_mode') == [('wal',)], "fast profile should use WAL"
+        assert db.get('PRAGMA synchronous') == [(1,)], "fast profile should use synchronous=NORMAL"
+        db.run('drop table prices')
+        db.create_table('prices', [('id', int, 'UNIQUE'), ('price', float)], 'id')
+        db.tables['prices'].insert_many({'id': i, 'price': float(i)} for i in range(10))
+
+        reader = data.Database(sqlite3.connect, database="testdb_profile", sqlite_profile='readonly')
+        assert len(reader.tables['prices'].select('id')) == 10, "readonly database should read rows"
+        reader.tables['prices'].insert(id=100, price=1.0)
+        assert len(db.tables['prices'].select('id')) == 10, "readonly database should not write rows"
+        try:
+            data.Database(sqlite3.connect, database="testdb_profile", sqlite_profile='unknown')
+            assert False, "expected InvalidInputError for an unknown profile"
+        except data.InvalidInputError:
+            pass
+        reader.close()
+        db.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(f"testdb_profile{suffix}"):
+                os.remove(f"testdb_profile{suffix}")
+    def test_run_sqlite_index_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table prices')
+        db.create_table(
+            'prices', 
+            [('id', int, 'UNIQUE'), ('symbol', str), ('date', str), ('price', float)], 
+            'id',
+            indexes=['symbol', {'columns': ['symbol', 'date'], 'unique': True, 'name': 'prices_symbol_date'}]
+        )
+        prices = db.tables['prices']
+        expected = {
+            'idx_prices_symbol': {'columns': ['symbol'], 'unique': False},
+            'prices_symbol_date': {'columns': ['symbol', 'date'], 'unique': True}
+        }
+        assert prices.indexes == expected, f"unexpected indexes {prices.indexes}"
+        plan = db.get(f"EXPLAIN QUERY PLAN SELECT * FROM prices WHERE symbol = {db.param}", ['RHAT'])
+        assert 'INDEX' in str(plan), f"select on symbol should use an index {plan}"
+        prices.create_index('price', name='prices_price')
+        db.close()
+
+        db = data.Database(sqlite3.connect, database="testdb")
+        prices = db.tables['prices']
+        assert prices.indexes == {**expected, 'prices_price': {'columns': ['price'], 'unique': False}}, \
+            f"indexes should be loaded {prices.indexes}"
+        prices.drop_index('prices_price')
+        assert not 'prices_price' in prices.indexes
+        db.create_table('prices', [('id', int, 'UNIQUE'), ('symbol', str), ('date', str), ('price', float)], 'id', indexes=['symbol'])
+        assert db.tables['prices'].indexes == expected, "existing indexes should be kept"
+        try:
+            prices.create_index('missing')
+            assert False, "expected InvalidInputError for an invalid column"
+        except data.InvalidInputError:
+            pass
+        # prefix lengths only apply to mysql TEXT columns
+        assert prices.create_index([('symbol', 8), 'date']) == 'idx_prices_symbol_date'
+        assert prices.indexes['idx_prices_symbol_date'] == {'columns': ['symbol', 'date'], 'unique': False}
+        prices.drop_index('idx_prices_symbol_date')
+
+        # partial & expression indexes created outside of pyql
+        db.run('CREATE INDEX prices_positive ON prices (symbol, price DESC) WHERE price > 0')
+        db.run('CREATE INDEX prices_lower ON prices (lower(symbol), date)')
+        db.close()
+        prices = data.Database(sqlite3.connect, database="testdb").tables['prices']
+        assert prices.indexes['prices_positive'] == {'columns': ['symbol', 'price'], 'unique': False, 'where': 'price > 0'}, \
+            f"unexpected partial index {prices.indexes['prices_positive']}"
+        assert prices.indexes['prices_lower'] == {'columns': [None, 'date'], 'unique': False}, \
+            f"unexpected expression index {prices.indexes['prices_lower']}"
+    def test_run_sqlite_paginate_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table prices')
+        db.create_table('prices', [('id', int, 'UNIQUE'), ('symbol', str), ('price', float)], 'id')
+        prices = db.tables['prices']
+        prices.insert_many({'id': i, 'symbol': 'RHAT' if i % 2 else 'NTAP', 'price': float(i % 7)} for i in range(1, 101))
+
+        rows = prices.select('id', orderby='id desc', limit=5)
+        assert [r['id'] for r in rows] == [100, 99, 98, 97, 96], f"unexpected rows {rows}"
+        rows = prices.select('id', orderby='id', limit=3, offset=10)
+        assert [r['id'] for r in rows] == [11, 12, 13], f"unexpected rows {rows}"
+        rows = prices.select('id', where={'symbol': 'RHAT'}, orderby='id', offset=48)
+        assert [r['id'] for r in rows] == [97, 99], f"offset without limit returned {rows}"
+        rows = prices.select('id', 'price', orderby=['price desc', ('id', 'asc')], limit=2)
+        assert rows == [{'id': 6, 'price': 6.0}, {'id': 13, 'price': 6.0}], f"unexpected multi-column order {rows}"
+        try:
+            prices.select('id', orderby='id sideways')
+            assert False, "expected InvalidInputError for an invalid direction"
+        except data.InvalidInputError:
+            pass
+
+        pages = list(prices.paginate('symbol', page_size=30, where={'symbol': 'RHAT'}))
+        assert [len(p) for p in pages] == [30, 20], f"unexpected page sizes {[len(p) for p in pages]}"
+        assert pages[1][0] == {'symbol': 'RHAT', 'id': 61}, f"unexpected row {pages[1][0]}"
+        page = next(prices.paginate(page_size=10, after=95))
+        assert [r['id'] for r in page] == [96, 97, 98, 99, 100], "paginate should seek past after"
+        page = next(prices.paginate('id', page_size=2, after=50, desc=True))
+        assert [r['id'] for r in page] == [49, 48], "desc paginate should seek below after"
+        assert list(prices.paginate(page_size=10, after=100)) == [], "no pages expected after the last key"
+
+        pages = list(prices.paginate('*', page_size=2, after=95, row_format='tuple'))
+        assert pages == [[(96, 'NTAP', 5.0), (97, 'RHAT', 6.0)], [(98, 'NTAP', 0.0), (99, 'RHAT', 1.0)], [(100, 'NTAP', 2.0)]], f"unexpected tuple pages {pages}"
+        pages = list(prices.paginate('price', page_size=3, after=95, row_format='namedtuple'))
+        assert [[r.id for r in p] for p in pages] == [[96, 97, 98], [99, 100]], f"unexpected namedtuple pages {pages}"
+        pages = list(prices.paginate('id', page_size=3, after=95, row_format='columns'))
+        assert pages == [{'id': [96, 97, 98]}, {'id': [99, 100]}], f"unexpected columns pages {pages}"
+    def test_run_sqlite_aggregate_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table trades')
+        db.create_table('trades', [('id', int, 'UNIQUE'), ('symbol', str), ('qty', int), ('price', float)], 'id')
+        trades = db.tables['trades']
+        trades.insert_many([
+            {'id': 1, 'symbol': 'RHAT', 'qty': 100, 'price': 35.0},
+            {'id': 2, 'symbol': 'RHAT', 'qty': 200, 'price': 36.0},
+            {'id': 3, 'symbol': 'NTAP', 'qty': 50, 'price': 10.0},
+            {'id': 4, 'symbol': 'NTNX', 'qty': None, 'price': 20.0}
+        ])
+        assert trades.count() == 4, "expected 4 rows"
+        assert trades.count(where={'symbol': 'RHAT'}) == 2, "expected 2 RHAT rows"
+        assert trades.count(where={'symbol': 'MSFT'}) == 0, "expected 0 MSFT rows"
+
+        result = trades.aggregate(
+            {'qty': 'sum', 'price': ['avg', 'max'], '*': 'count'},
+            group_by=['symbol'],
+            having=[['sum(qty)', '>', 10]],
+            orderby='sum(qty) desc'
+        )
+        assert result == [
+            {'symbol': 'RHAT', 'sum(qty)': 300, 'avg(price)': 35.5, 'max(price)': 36.0, 'count(*)': 2},
+            {'symbol': 'NTAP', 'sum(qty)': 50, 'avg(price)': 10.0, 'max(price)': 10.0, 'count(*)': 1}
+        ], f"unexpected aggregate result {result}"
+        result = trades.aggregate({'qty': ['min', 'count']}, row_format='tuple')
+        assert result == [(50, 3)], f"unexpected aggregate result {result}"
+        for invalid in [{'qty': 'median'}, {'*': 'sum'}, {'missing': 'sum'}]:
+            try:
+                trades.aggregate(invalid)
+                assert False, f"expected InvalidInputError for {invalid}"
+            except data.InvalidInputError:
+                pass
+
+        # a failed query counts 0 as select returns [], and raises within a transaction
+        with db.cursor() as c:
+            c.execute('DROP TABLE trades')
+        assert trades.select('id') == [], "a failed select should return []"
+        assert trades.count() == 0, "a failed count should return 0"
+        try:
+            with db.transaction():
+                trades.count()
+            assert False, "expected a failed count to raise within a transaction"
+        except sqlite3.OperationalError:
+            pass
+    def test_run_sqlite_conditions_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table trades')
+        db.create_table('trades', [('id', int, 'UNIQUE'), ('symbol', str), ('qty', int), ('price', float)], 'id')
+        trades = db.tables['trades']
+        trades.insert_many([
+            {'id': 1, 'symbol': 'RHAT', 'qty': 100, 'price': 35.0},
+            {'id': 2, 'symbol': 'RHAT', 'qty': 200, 'price': 36.0},
+            {'id': 3, 'symbol': 'NTAP', 'qty': 50, 'price': 10.0},
+            {'id': 4, 'symbol': 'NTNX', 'qty': None, 'price': 20.0}
+        ])
+        def ids(where):
+            return [r['id'] for r in trades.select('id', where=where, orderby='id')]
+        assert ids({'or': [{'symbol': 'NTAP'}, ['qty', '>', 150]]}) == [2, 3], "unexpected or result"
+        assert ids([{'symbol': 'RHAT'}, {'or': [['qty', '<', 150], ['price', '>', 35.5]]}]) == [1, 2]
+        assert ids({'or': [{'symbol': 'RHAT', 'qty': 100}, {'and': [['price', '<', 15], ['qty', 'is not null']]}]}) == [1, 3]
+        assert ids({'not': {'or': [{'symbol': 'RHAT'}, {'symbol': 'NTAP'}]}}) == [4], "unexpected not result"
+        assert ids([['price', 'between', [20, 35]]]) == [1, 4], "unexpected between result"
+        assert ids([['price', 'not between', [20, 35]]]) == [2, 3], "unexpected not between result"
+        assert ids([['qty', 'is null']]) == [4], "unexpected is null result"
+        assert ids({'or': [['symbol', 'in', ['NTAP', 'NTNX']], ['id', '=', 1]]}) == [1, 3, 4]
+        # same shape, different values re-uses the compiled statement
+        assert ids({'or': [{'symbol': 'RHAT'}, ['qty', '>', 10]]}) == [1, 2, 3]
+        assert trades.count(where={'or': [{'symbol': 'NTAP'}, {'symbol': 'NTNX'}]}) == 2
+        trades.delete(where={'or': [{'id': 1}, {'id': 4}]})
+        assert ids([]) == [2, 3], "unexpected rows after delete"
+        for invalid in [{'or': []}, {'or': {'id': 1}}, {'not': []}, [['price', 'between', [1]]]]:
+            try:
+                trades.select(where=invalid)
+                assert False, f"expected InvalidInputError for {invalid}"
+            except data.InvalidInputError:
+                pass
+    def test_run_sqlite_instrumentation_test(self):
+        import sqlite3
+        events, errors, before = [], [], []
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            after_execute=events.append,
+            on_error=errors.append,
+            slow_query_ms=0,
+            query_stats=True
+            )
+        db.add_hook('before_execute', before.append)
+        db.run('drop table trades')
+        db.create_table('trades', [('id', int, 'UNIQUE'), ('symbol', str), ('qty', int)], 'id')
+        trades = db.tables['trades']
+        trades.insert_many({'id': i, 'symbol': 'RHAT' if i % 2 else 'NTAP', 'qty': i} for i in range(1, 11))
+        events.clear()
+        for symbol in ['RHAT', 'NTAP', 'RHAT']:
+            assert len(trades.select('*', where={'symbol': symbol})) == 5
+        assert len(events) == 3, f"expected 3 after_execute events {events}"
+        event = events[-1]
+        assert event['method'] == 'get' and event['params'] == ['RHAT'] and event['rows'] == 5, f"unexpected event {event}"
+        assert set(event['timings']) == {'connect', 'execute', 'fetch', 'convert'}, f"unexpected timings {event['timings']}"
+        assert event['elapsed'] >= sum(event['timings'].values()) * 0.99
+        assert before[-1] is event, "before_execute & after_execute should share the event"
+
+        stats = db.query_stats.snapshot()[event['query']]
+        assert stats['count'] == 3 and stats['rows'] == 15 and stats['errors'] == 0, f"unexpected stats {stats}"
+        assert sum(stats['histogram'].values()) == 3 and stats['p99_ms'] >= stats['p50_ms']
+        assert db.slow_queries[-1] is event, "slow_query_ms=0 should log every query"
+
+        assert len(list(trades.iter_select('id', batch_size=3))) == 10
+        assert events[-1]['method'] == 'iter_batches' and events[-1]['rows'] == 10
+
+        db.get('select * from missing_table')
+        assert len(errors) == 1 and errors[0]['error'] is not None, f"expected on_error event {errors}"
+        assert db.query_stats.snapshot()['select * from missing_table']['errors'] == 1
+
+        db.remove_hook('after_execute', events.append)
+        db.slow_query_ms, db.query_stats = None, None
+        count = len(events)
+        db.add_hook('after_execute', lambda e: 1/0) # hook errors are logged, not raised
+        trades.select('*')
+        db.remove_hook('before_execute', before.append)
+        assert len(events) == count, "removed hook should not be called"
+        try:
+            db.add_hook('before_commit', print)
+            assert False, "expected InvalidInputError for an unknown hook"
+        except data.InvalidInputError:
+            pass
+    def test_run_sqlite_prepare_select_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb"
+            )
+        db.run('drop table employees')
+        db.run('drop table departments')
+        db.create_table('departments', [('id', int, 'UNIQUE NOT NULL'), ('name', str)], 'id')
+        db.create_table(
+            'employees', [('id', int, 'UNIQUE NOT NULL'), ('name', str), ('department_id', int)], 'id',
+            foreign_keys={'department_id': {'table': 'departments', 'ref': 'id', 'mods': ''}})
+        db.tables['departments'].insert_many([{'id': 1, 'name': 'hr'}, {'id': 2, 'name': 'it'}])
+        employees = db.tables['employees']
+        employees.insert_many([
+            {'id': 1, 'name': 'frank', 'department_id': 1},
+            {'id': 2, 'name': 'jane', 'department_id': 2},
+            {'id': 3, 'name': 'joe', 'department_id': 2},
+            {'id': 4, 'name': 'eli', 'department_id': None}
+        ])
+        by_department = employees.prepare_select(
+            'employees.name', 'departments.name', join='departments', where_columns=['employees.department_id'], orderby='employees.id')
+        assert by_department.sql.startswith('SELECT employees.name,departments.name FROM employees JOIN departments')
+        assert by_department(2) == [
+            {'employees.name': 'jane', 'departments.name': 'it'}, {'employees.name': 'joe', 'departments.name': 'it'}
+        ], f"unexpected rows {by_department(2)}"
+        assert by_department(2, limit=1, row_format='tuple') == [('jane', 'it')]
+        assert by_department(2, where=[['employees.name', 'like', 'jo*']]) == [{'employees.name': 'joe', 'departments.name': 'it'}]
+        assert by_department.select(where={'departments.name': 'hr'}) == [{'employees.name': 'frank', 'departments.name': 'hr'}]
+
+        all_names = employees.prepare_select('name', orderby='id', row_format='tuple')
+        assert all_names.sql.startswith('SELECT name FROM employees') and not 'WHERE' in all_names.sql, f"unexpected sql {all_names.sql}"
+        assert all_names() == [('frank',), ('jane',), ('joe',), ('eli',)], f"unexpected rows {all_names()}"
+        assert all_names(limit=1) == [('frank',)]
+        names = employees.prepare_select('name', where_columns=['department_id'], row_format='tuple')
+        assert names(None) == [('eli',)], "None values should select IS NULL"
+        try:
+            names(1, 2)
+            assert False, "expected InvalidInputError for too many values"
+        except data.InvalidInputError:
+            pass
+        for invalid in [{'where_columns': ['missing']}, {'row_format': 'numpy'}]:
+            try:
+                employees.prepare_select('name', **invalid)
+                assert False, f"expected InvalidInputError for {invalid}"
+            except data.InvalidInputError:
+                pass
+
+        # select re-uses plans of db.plan_cache
+        hits = db.plan_cache.stats['hits']
+        for i in range(1, 4):
+            employees.select('*', join='departments', where={'employees.id': i})
+        assert db.plan_cache.stats['hits'] == hits + 2, f"expected cached plans {db.plan_cache.stats}"
+        # plans compile again once a table changes
+        db.create_table(
+            'employees', [('id', int, 'UNIQUE NOT NULL'), ('name', str), ('department_id', int), ('salary', float)], 'id',
+            foreign_keys={'department_id': {'table': 'departments', 'ref': 'id', 'mods': ''}})
+        db.run('ALTER TABLE employees ADD COLUMN salary REAL')
+        rows = db.tables['employees'].select('*', where={'id': 1})
+        assert rows == [{'id': 1, 'name': 'frank', 'department_id': 1, 'salary': None}], f"unexpected rows {rows}"
+        assert names(1) == [('frank',)]
+    def test_run_sqlite_result_cache_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            result_cache={'max_size': 100}
+            )
+        db.run('drop table employees')
+        db.run('drop table departments')
+        db.create_table('departments', [('id', int, 'UNIQUE NOT NULL'), ('name', str)], 'id')
+        db.create_table(
+            'employees', [('id', int, 'UNIQUE NOT NULL'), ('name', str), ('department_id', int)], 'id',
+            foreign_keys={'department_id': {'table': 'departments', 'ref': 'id', 'mods': 'ON DELETE CASCADE'}})
+        departments, employees = db.tables['departments'], db.tables['employees']
+        departments.insert_many([{'id': 1, 'name': 'hr'}, {'id': 2, 'name': 'it'}])
+        employees.insert_many([{'id': 1, 'name': 'frank', 'department_id': 1}, {'id': 2, 'name': 'jane', 'department_id': 2}])
+        stats = db.result_cache.stats
+
+        assert departments.select('*') == departments.select('*')
+        assert stats['hits'] == 1 and stats['misses'] == 1, f"unexpected stats {stats}"
+        assert departments[1] == 'hr'
+        db.run("UPDATE departments SET name = 'people' WHERE id = 1")
+        assert departments[1] == 'hr', "out of band writes are not seen until invalidated"
+        db.invalidate('departments')
+        assert departments[1] == 'people'
+
+        def joined():
+            return employees.select('employees.name', 'departments.name', join='departments', orderby='employees.id')
+        assert joined()[0] == {'employees.name': 'frank', 'departments.name': 'people'}
+        hits = stats['hits']
+        joined()
+        assert stats['hits'] == hits + 1, "expected a cached join"
+        departments.update(name='hr', where={'id': 1})
+        assert joined()[0]['departments.name'] == 'hr', "writes to a joined table should invalidate"
+        assert employees.count() == 2
+        departments.delete(where={'id': 2})
+        assert employees.count() == 1, "writes cascading to referencing tables should invalidate"
+
+        with db.transaction():
+            employees.insert(id=3, name='joe', department_id=1)
+            assert employees.count() == 2, "queries within a transaction are not cached"
+        assert employees.count() == 2
+        by_department = employees.prepare_select('name', where_columns=['department_id'], row_format='tuple')
+        assert by_department(1) == [('frank',), ('joe',)]
+        employees[4] = {'name': 'eli', 'department_id': 1}
+        assert by_department(1) == [('frank',), ('joe',), ('eli',)], "tb[key] = value should invalidate"
+        assert stats['invalidations'] > 0 and len(db.result_cache) > 0
+        db.invalidate()
+        assert len(db.result_cache) == 0, "db.invalidate() should clear the cache"
+    def test_run_sqlite_update_delete_many_test(self):
+        import sqlite3
+        db = data.Database(
+            sqlite3.connect, 
+            database="testdb",
+            result_cache=True
+            )
+        db.run('drop table stocks')
+        db.create_table('stocks', [('order_num', int, 'UNIQUE NOT NULL'), ('symbol', str), ('qty', int), ('price', float)], 'order_num')
+        stocks = db.tables['stocks']
+        stocks.enable_cache()
+        stocks.insert_many({'order_num': i, 'symbol': 'RHAT', 'qty': i, 'price': 1.0} for i in range(1, 101))
+        assert stocks[5] == {'order_num': 5, 'symbol': 'RHAT', 'qty': 5, 'price': 1.0}
+        assert stocks.count(where={'qty': 0}) == 0
+
+        result = stocks.update_many(
+            [{'order_num': i, 'qty': 0} for i in range(1, 51)] + [{'order_num': 51, 'qty': 0, 'price': 2.5}, {'order_num': 1000, 'qty': 0}],
+            batch_size=20)
+        assert result == {'updated': 51, 'batches': 5}, f"unexpected result {result}"
+        assert stocks[5] == {'order_num': 5, 'symbol': 'RHAT', 'qty': 0, 'price': 1.0}, "cached row should be updated"
+        assert stocks[51]['price'] == 2.5
+        assert stocks.count(where={'qty': 0}) == 51, "result cache should be invalidated"
+
+        result = stocks.delete_many(range(1, 61), batch_size=25)
+        assert result == {'deleted': 60, 'batches': 3}, f"unexpected result {result}"
+        assert stocks[5] is None, "cached row should be deleted"
+        assert stocks.count() == 40
+        assert stocks.delete_many([]) == {'deleted': 0, 'batches': 0}
+        # sqlite batches bind at most 999 keys, the SQLITE_MAX_VARIABLE_NUMBER of sqlite before 3.32
+        stocks.insert_many({'order_num': i, 'symbol': 'NTAP', 'qty': i, 'price': 1.0} for i in range(1000, 2500))
+        result = stocks.delete_many(range(1000, 2500))
+        assert result == {'deleted': 1500, 'batches': 2}, f"unexpected result {result}"
+        for invalid in [[{'qty': 1}], [{'order_num': 61}], [{'order_num': 61, 'missing': 1}]]:
+            try:
+                stocks.update_many(invalid)
+                assert False, f"expected InvalidInputError for {invalid}"
+            except data.InvalidInputError:
+                pass
+    def test_run_sqlite_schema_cache_test(self):
+        import sqlite3
+        db = data.Database(sqlite3.connect, database="testdb")
+        for i in range(5):
+            db.run(f'drop table schema_{i}')
+            db.create_table(f'schema_{i}', [('id', int, 'UNIQUE'), ('name', str), ('meta', dict)], 'id', indexes=['name'])
+        db.close()
+
+        db = data.Database(sqlite3.connect, database="testdb")
+        assert db.pool.stats['checkouts'] <= 2, f"tables should be loaded in 1 pass, {db.pool.stats['checkouts']} queries"
+
+        if os.path.exists('testdb_schema.json'):
+            os.remove('testdb_schema.json')
+        db = data.Database(sqlite3.connect, database="testdb", schema_cache='testdb_schema.json')
+        assert os.path.exists('testdb_schema.json'), "schema_cache should be written"
+        cached = data.Database(sqlite3.connect, database="testdb", schema_cache='testdb_schema.json')
+        for name in [f'schema_{i}' for i in range(5)]:
+            assert cached.tables[name].columns == db.tables[name].columns, "cached columns should match"
+            assert cached.tables[name].indexes == db.tables[name].indexes, "cached indexes should match"
+        assert cached.tables['schema_0'].columns['meta'].type == dict
+
+        db.run('drop table schema_4')
+        cached = data.Database(sqlite3.connect, database="testdb", schema_cache='testdb_schema.json')
+        assert not 'schema_4' in cached.tables, "schema changes should invalidate the schema_cache"
+        os.remove('testdb_schema.json')
+
+        lazy = data.Database(sqlite3.connect, database="testdb", lazy_tables=True)
+        assert lazy.tables.loaded() == [], "lazy tables should not be loaded at start"
+        assert 'schema_1' in lazy.tables and not 'schema_4' in lazy.tables
+        lazy.tables['schema_1'].insert(id=1, name='a', meta={'b': 1})
+        assert lazy.tables['schema_1'][1] == {'id': 1, 'name': 'a', 'meta': {'b': 1}}
+        assert [t.name for t in lazy.tables.loaded()] == ['schema_1'], "only accessed tables should be loaded"
+        assert len(lazy.tables) == len(db.tables) - 1
+    def test_run_sqlite_async_test(self):
+        try:
+            import aiosqlite
+        except ImportError:
+            self.skipTest("aiosqlite is not installed")
+        import asyncio
+        async def run():
+            db = await data.AsyncDatabase.create(aiosqlite.connect, database="testdb", pool_max_size=4)
+            await db.run('drop table async_stocks')
+            await db.create_table(
+                'async_stocks', 
+                [('order_num', int, 'AUTOINCREMENT'), ('symbol', str), ('qty', int), ('trans', dict)], 
+                'order_num'
+            )
+            stocks = db.tables['async_stocks']
+            assert isinstance(stocks, data.AsyncTable), "expected an AsyncTable"
+            await stocks.insert(symbol='RHAT', qty=100, trans={'type': 'BUY'})
+            result = await stocks.insert_many(
+                [{'symbol': 'NTAP', 'qty': i} for i in range(10)], batch_size=4, return_keys=True)
+            assert result['inserted'] == 10 and result['keys'] == list(range(2, 12)), f"unexpected insert_many result {result}"
+
+            rows = await stocks.select('*', where={'symbol': 'RHAT'})
+            assert rows == [{'order_num': 1, 'symbol': 'RHAT', 'qty': 100, 'trans': {'type': 'BUY'}}], f"unexpected rows {rows}"
+            counts = await asyncio.gather(*[stocks.select('order_num', where={'symbol': 'NTAP'}) for _ in range(8)])
+            assert all(len(c) == 10 for c in counts), "concurrent selects should each return 10 rows"
+            assert db.pool.stats['created'] <= 4, "pool should not exceed pool_max_size"
+            assert len([row async for row in stocks]) == 11, "expected 11 rows from async for"
+
+            await stocks.update(qty=5, where={'order_num': 1})
+            assert (await stocks[1])['qty'] == 5, "update failed"
+            try:
+                async with db.transaction():
+                    await stocks.delete(where={'symbol': 'NTAP'})
+                    raise Exception("rollback")
+            except Exception:
+                pass
+            assert len(await stocks.select('order_num')) == 11, "transaction should be rolled back"
+            await stocks.delete(where=[['qty', '<', 5]])
+            assert not await stocks.contains(2), "order 2 should be deleted"
+            result = await stocks.update_many([{'order_num': i, 'qty': 0} for i in range(7, 12)], batch_size=2)
+            assert result == {'updated': 5, 'batches': 3}, f"unexpected update_many result {result}"
+            result = await stocks.delete_many(range(7, 12))
+            assert result == {'deleted': 5, 'batches': 1}, f"unexpected delete_many result {result}"
+            for method in [lambda: db.submit('SELECT 1'), lambda: db.executor, lambda: stocks.select_async_futures('*')]:
+                with self.assertRaises(data.InvalidInputError):
+                    method()
+            await db.close()
+        asyncio.run(run())
         
 
 def test(db):
@@ -73,6 +992,10 @@ def test(db):
     )
     print(db.tables['stocks'].columns)
     assert 'stocks' in db.tables, "table creation failed"
+    # mysql indexes str (TEXT) columns by a prefix
+    assert db.tables['stocks'].create_index(['symbol', ('trans', 16), 'qty']) == 'idx_stocks_symbol_trans_qty'
+    assert 'idx_stocks_symbol_trans_qty' in db.tables['stocks'].indexes, "index creation failed"
+    db.tables['stocks'].drop_index('idx_stocks_symbol_trans_qty')
 
 
     db.run('drop table employees')
@@ -16,6 +16,7 @@ setuptools.setup(
          "License :: OSI Approved :: MIT License",
          "Operating System :: OS Independent",
      ],
-     python_requires='>=3.4, <4',
+     python_requires='>=3.7, <4',
      install_requires=['mysql-connector-python'],
+     extras_require={'numpy': ['numpy']},
  )
\ No newline at end of file